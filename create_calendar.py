@@ -13,6 +13,7 @@ Output: data/dim_calendar.parquet
 import os
 import pandas as pd
 from datetime import timedelta
+from utils.write_parquet_utils import write_parquet
 
 # Output configuration
 OUTPUT_DIR = os.getenv("DATA_DIR", "data")
@@ -88,7 +89,7 @@ print(f"Calendar dimension created: {len(df)} days from {df['DateDay'].min()} to
 # ========================================
 # SAVE OUTPUT
 # ========================================
-df.to_parquet(OUTPUT_FILE, index=False)
+write_parquet(df, OUTPUT_FILE)
 print(f"Calendar dimension stored at: {OUTPUT_FILE}")
 
 # ========================================
@@ -2,49 +2,311 @@
 DuckDB Data Warehouse Builder
 
 Creates/updates the DuckDB database from parquet files:
-1. Backs up existing database
+1. Backs up the existing database (Parquet snapshot, or a file copy with DWH_BACKUP=copy)
 2. Cleans up old backups
 3. Connects with retry logic (handles locks from BI tools)
-4. Loads parquet files as tables
+4. Loads parquet files as tables, skipping those whose file is unchanged
+   since the last load (meta.load_manifest; --full-refresh reloads all),
+   sorted and indexed per table_load_specs (tables with a primary_key get
+   only their new, changed and deleted rows applied), labels as ENUMs and
+   flags/codes narrowed per utils/dtype_utils.py
+5. Refreshes the materialized rollups (rollup_definitions) of reloaded tables
+   and of Parquet views whose file changed,
+   recomputing only the months whose rows changed (--check-rollups compares
+   them with a full recompute)
+
+`python create_duckdb.py --benchmark` times the typical dashboard filters on
+plain vs sorted/indexed copies of the tables in table_load_specs.
+
+Build-then-swap mode (DWH_PUBLISH=swap): instead of rewriting the live file
+under Metabase's feet, the next warehouse is built in empower_mx_dwh.next.duckdb
+(seeded from the live file, so unchanged tables carry over), validated against
+the Parquet row counts, and renamed over the live file in one atomic step.
+Readers never see a half-built database and the build never waits for their
+lock. With DWH_BACKUP=copy the previous version is kept through a hard link.
+
+UTC-only mode (DWH_UTC_ONLY=1): base tables keep only the UTC timestamps (in
+the `utc` schema) and each table name is a view that recomputes the *CDMX
+columns and month truncations, so Metabase queries are unchanged
+(see utils/dwh_utils.py).
+
+Backups (DWH_BACKUP=snapshot, the default): before the build changes anything,
+each table of the current warehouse is snapshotted as zstd Parquet under
+db/snapshots/, unchanged tables hard-linked to the previous snapshot, so a bad
+build never replaces the last good restore point; daily/weekly retention
+(see utils/snapshot_utils.py; restore with `python -m utils.snapshot_utils restore`).
+DWH_BACKUP=copy keeps the previous full-file copy instead.
 
 Output: db/empower_mx_dwh.duckdb
 """
 
 import duckdb
+import os
 import shutil
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
+from utils.dwh_utils import (
+    PARQUET_VIEW_MODE, STORAGE_SCHEMA, benchmark_load_specs, configure, create_clustered_table,
+    create_parquet_view, drop_relation, forget_loads, is_unchanged, list_relations, load_utc_only,
+    parquet_source_sql, parquet_stats, publish_swap, read_manifest, record_load, source_state, upsert_table,
+    validate_warehouse,
+)
+from utils.dtype_utils import policy_sha256, typed_source_sql
+from utils.rollup_utils import check_rollup, decimal_sum, forget_rollups, is_current, refresh_rollup
+from utils.snapshot_utils import prune_snapshots, take_snapshot
 
 # Define paths
 DATA_DIR = Path(__file__).parent / "data"
 DB_DIR = Path(__file__).parent / "db"
 DB_PATH = DB_DIR / "empower_mx_dwh.duckdb"
+NEXT_DB_PATH = DB_DIR / "empower_mx_dwh.next.duckdb"
+
+UTC_ONLY = os.getenv("DWH_UTC_ONLY", "0") == "1"
+LOAD_MODE = "utc_only" if UTC_ONLY else "table"
+FULL_REFRESH = "--full-refresh" in sys.argv
+SWAP = os.getenv("DWH_PUBLISH", "inplace") == "swap"
+BACKUP = os.getenv("DWH_BACKUP", "snapshot")  # snapshot | copy
+
+# Load concurrency and DuckDB resources (unset: DuckDB defaults)
+LOAD_WORKERS = int(os.getenv("DWH_LOAD_WORKERS", "4"))
+DUCKDB_THREADS = os.getenv("DWH_DUCKDB_THREADS")
+DUCKDB_MEMORY_LIMIT = os.getenv("DWH_DUCKDB_MEMORY_LIMIT")
+DUCKDB_TEMP_DIRECTORY = os.getenv("DWH_DUCKDB_TEMP_DIRECTORY")
+PRESERVE_INSERTION_ORDER = os.getenv("DWH_PRESERVE_INSERTION_ORDER")
+
+# ========================================
+# TABLES
+# ========================================
+# Map parquet files to their corresponding table names
+# Fact tables: transactional data (loans, collections)
+# Dim tables: reference/lookup data (calendar, experiments, users)
+# Analytics tables: raw data from external systems (Arcus), kept as append-only
+# month-partitioned datasets (directories, see utils/dataset_utils.py): filters
+# on their date_month / creation_date_month column skip whole files
+parquet_table_map = {
+    "loan.parquet": "fact_loan",
+    "collections_strategies.parquet": "fact_collections_strategies",
+    "dim_calendar.parquet": "dim_calendar",
+    "arcus_payments_raw": "analytics_arcus_payments",
+    "arcus_transactions_raw": "analytics_arcus_transactions",
+    "arcus_transactions.parquet": "dim_arcus_transactions",
+    "experiments.parquet": "dim_user_experiment",
+    "dispute.parquet": "dim_loan_dispute",
+    "referrals_transactions.parquet": "dim_referral_transactions",
+    "offers.parquet": "dim_user_analytics",
+    "referrals_arcus_payouts.parquet": "dim_referral_arcus_payouts",
+    "arcus_disbursements.parquet": "analytics_arcus_disbursements",
+    "growth_data.parquet": "dim_growth_data"
+}
+
+# Tables published as views over their Parquet file instead of being copied
+# into DuckDB (no load step; DuckDB prunes row groups at query time).
+# DWH_PARQUET_VIEWS=table1,table2 overrides this; "all" selects every table.
+parquet_view_tables = set()
+if os.getenv("DWH_PARQUET_VIEWS") is not None:
+    parquet_view_tables = {name.strip() for name in os.getenv("DWH_PARQUET_VIEWS").split(",") if name.strip()}
+if "all" in parquet_view_tables:
+    parquet_view_tables = set(parquet_table_map.values())
+
+# Month truncations published by the views of UTC-only mode and by Parquet
+# views (same names as load_accounting_data.py)
+view_derived_columns = {
+    "fact_loan": {
+        "IssueMonth": "date_trunc('month', IssueDate)",
+        "IssueMonthCDMX": "date_trunc('month', IssueDateCDMX)",
+        "SettledAtMonth": "date_trunc('month', SettledAt)",
+        "SettledAtMonthCDMX": "date_trunc('month', SettledAtCDMX)",
+        "DueDateMonth": "date_trunc('month', DueDate)",
+    },
+}
+
+# Load specs: rows are sorted on the ORDER BY key so DuckDB's per-row-group
+# min/max can skip most of the table for the dashboard date filters, and ART
+# indexes serve point lookups. Ignored for Parquet views.
+# With a primary_key, a changed file is applied as an upsert (only new,
+# changed and, with deletes, vanished rows are written) instead of a full
+# rewrite; --full-refresh rewrites (and re-sorts) it. Table mode only. The
+# primary_key is the grain of the file and must be unique in it, otherwise the
+# table is reloaded in full.
+table_load_specs = {
+    "fact_loan": {
+        "order_by": ["IssueDateCDMX", "DueDate"],
+        "indexes": ["UserId"],
+        # One row per loan and Pypper late strategy (strategy_utils merges every
+        # late strategy row of the loan), NULL when it has none
+        "primary_key": ["UserLoanId", "LateStrategyCreatedAt"],
+        "deletes": True,
+    },
+    "dim_arcus_transactions": {
+        "order_by": ["CreatedAtCDMX"],
+        "indexes": ["UserLoanId"],
+        "primary_key": ["ArcusTransactionId", "UserLoanId"],
+        "deletes": True,
+    },
+}
+
+# Materialized monthly rollups of fact_loan for the dashboards (same measures as
+# load_accounting_data.py). Refreshed after the loads, recomputing only the
+# months whose source rows changed (see utils/rollup_utils.py).
+APPORTIONED_AMOUNT_PAID = (
+    "CASE WHEN TotalAmountPaid > TotalAmountDue THEN round(TotalAmountDue, 2) ELSE round(TotalAmountPaid, 2) END"
+)
+DPD_BUCKET = """CASE
+    WHEN LoanStatus = 2 THEN 'Settled'
+    WHEN DaysLate <= 0 THEN 'Current'
+    WHEN DaysLate <= 30 THEN '1-30'
+    WHEN DaysLate <= 60 THEN '31-60'
+    WHEN DaysLate <= 90 THEN '61-90'
+    ELSE '90+'
+END"""
+rollup_definitions = {
+    "rollup_loan_origination_monthly": {
+        "source": "fact_loan",
+        "month": "date_trunc('month', IssueDateCDMX)",
+        "where": "LoanStatus != 6",
+        "dimensions": {"LoanCohort": "LoanCohort", "CreditPolicyName": "CreditPolicyName"},
+        "measures": {
+            "Loans": "count(*)",
+            **{
+                column: decimal_sum(column)
+                for column in ["PrincipalAmount", "Fee", "TaxOnFee", "LateFee", "TaxOnLateFee", "TotalAmountDue",
+                               "PrincipalPaid", "FeePaid", "TaxOnFeePaid", "LateFeePaid", "TaxOnLateFeePaid"]
+            },
+            "ApportionedAmountPaid": decimal_sum(APPORTIONED_AMOUNT_PAID),
+        },
+    },
+    "rollup_loan_settled_monthly": {
+        "source": "fact_loan",
+        "month": "date_trunc('month', SettledAtCDMX)",
+        "where": "LoanStatus != 6",
+        "dimensions": {"LoanCohort": "LoanCohort"},
+        "measures": {
+            "Loans": "count(*)",
+            **{
+                column: decimal_sum(column)
+                for column in ["PrincipalPaid", "FeePaid", "TaxOnFeePaid", "LateFeePaid", "TaxOnLateFeePaid",
+                               "DisputeAmount"]
+            },
+            "ApportionedAmountPaid": decimal_sum(APPORTIONED_AMOUNT_PAID),
+        },
+    },
+    "rollup_loan_dpd_monthly": {
+        "source": "fact_loan",
+        "month": "date_trunc('month', DueDate)",
+        "where": "LoanStatus != 6",
+        "dimensions": {"DPDBucket": DPD_BUCKET, "LoanCohort": "LoanCohort"},
+        "measures": {
+            "Loans": "count(*)",
+            "TotalAmountDue": decimal_sum("TotalAmountDue"),
+            "TotalAmountPaid": decimal_sum("TotalAmountPaid"),
+            "OutstandingAmount": decimal_sum("greatest(TotalAmountDue - coalesce(TotalAmountPaid, 0), 0)"),
+        },
+    },
+    # Cohort curve: loans of each issue month by how many months later they settled (NULL: not yet)
+    "rollup_loan_cohort_curve": {
+        "source": "fact_loan",
+        "month": "date_trunc('month', IssueDateCDMX)",
+        "where": "LoanStatus != 6",
+        "dimensions": {
+            "LoanCohort": "LoanCohort",
+            "MonthsToSettle": "date_diff('month', date_trunc('month', IssueDateCDMX), date_trunc('month', SettledAtCDMX))",
+        },
+        "measures": {
+            "Loans": "count(*)",
+            "PrincipalAmount": decimal_sum("PrincipalAmount"),
+            "TotalAmountPaid": decimal_sum("TotalAmountPaid"),
+        },
+    },
+}
+
+# Typical Metabase filters, timed by --benchmark ({placeholders} from benchmark_params)
+benchmark_queries = {
+    "fact_loan issued last 30 days": (
+        "SELECT count(*), sum(PrincipalAmount) FROM fact_loan WHERE IssueDateCDMX >= '{recent_issue}'"
+    ),
+    "fact_loan due in one month": (
+        "SELECT LoanStatusDescription, count(*) FROM fact_loan "
+        "WHERE DueDate >= '{due_month}' AND DueDate < '{due_month}'::TIMESTAMP + INTERVAL 1 MONTH GROUP BY 1"
+    ),
+    "fact_loan one user": "SELECT * FROM fact_loan WHERE UserId = '{user_id}'",
+    "dim_arcus_transactions last 7 days": (
+        "SELECT count(*), sum(Amount) FROM dim_arcus_transactions WHERE CreatedAtCDMX >= '{recent_arcus}'"
+    ),
+    "dim_arcus_transactions one loan": "SELECT * FROM dim_arcus_transactions WHERE UserLoanId = '{user_loan_id}'",
+}
+benchmark_params = {
+    "recent_issue": "SELECT max(IssueDateCDMX) - INTERVAL 30 DAY FROM fact_loan",
+    "due_month": "SELECT date_trunc('month', median(DueDate)) FROM fact_loan",
+    "user_id": "SELECT min(UserId) FROM fact_loan",
+    "recent_arcus": "SELECT max(CreatedAtCDMX) - INTERVAL 7 DAY FROM dim_arcus_transactions",
+    "user_loan_id": "SELECT min(UserLoanId) FROM dim_arcus_transactions",
+}
+
+if "--benchmark" in sys.argv:
+    # Plain vs clustered copies of the spec'd tables; the warehouse is not touched
+    benchmark_load_specs(
+        {
+            table_name: DATA_DIR / parquet_file
+            for parquet_file, table_name in parquet_table_map.items()
+            if table_name in table_load_specs
+        },
+        table_load_specs,
+        benchmark_queries,
+        benchmark_params,
+    )
+    sys.exit(0)
+
 
 # Ensure the db folder exists
 DB_DIR.mkdir(parents=True, exist_ok=True)
 
-# STEP 1: Snapshot old DB before overwriting
-if DB_PATH.exists():
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_path = DB_DIR / f"empower_mx_dwh_backup_{timestamp}.duckdb"
+timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+backup_path = DB_DIR / f"empower_mx_dwh_backup_{timestamp}.duckdb"
+
+# STEP 1: Snapshot old DB before overwriting (swap mode: seed the next build instead)
+had_database = DB_PATH.exists()
+if SWAP:
+    for stale in (NEXT_DB_PATH, NEXT_DB_PATH.with_name(NEXT_DB_PATH.name + ".wal")):
+        stale.unlink(missing_ok=True)
+    if DB_PATH.exists():
+        shutil.copy(DB_PATH, NEXT_DB_PATH)
+        print(f"🏗️ Building next warehouse in: {NEXT_DB_PATH}")
+elif DB_PATH.exists() and BACKUP == "copy":
     shutil.copy(DB_PATH, backup_path)
     print(f"📦 Backup created at: {backup_path}")
 
-# STEP 2: Cleanup old backups (keep only latest)
-backups = sorted(DB_DIR.glob("empower_mx_dwh_backup_*.duckdb"), reverse=True)
-for old_backup in backups[1:]:
-    old_backup.unlink()
-    print(f"🧹 Deleted old backup: {old_backup.name}")
-    
-# STEP 3: Try connecting with retry logic in case of lock
+
+def timed(function, *args):
+    """(function(*args), seconds taken)."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def cleanup_backups():
+    """Keep only the latest backup."""
+    backups = sorted(DB_DIR.glob("empower_mx_dwh_backup_*.duckdb"), reverse=True)
+    for old_backup in backups[1:]:
+        old_backup.unlink()
+        print(f"🧹 Deleted old backup: {old_backup.name}")
+
+
+# STEP 2: Cleanup old backups (swap mode: after publishing)
+if not SWAP and BACKUP == "copy":
+    cleanup_backups()
+
+# STEP 3: Try connecting with retry logic in case of lock (the next build has no readers)
+build_path = NEXT_DB_PATH if SWAP else DB_PATH
 MAX_RETRIES = 5
 WAIT_SECONDS = 2
 con = None
 
 for attempt in range(MAX_RETRIES):
     try:
-        con = duckdb.connect(DB_PATH.as_posix())
+        con = duckdb.connect(build_path.as_posix())
         print("✅ Connected to DuckDB")
         break
     except duckdb.IOException as e:
@@ -57,46 +319,204 @@ for attempt in range(MAX_RETRIES):
 if con is None:
     raise RuntimeError("❌ Could not connect to DuckDB due to a persistent lock.")
 
-# STEP 4: Load parquet files into DuckDB
-# Map parquet files to their corresponding table names
-# Fact tables: transactional data (loans, collections)
-# Dim tables: reference/lookup data (calendar, experiments, users)
-# Analytics tables: raw data from external systems (Arcus)
-parquet_table_map = {
-    "loan.parquet": "fact_loan",
-    "collections_strategies.parquet": "fact_collections_strategies",
-    "dim_calendar.parquet": "dim_calendar",
-    "arcus_payments_raw.parquet": "analytics_arcus_payments",
-    "arcus_transactions_raw.parquet": "analytics_arcus_transactions",
-    "arcus_transactions.parquet": "dim_arcus_transactions",
-    "experiments.parquet": "dim_user_experiment",
-    "dispute.parquet": "dim_loan_dispute",
-    "referrals_transactions.parquet": "dim_referral_transactions",
-    "offers.parquet": "dim_user_analytics",
-    "referrals_arcus_payouts.parquet": "dim_referral_arcus_payouts",
-    "arcus_disbursements.parquet": "analytics_arcus_disbursements",
-    "growth_data.parquet": "dim_growth_data"
-}
+# Snapshot the current warehouse before anything changes (swap mode: its copy)
+if BACKUP == "snapshot" and had_database:
+    take_snapshot(con)
+    prune_snapshots()
 
-# Drop existing tables that are not in the new map
-existing_tables = [row[0] for row in con.execute("SHOW TABLES").fetchall()]
-desired_tables = list(parquet_table_map.values())
+configure(
+    con,
+    threads=DUCKDB_THREADS,
+    memory_limit=DUCKDB_MEMORY_LIMIT,
+    temp_directory=DUCKDB_TEMP_DIRECTORY,
+    preserve_insertion_order=None if PRESERVE_INSERTION_ORDER is None else PRESERVE_INSERTION_ORDER == "1",
+)
+
+# STEP 4: Load parquet files into DuckDB (tables configured above)
+# Drop existing tables (or views) that are not in the new map
+existing_tables = list_relations(con)
+desired_tables = list(parquet_table_map.values()) + list(rollup_definitions)
 tables_to_drop = set(existing_tables) - set(desired_tables)
 
 for table in tables_to_drop:
-    con.execute(f"DROP TABLE {table}")
+    drop_relation(con, table)
     print(f"🗑️ Dropped outdated table: {table}")
 
-# Load and replace each table
+manifest = read_manifest(con)
+forget_loads(con, set(manifest) - set(desired_tables))
+
+# UTC storage tables only back the views of UTC-only mode
+stored_tables = list_relations(con, STORAGE_SCHEMA)
+for table in stored_tables:
+    if not UTC_ONLY or table not in desired_tables:
+        drop_relation(con, table, STORAGE_SCHEMA)
+
+
+
+def table_load_mode(table_name):
+    """
+    Load mode recorded in the manifest; it includes the type policy and the load
+    spec, so changing either reloads the table.
+    """
+    if table_name in parquet_view_tables:
+        return PARQUET_VIEW_MODE
+    mode = f"{LOAD_MODE};types={policy_sha256()}"
+    spec = table_load_specs.get(table_name)
+    if not spec:
+        return mode
+    return (
+        f"{mode};order_by={','.join(spec.get('order_by', []))};indexes={','.join(spec.get('indexes', []))}"
+        f";primary_key={','.join(spec.get('primary_key', []))};deletes={spec.get('deletes', False)}"
+    )
+
+
+def load_table(cursor, parquet_path, table_name, upsert=False):
+    """
+    Load one Parquet file as table_name on its own cursor.
+    Returns (dropped CDMX columns, rows, upsert counts or None for a full load).
+    """
+    spec = table_load_specs.get(table_name, {})
+    try:
+        dropped, changes = [], None
+        if table_load_mode(table_name) != PARQUET_VIEW_MODE:
+            # Labels as ENUMs (keeping the label order of the table being replaced),
+            # flags and codes narrowed (utils/dtype_utils.py)
+            previous = table_name if table_name in existing_tables else None
+            source_sql = typed_source_sql(cursor, parquet_source_sql(parquet_path), previous=previous)
+        if upsert:
+            changes = upsert_table(cursor, table_name, source_sql, spec["primary_key"], spec.get("deletes", False))
+            if changes is None:
+                print(f"⚠️ {table_name}: reloading the whole table")
+        if changes is not None:
+            pass  # upserted into the existing table
+        elif table_load_mode(table_name) == PARQUET_VIEW_MODE:
+            create_parquet_view(
+                cursor, table_name, parquet_path,
+                derived_columns=view_derived_columns.get(table_name),
+            )
+        elif UTC_ONLY:
+            dropped = load_utc_only(
+                cursor, table_name, source_sql,
+                derived_columns=view_derived_columns.get(table_name),
+                order_by=spec.get("order_by"),
+                indexes=spec.get("indexes"),
+            )
+        else:
+            # Create or replace table from Parquet (a view left by another mode is dropped first)
+            create_clustered_table(cursor, table_name, source_sql, spec.get("order_by"), spec.get("indexes"))
+        rows = cursor.execute(f"SELECT count(*) FROM {table_name}").fetchone()[0]
+        return dropped, rows, changes
+    finally:
+        cursor.close()
+
+
+# Find the tables whose Parquet file changed
+reloaded, skipped, pending = [], [], []
+changed_views = []  # Parquet views left in place whose file changed: their rollups still refresh
 for parquet_file, table_name in parquet_table_map.items():
     parquet_path = DATA_DIR / parquet_file
-    print(f"Loading {parquet_path} into table '{table_name}'...")
-    
-    # Create or replace table from Parquet
-    con.execute(f"""
-        CREATE OR REPLACE TABLE {table_name} AS
-        SELECT * FROM '{parquet_path.as_posix()}'
-    """)
+    load_mode = table_load_mode(table_name)
+    previous = manifest.get(table_name)
+    state = source_state(parquet_path, previous, hash_content=load_mode != PARQUET_VIEW_MODE)
+    if not FULL_REFRESH and table_name in existing_tables and is_unchanged(previous, state, load_mode):
+        skipped.append(table_name)
+        if (previous["size_bytes"], previous["mtime"]) != (state["size_bytes"], state["mtime"]):
+            if load_mode == PARQUET_VIEW_MODE:
+                changed_views.append(table_name)
+            record_load(con, table_name, state, load_mode)  # rewritten (same content, or read in place)
+        continue
+    # Same spec as the stored table: apply the new file as an upsert
+    upsert = (
+        not FULL_REFRESH
+        and not UTC_ONLY
+        and "primary_key" in table_load_specs.get(table_name, {})
+        and load_mode != PARQUET_VIEW_MODE
+        and table_name in existing_tables
+        and previous is not None
+        and previous["load_mode"] == load_mode
+    )
+    pending.append((parquet_path, table_name, state, upsert))
+
+# Load them concurrently, one cursor per table, biggest files first so the
+# fact tables start right away and the small dims fill the other workers
+pending.sort(key=lambda item: item[2]["size_bytes"], reverse=True)
+if UTC_ONLY and pending:
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {STORAGE_SCHEMA}")
+
+started = time.perf_counter()
+with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+    futures = {}
+    for parquet_path, table_name, state, upsert in pending:
+        print(f"{'Upserting' if upsert else 'Loading'} {parquet_path} into table '{table_name}'...")
+        future = executor.submit(timed, load_table, con.cursor(), parquet_path, table_name, upsert)
+        futures[future] = (parquet_path, table_name, state)
+
+    for future in as_completed(futures):
+        parquet_path, table_name, state = futures[future]
+        (dropped, rows, changes), seconds = future.result()
+        record_load(con, table_name, state, table_load_mode(table_name))
+        reloaded.append(table_name)
+        _, file_bytes, uncompressed_bytes = parquet_stats(parquet_path)
+        action = "view over" if table_load_mode(table_name) == PARQUET_VIEW_MODE else "loaded from"
+        if changes is not None:
+            action = f"+{changes['inserted']:,} / ~{changes['updated']:,} / -{changes['deleted']:,} upserted from"
+        print(
+            f"📥 {table_name}: {rows:,} rows, {action} {file_bytes / 1024 ** 2:.1f} MB parquet "
+            f"({uncompressed_bytes / 1024 ** 2:.1f} MB uncompressed) in {seconds:.1f}s"
+        )
+        if dropped:
+            print(f"🕒 {table_name}: {len(dropped)} CDMX columns computed by the view")
+if pending:
+    print(f"⏱️ Loaded {len(pending)} tables in {time.perf_counter() - started:.1f}s with {LOAD_WORKERS} workers")
+
+print(f"\n♻️ Reloaded {len(reloaded)} tables: {', '.join(reloaded) or '-'}")
+print(f"⏭️ Unchanged, skipped {len(skipped)} tables: {', '.join(skipped) or '-'}")
+if changed_views:
+    print(f"👀 Views over a changed file: {', '.join(changed_views)}")
 
+# STEP 5: Refresh the rollups whose source table was reloaded or whose source
+# view reads a changed file (only changed months)
+forget_rollups(con, rollup_definitions)
+for rollup_name, definition in rollup_definitions.items():
+    source_changed = definition["source"] in reloaded or definition["source"] in changed_views
+    if not source_changed and not FULL_REFRESH and is_current(con, rollup_name, definition):
+        continue
+    report = refresh_rollup(con, rollup_name, definition, full=FULL_REFRESH)
+    print(
+        f"📊 {rollup_name}: {report['mode']}, {report['recomputed']}/{report['months']} months recomputed, "
+        f"{report['rows']:,} rows in {report['seconds']:.2f}s"
+    )
+
+if "--check-rollups" in sys.argv:
+    for rollup_name, definition in rollup_definitions.items():
+        differences = check_rollup(con, rollup_name, definition)
+        print(f"{'✅' if differences == 0 else '❌'} {rollup_name}: {differences} rows differ from a full recompute")
+
+if SWAP:
+    # STEP 6: Validate the next build (live file untouched on failure)
+    expected_rows = {
+        table_name: parquet_stats(DATA_DIR / parquet_file)[0]
+        for parquet_file, table_name in parquet_table_map.items()
+    }
+    problems = validate_warehouse(con, expected_rows)
+    if problems:
+        con.close()
+        raise RuntimeError(
+            f"❌ Validation failed, {DB_PATH.name} left unchanged ({NEXT_DB_PATH.name} kept for inspection):\n  "
+            + "\n  ".join(problems)
+        )
+    print(f"🔎 Validated {len(expected_rows)} tables")
+
+con.execute("CHECKPOINT")
 con.close()
-print(f"\n✅ DuckDB created at: {DB_PATH}")
\ No newline at end of file
+
+if SWAP:
+    # STEP 7: Swap it in (DWH_BACKUP=copy: the previous version becomes the backup)
+    had_previous = DB_PATH.exists()
+    publish_swap(NEXT_DB_PATH, DB_PATH, backup_path if BACKUP == "copy" else None)
+    if had_previous and BACKUP == "copy":
+        print(f"📦 Previous version kept at: {backup_path}")
+        cleanup_backups()
+    print(f"\n✅ DuckDB published at: {DB_PATH}")
+else:
+    print(f"\n✅ DuckDB created at: {DB_PATH}")
@@ -9,18 +9,34 @@ Connection features:
 - Azure Active Directory password authentication
 - Encrypted connection with server certificate validation disabled
 - Uses ODBC Driver 18 for SQL Server
+- One pooled engine per process, reused by every query and disposed at exit
+
+Pool settings (optional, .env):
+- DB_POOL_SIZE (default 5), DB_MAX_OVERFLOW (default 5)
+- DB_POOL_RECYCLE seconds (default 1800), DB_POOL_PRE_PING (default true)
+
+Azure AD token caching (optional):
+If azure-identity is installed and DB_AZURE_CLIENT_ID is set, an access token
+is requested once with DB_UID/DB_PASSWORD and handed to every new connection
+until it is about to expire, instead of the driver doing the
+ActiveDirectoryPassword exchange on each connect. DB_AZURE_TENANT_ID defaults
+to "organizations".
 
 Usage:
     from db_connection import get_db_connection
-    
+
     engine = get_db_connection()
     with engine.connect() as conn:
         result = conn.execute("SELECT * FROM my_table")
 """
 
 from dotenv import load_dotenv
+import atexit
 import os
-from sqlalchemy import create_engine
+import struct
+import threading
+import time
+from sqlalchemy import create_engine, event
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -31,6 +47,28 @@ db_database = os.getenv("DB_DATABASE")
 db_uid = os.getenv("DB_UID")
 db_password = os.getenv("DB_PASSWORD")
 
+# Pool configuration
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Azure AD token configuration
+AZURE_CLIENT_ID = os.getenv("DB_AZURE_CLIENT_ID")
+AZURE_TENANT_ID = os.getenv("DB_AZURE_TENANT_ID", "organizations")
+AZURE_SQL_SCOPE = "https://database.windows.net/.default"
+# Refresh the token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+# ODBC connection attribute used to pass an access token (msodbcsql.h)
+SQL_COPT_SS_ACCESS_TOKEN = 1256
+
+try:
+    from azure.identity import UsernamePasswordCredential
+except ImportError:
+    UsernamePasswordCredential = None
+
+USE_ACCESS_TOKEN = UsernamePasswordCredential is not None and bool(AZURE_CLIENT_ID)
+
 # Build SQLAlchemy connection string for Azure SQL Server
 # - driver: ODBC Driver 18 for SQL Server (required for Azure)
 # - Encrypt=yes: Force encrypted connection
@@ -39,7 +77,83 @@ db_password = os.getenv("DB_PASSWORD")
 # - Authentication=ActiveDirectoryPassword: Use Azure AD authentication
 connection_string = f"mssql+pyodbc://{db_uid}:{db_password}@{db_server}/{db_database}?driver=ODBC+Driver+18+for+SQL+Server&Encrypt=yes&TrustServerCertificate=no&ApplicationIntent=READONLY&Authentication=ActiveDirectoryPassword"
 
+# With a cached access token the driver must not receive UID/PWD/Authentication
+token_connection_string = f"mssql+pyodbc://@{db_server}/{db_database}?driver=ODBC+Driver+18+for+SQL+Server&Encrypt=yes&TrustServerCertificate=no&ApplicationIntent=READONLY"
+
+_lock = threading.Lock()
+_engine = None
+_engine_pid = None
+_credential = None
+_token = None
+
+
+def _get_access_token():
+    """Return a cached Azure AD access token for Azure SQL, refreshing it near expiry."""
+    global _credential, _token
+
+    with _lock:
+        if _token is None or _token.expires_on - TOKEN_REFRESH_MARGIN <= time.time():
+            if _credential is None:
+                _credential = UsernamePasswordCredential(
+                    client_id=AZURE_CLIENT_ID,
+                    username=db_uid,
+                    password=db_password,
+                    tenant_id=AZURE_TENANT_ID,
+                )
+            _token = _credential.get_token(AZURE_SQL_SCOPE)
+            print("🔑 Azure AD access token refreshed.")
+        return _token.token
+
+
+def _attach_access_token(dialect, conn_rec, cargs, cparams):
+    # Hand the cached token to the ODBC driver for every new pooled connection
+    token_bytes = _get_access_token().encode("utf-16-le")
+    token_struct = struct.pack(f"<I{len(token_bytes)}s", len(token_bytes), token_bytes)
+    cparams.setdefault("attrs_before", {})[SQL_COPT_SS_ACCESS_TOKEN] = token_struct
+
+
+def _create_engine():
+    engine = create_engine(
+        token_connection_string if USE_ACCESS_TOKEN else connection_string,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=POOL_PRE_PING,
+    )
+    if USE_ACCESS_TOKEN:
+        event.listen(engine, "do_connect", _attach_access_token)
+    return engine
+
+
 # Function to return the database connection
 def get_db_connection():
-    engine = create_engine(connection_string)
-    return engine
\ No newline at end of file
+    """
+    Return the process-wide pooled engine, creating it on first use.
+
+    Callers must not dispose it. A forked child process gets its own engine
+    (the parent's pooled connections are left untouched).
+    """
+    global _engine, _engine_pid
+
+    with _lock:
+        if _engine is not None and _engine_pid != os.getpid():
+            _engine.dispose(close=False)
+            _engine = None
+        if _engine is None:
+            _engine = _create_engine()
+            _engine_pid = os.getpid()
+        return _engine
+
+
+def dispose_db_connection():
+    """Close every pooled connection. Registered to run at interpreter exit."""
+    global _engine
+
+    with _lock:
+        if _engine is not None and _engine_pid == os.getpid():
+            _engine.dispose()
+            print("✅ Database connection closed.")
+        _engine = None
+
+
+atexit.register(dispose_db_connection)
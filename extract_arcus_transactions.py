@@ -1,12 +1,13 @@
-from utils.fetch_data_utils import fetch_data
+from utils.dtype_utils import apply_type_policy
+from utils.fetch_data_utils import fetch_data_to_parquet
+from utils.timezone_utils import add_cdmx_columns
 import pandas as pd
 import numpy as np
 from datetime import datetime
 
+OUTPUT_FILE = "data/arcus_transactions.parquet"
 
-print("Start pulling data from db:")
-
-arcus = fetch_data("""
+ARCUS_TRANSACTIONS_QUERY = """
 select
     ar.ArcusTransactionId,
     ar.ExternalId,
@@ -36,37 +37,30 @@ select
     ar.TrackingId,
     case when ua.ArcusTransactionId is not null then 1 else 0 end as IsUnallocated,
     ar.FailureCode
-from ArcusTransactions ar   
+from ArcusTransactions ar
     left join UserLoanArcusTransactions ulat  on ar.ArcusTransactionId = ulat.ArcusTransactionId
     left join UnallocatedPaymentArcusTransactions ua on ua.ArcusTransactionId = ar.ArcusTransactionId
 where ar.CreatedAt >= '2025-06-01'
-""")
-
-print("✅ arcus db transactions")
-
-# Convert UTC timestamps to Mexico City timezone
-arcus['CreatedAt'] = arcus['CreatedAt'].dt.tz_localize('UTC')
-arcus['CreatedAtCDMX'] = arcus['CreatedAt'].dt.tz_convert('America/Mexico_City')
+"""
 
-arcus['ModifiedAt'] = arcus['ModifiedAt'].dt.tz_localize('UTC')
-arcus['ModifiedAtCDMX'] = arcus['ModifiedAt'].dt.tz_convert('America/Mexico_City')
+def transform_arcus(arcus):
+    """Per-chunk cleanup: CDMX timestamps, naive datetimes and compact column types."""
+    # Convert UTC timestamps to Mexico City time (both stored as naive datetimes)
+    arcus["CompletedAt"] = pd.to_datetime(arcus["CompletedAt"], errors="coerce")
+    add_cdmx_columns(arcus, ['CreatedAt', 'ModifiedAt', 'CompletedAt'])
 
-arcus["CompletedAt"] = pd.to_datetime(arcus["CompletedAt"], errors="coerce")
-arcus['CompletedAt'] = arcus['CompletedAt'].dt.tz_localize('UTC')
-arcus['CompletedAtCDMX'] = arcus['CompletedAt'].dt.tz_convert('America/Mexico_City')
+    # UserLoanId as a string id for consistent joining with other datasets, labels as
+    # categoricals, flags and codes narrowed (utils/dtype_utils.py)
+    arcus = apply_type_policy(arcus)
+    # Unallocated transactions have always carried the literal 'None' (str(None)); the
+    # dashboards join and count on it, so it is kept rather than becoming NULL
+    arcus["UserLoanId"] = arcus["UserLoanId"].fillna("None")
+    return arcus
 
-# Remove timezone info for Parquet compatibility (stores as naive datetime)
-for col in arcus.select_dtypes(include=['datetimetz']).columns:
-    arcus[col] = arcus[col].dt.tz_localize(None)
-
-# Convert UserLoanId to string for consistent joining with other datasets
-arcus['UserLoanId'] = arcus['UserLoanId'].apply(
-    lambda x: str(int(x)) if pd.notnull(x) else None
-)
-
-arcus['UserLoanId'] = arcus['UserLoanId'].astype(str)
+# Stream the result set chunk by chunk into Parquet row groups (bounded memory)
+print("Start pulling data from db:")
 
-# decimal format and remove tz type
+rows = fetch_data_to_parquet(ARCUS_TRANSACTIONS_QUERY, OUTPUT_FILE, transform=transform_arcus)
 
-arcus.to_parquet("data/arcus_transactions.parquet", index=False)
-print("Arcus transactions parquet stored locally.")
\ No newline at end of file
+print(f"✅ arcus db transactions ({rows} rows)")
+print("Arcus transactions parquet stored locally.")
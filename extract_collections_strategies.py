@@ -1,6 +1,10 @@
 import os
 import pandas as pd
-from utils.fetch_data_utils import fetch_data
+import pyarrow as pa
+from utils.dtype_utils import apply_type_policy
+from utils.fetch_data_utils import fetch_arrow
+from utils.timezone_utils import add_cdmx_columns
+from utils.write_parquet_utils import write_parquet
 
 # Output configuration
 OUTPUT_DIR = os.getenv("DATA_DIR", "data")
@@ -10,8 +14,16 @@ OUTPUT_FILE = os.path.join(OUTPUT_DIR, "collections_strategies.parquet")
 # EXTRACT STRATEGY ASSIGNMENTS
 # ========================================
 # Filters for active collection strategies only (excludes deprecated/test strategies)
+# Pulled as typed Arrow columns: UserLoanId arrives as a string and CreatedAt
+# as a timestamp, so no object-dtype re-parsing is needed afterwards.
 
-strategies_df = fetch_data("""
+STRATEGIES_SCHEMA = {
+    "UserLoanId": pa.string(),
+    "CreatedAt": pa.timestamp("us"),
+    "Strategy": pa.int64(),
+}
+
+strategies_df = fetch_arrow("""
 select
     UserLoanId,
     CreatedAt,
@@ -33,8 +45,7 @@ select
 from LoanCollectionStrategies lcs
 where
     Strategy in (3,4,5,7,8,10,11,12,13,14)
-"""
-)
+""", schema=STRATEGIES_SCHEMA).to_pandas()
 
 print("Data extracted successfully.")
 
@@ -43,25 +54,17 @@ print("Data extracted successfully.")
 # ========================================
 # Convert UTC timestamps to Mexico City timezone for business reporting
 
-strategies_df["CreatedAt"] = pd.to_datetime(strategies_df["CreatedAt"], errors="coerce")
-strategies_df['CreatedAt'] = strategies_df['CreatedAt'].dt.tz_localize('UTC')
-strategies_df['CreatedAtCDMX'] = strategies_df['CreatedAt'].dt.tz_convert('America/Mexico_City')
-
-# Strip timezone info for DuckDB compatibility (stores as naive datetime)
-for col in strategies_df.select_dtypes(include=['datetimetz']).columns:
-    strategies_df[col] = strategies_df[col].dt.tz_localize(None)
-
-# ========================================
-# DATA TYPE STANDARDIZATION
-# ========================================
-# Convert UserLoanId to string for consistent joins with other datasets
-strategies_df['UserLoanId'] = strategies_df['UserLoanId'].astype(str)
+# Both columns stay naive datetimes for DuckDB compatibility
+add_cdmx_columns(strategies_df, ['CreatedAt'])
 
 print("Final data set created successfully.")
 
 # ========================================
 # DATA TYPE STANDARDIZATION
 # ========================================
-# Convert UserLoanId to string for consistent joins with other datasets
-strategies_df.to_parquet(OUTPUT_FILE, index=False)
+# Compact types (utils/dtype_utils.py): StrategyName/StrategyType as categoricals,
+# Strategy narrowed; UserLoanId stays a string for consistent joins with other datasets
+apply_type_policy(strategies_df)
+# Sorted by UserLoanId, CreatedAt (utils/write_parquet_utils.py)
+write_parquet(strategies_df, OUTPUT_FILE)
 print("Collections strategies parquet stored locally.")
\ No newline at end of file
@@ -1,9 +1,12 @@
 from utils.gsheets_utils import load_drive_file_as_dataframe, list_files_in_folder
 import pandas as pd
+from typing import Optional
 from datetime import datetime
 import os
 import numpy as np
+from utils.catalog_utils import column_months
 from utils.fetch_parquet_utils import fetch_parquet
+from utils.write_parquet_utils import write_parquet
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -80,7 +83,7 @@ def process_monthly_files(
     parquet_file: str = "growth_data.parquet",
     months_to_refresh=None,          # e.g. ["2025_09", "2025_11"]
     process_missing: bool = True     # also load months not in parquet yet
-) -> pd.DataFrame:
+) -> Optional[pd.DataFrame]:
     """
     Process monthly Facebook Ads CSV files from Google Drive.
     
@@ -89,6 +92,7 @@ def process_monthly_files(
     2. Refresh: Re-process specific months (months_to_refresh=["2025_11"])
     
     CSV naming convention: YYYY_MM.csv (e.g., 2025_11.csv)
+    Returns the updated data, or None when there was nothing to process.
     """
 
     # Normalize months_to_refresh
@@ -96,15 +100,18 @@ def process_monthly_files(
         months_to_refresh = [months_to_refresh]
     months_to_refresh = set(months_to_refresh or [])
 
-    # 1. Load existing parquet
+    # 1. Months already in the parquet: from the catalog (one row group per month),
+    # else from the install_day column alone. The rows are only read if there is new data.
+    existing_path = os.path.join("data", parquet_file)
     try:
-        df_existing = fetch_parquet(parquet_file=parquet_file)
-        df_existing["install_day"] = pd.to_datetime(df_existing["install_day"])
-        existing_months = set(df_existing["install_day"].dt.strftime("%Y_%m").unique())
+        months = column_months(existing_path, "install_day")
+        if months is None:
+            months = pd.to_datetime(fetch_parquet(parquet_file, columns=["install_day"])["install_day"])
+        existing_months = set(pd.DatetimeIndex(months).dropna().strftime("%Y_%m"))
         print("Existing months in parquet:", sorted(existing_months))
     except Exception as e:
         print(f"Could not load existing parquet ({parquet_file}): {e}")
-        df_existing = None
+        existing_path = None
         existing_months = set()
         print("Starting with empty history.")
 
@@ -150,9 +157,13 @@ def process_monthly_files(
     # 3. No new data to process?
     if not new_dfs:
         print("No new or refreshed months to process.")
-        return df_existing
+        return None
 
     df_new = pd.concat(new_dfs, ignore_index=True)
+    df_existing = None
+    if existing_path is not None:
+        df_existing = fetch_parquet(parquet_file=parquet_file)
+        df_existing["install_day"] = pd.to_datetime(df_existing["install_day"])
 
     # 4. Drop explicitly refreshed months from existing parquet
     if df_existing is not None and months_to_drop_from_existing:
@@ -168,7 +179,7 @@ def process_monthly_files(
 
     # 6. Save updated parquet
     os.makedirs("data", exist_ok=True)
-    df_final.to_parquet(PARQUET_SAVE_PATH, index=False)
+    write_parquet(df_final, PARQUET_SAVE_PATH)
 
     print(f"Updated parquet saved to {PARQUET_SAVE_PATH}")
 
@@ -1,18 +1,109 @@
+"""
+Loan Detail Extraction (fact_loan)
+
+Builds data/loan.parquet from SQL Server:
+1. Pulls loans and payment aggregates (Arcus, Stripe, disputes, Openpay cash)
+2. Apportions payments across late fee, fee, taxes and principal
+3. Computes settlement dates, DaysLate and collections strategy columns
+
+Modes:
+- Full refresh (default, what the nightly cron runs): every loan is pulled
+- Incremental: python extract_loan_detail.py --incremental (or LOAN_INCREMENTAL=1)
+  only pulls users with a loan modified since the stored UserLoans.ModifiedAt
+  watermark and merges them into data/loan_base.parquet. Falls back to a full
+  refresh on the first run. Payments do not update UserLoans.ModifiedAt, so
+  without --payment-events a new payment on an otherwise unchanged loan is
+  only picked up by the next full refresh; with --payment-events the
+  re-pulled loans also include every loan with new payment events
+  (--full-refresh overrides LOAN_INCREMENTAL=1)
+
+DaysLate, IsPostDD and the strategy columns depend on today's date and on
+collections_strategies.parquet, so they are recomputed for every loan on each run.
+
+Engines:
+- pandas (default)
+- duckdb: python extract_loan_detail.py --engine duckdb (or LOAN_ENGINE=duckdb)
+  stages the raw pulls in data/staging/loan/ and runs the whole derivation as
+  one multi-threaded DuckDB query plan (utils/loan_duckdb_utils.py)
+- partitioned: python extract_loan_detail.py --engine partitioned
+  streams the pulls to data/staging/loan/, hashes loans by UserId into N
+  buckets and builds each bucket in its own process (LoanNumber is per user,
+  so buckets are independent). N is chosen so LOAN_WORKERS buckets in flight
+  fit in LOAN_MEMORY_BUDGET; bucket outputs go to data/loan_parts/ and are
+  streamed into the usual output files
+- Parity check on the last staged full pull: --check-duckdb-parity
+
+Payment events (--payment-events or LOAN_PAYMENT_EVENTS=1, any engine):
+payments are read from the transaction-grain fact in data/payment_events.parquet
+(extract_payment_events.py), which is itself pulled incrementally by
+ModifiedAt. Besides the loans of changed users, only loans with new or changed
+payment events are re-apportioned; the aggregate queries below are not run.
+
+Output: data/loan.parquet
+"""
+
 import os
-from utils.fetch_data_utils import fetch_data
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from utils.dtype_utils import apply_type_policy, id_strings
+from utils.fetch_data_utils import fetch_data, fetch_data_batch, fetch_data_to_parquet, DEFAULT_MAX_WORKERS
 from utils.fetch_parquet_utils import fetch_parquet
+from utils.apportion_utils import apportion_payments_frame, APPORTIONED_COLUMNS, DEFAULT_TAX_RATE
+from utils.strategy_utils import USED_STRATEGIES, resolve_collections_strategies
+from utils.watermark_utils import read_watermark, write_watermarks
+from utils.timezone_utils import add_cdmx_columns, utc_to_cdmx
+from utils import loan_duckdb_utils
+from utils.loan_duckdb_utils import STAGED_SOURCES
+from extract_payment_events import EVENTS_FILE, update_payment_events, stage_payment_aggregates
+from utils.partition_utils import bucket_filter, choose_partitions, combine_parts, parquet_memory_size, parse_bytes
+from utils.write_parquet_utils import copy_to_parquet, write_parquet
+import duckdb
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime
 
 OUTPUT_DIR = os.getenv("DATA_DIR", "data")
 OUTPUT_FILE = os.path.join(OUTPUT_DIR, "loan.parquet")
+# Loan + repayment columns before DaysLate/strategies; incremental runs merge into this
+BASE_FILE = os.path.join(OUTPUT_DIR, "loan_base.parquet")
+
+# Raw source pulls staged as Parquet for the DuckDB engine
+STAGING_DIR = os.path.join(OUTPUT_DIR, "staging", "loan")
+# pandas (default), duckdb (utils/loan_duckdb_utils.py) or partitioned
+LOAN_ENGINE = os.getenv("LOAN_ENGINE", "pandas")
+
+# Partitioned engine: bucket part files, memory budget for all workers together,
+# worker processes, and how much bigger a bucket gets in pandas than in Parquet
+PARTS_DIR = os.path.join(OUTPUT_DIR, "loan_parts")
+MEMORY_BUDGET = os.getenv("LOAN_MEMORY_BUDGET", "4GB")
+PARTITION_WORKERS = int(os.getenv("LOAN_WORKERS", str(os.cpu_count() or 1)))
+MEMORY_EXPANSION = float(os.getenv("LOAN_MEMORY_EXPANSION", "6"))
+
+# Payment events mode: payment aggregates come from data/payment_events.parquet
+# and only loans with new events (or changed users) are re-apportioned
+LOAN_PAYMENT_EVENTS = os.getenv("LOAN_PAYMENT_EVENTS") == "1"
+
+WATERMARK_NAME = "fact_loan"
+# Last payment event ModifiedAt already applied to fact_loan
+EVENTS_WATERMARK_NAME = "fact_loan_payment_events"
+# Re-read this much before the watermark to catch rows committed late on the replica
+WATERMARK_LOOKBACK = pd.Timedelta(hours=int(os.getenv("LOAN_WATERMARK_LOOKBACK_HOURS", "2")))
 
 pd.set_option('display.max_columns', None)
 
-print("Start pulling data from db:")
+# ========================================
+# SOURCE QUERIES
+# ========================================
+# {user_filter}/{loan_filter} are empty on a full refresh and restrict the
+# pull to changed users on an incremental run. {tax_rate} is the IVA rate the
+# apportionment splits payments with (apportion_utils.DEFAULT_TAX_RATE).
 
-loans = fetch_data("""
+LOANS_QUERY = """
 select
     uls.UserId,
     l.UserLoanId,
@@ -21,9 +112,9 @@ select
     l.DueDate,
     l.Amount as PrincipalAmount,
     l.Fee,
-    l.Fee * 0.16 as TaxOnFee,
+    l.Fee * {tax_rate} as TaxOnFee,
     case when IsLate = 1 then l.LateFee else 0 end as LateFee,
-    case when IsLate = 1 then l.LateFee * 0.16 else 0 end as TaxOnLateFee,
+    case when IsLate = 1 then l.LateFee * {tax_rate} else 0 end as TaxOnLateFee,
     l.LoanStatus,
     l.IsLate,
     case
@@ -75,11 +166,17 @@ left join LoanOffers jlo ON l.JitLoanOfferId = jlo.LoanOfferId
 where
     l.LoanStatus not in (6)
     -- and convert(date, l.CreatedAt) >= '2024-01-01'
-""")
+    {user_filter}
+"""
 
-print("✅ loans")
+# Columns LOANS_QUERY returns (the loan part of loan_base.parquet)
+LOAN_COLUMNS = [
+    "UserId", "UserLoanId", "IssueDate", "ModifiedAt", "DueDate", "PrincipalAmount", "Fee", "TaxOnFee",
+    "LateFee", "TaxOnLateFee", "LoanStatus", "IsLate", "LoanStatusDescription", "LoanNumber", "FeeRatio",
+    "JitOfferPolicy", "JitOfferPolicyName", "CreditPolicy", "CreditPolicyName", "MlScore",
+]
 
-arcus = fetch_data("""
+ARCUS_QUERY = """
 select
     ulat.UserLoanId,
     sum(ar.Amount) as AmountPaidArcus,
@@ -89,12 +186,11 @@ from UserLoanArcusTransactions ulat
 where
     ulat.IsDistribution = 0 -- only credit/in transactions
     and ar.Status != 2
+    {loan_filter}
 group by ulat.UserLoanId
-""")
+"""
 
-print("✅ arcus")
-
-stripe = fetch_data("""
+STRIPE_QUERY = """
 select
     ulst.UserLoanId,
     sum(st.Amount) as AmountPaidStripe,
@@ -102,12 +198,11 @@ select
 from UserLoanStripeTransactions ulst
     join StripeTransactions st ON ulst.StripeTransactionId = ST.StripeTransactionId
 where ST.Status = 1 -- Succeded
+{loan_filter}
 group by ulst.UserLoanId
-""")
-
-print("✅ stripe")
+"""
 
-dispute = fetch_data("""
+DISPUTE_QUERY = """
 select
     ulst.UserLoanId,
     sum(case when sd.StripeDisputeId is not null then st.Amount else 0 end) as DisputeAmount
@@ -116,12 +211,11 @@ from UserLoanStripeTransactions ulst
     join StripeDispute sd on sd.StripeTransactionId = st.StripeTransactionId
 where ST.Status = 1 -- Succeded
 and sd.DisputeStatus = 2 -- remediatedlost
+{loan_filter}
 group by ulst.UserLoanId
-""")
+"""
 
-print("✅ dispute")
-
-cash = fetch_data("""
+CASH_QUERY = """
 select
     ulot.UserLoanId,
     sum(ot.Amount) as AmountPaidCash,
@@ -130,262 +224,580 @@ from UserLoanOpenpayTransactions ulot
     join OpenpayTransactions ot on ulot.OpenpayTransactionId = ot.OpenpayTransactionId
 where ulot.IsDistribution = 0
 and ot.Status = 2
+{loan_filter}
 group by ulot.UserLoanId
-""")
-
-print("✅ cash")
-
-# Transform UTC to CDMX dates
-loans['IssueDate'] = loans['IssueDate'].dt.tz_localize('UTC')
-loans['IssueDateCDMX'] = loans['IssueDate'].dt.tz_convert('America/Mexico_City')
-
-loans['ModifiedAt'] = loans['ModifiedAt'].dt.tz_localize('UTC')
-loans['ModifiedAtCDMX'] = loans['ModifiedAt'].dt.tz_convert('America/Mexico_City')
-
-arcus["LastPaidAtArcus"] = pd.to_datetime(arcus["LastPaidAtArcus"], errors="coerce")
-arcus['LastPaidAtArcus'] = arcus['LastPaidAtArcus'].dt.tz_localize('UTC')
-arcus['LastPaidAtArcusCDMX'] = arcus['LastPaidAtArcus'].dt.tz_convert('America/Mexico_City')
-
-stripe["LastPaidAtStripe"] = pd.to_datetime(stripe["LastPaidAtStripe"], errors="coerce")
-stripe['LastPaidAtStripe'] = stripe['LastPaidAtStripe'].dt.tz_localize('UTC')
-stripe['LastPaidAtStripeCDMX'] = stripe['LastPaidAtStripe'].dt.tz_convert('America/Mexico_City')
-
-cash["LastPaidAtCash"] = pd.to_datetime(cash["LastPaidAtCash"], errors="coerce")
-cash['LastPaidAtCash'] = cash['LastPaidAtCash'].dt.tz_localize('UTC')
-cash['LastPaidAtCashCDMX'] = cash['LastPaidAtCash'].dt.tz_convert('America/Mexico_City')
-
-repayment = loans.merge(arcus, on="UserLoanId", how="left").merge(
-    stripe, on="UserLoanId", how="left"
-).merge(dispute, on="UserLoanId", how="left").merge(cash, on="UserLoanId", how="left")
-
-# Fill NaN values with 0 for payment amounts
-repayment["AmountPaidArcus"] = repayment["AmountPaidArcus"].fillna(0)
-repayment["AmountPaidStripe"] = repayment["AmountPaidStripe"].fillna(0)
-repayment["AmountPaidCash"] = repayment["AmountPaidCash"].fillna(0)
-repayment["DisputeAmount"] = repayment["DisputeAmount"].fillna(0)
-# repayment["LastAmountPaid"] = repayment["LastAmountPaid"].fillna(0)
-
-# Compute total amount due
-repayment["TotalAmountDue"] = (
-    repayment["PrincipalAmount"]
-    + repayment["Fee"]
-    + repayment["TaxOnFee"]
-    + repayment["LateFee"]
-    + repayment["TaxOnLateFee"]
-)
-
-# Initialize columns for apportioned amounts
-repayment['LateFeePaid'] = 0.0
-repayment['TaxOnLateFeePaid'] = 0.0
-repayment['FeePaid'] = 0.0
-repayment['TaxOnFeePaid'] = 0.0
-repayment['PrincipalPaid'] = 0.0
-
-# Compute total amount paid
-repayment["TotalAmountPaid"] = (
-    repayment["AmountPaidArcus"] + repayment["AmountPaidStripe"] + repayment["AmountPaidCash"] - repayment["DisputeAmount"]
-)
-repayment["TotalOriginalAmountPaid"] = repayment["TotalAmountPaid"]
-
-# Adjust LoanStatus = 2 and TotalAmountPaid < TotalAmountDue for underpayments adjustment
-repayment['TotalAmountPaid'] = np.where(
-    (repayment['TotalAmountPaid'] < repayment['TotalAmountDue']) &  (repayment['LoanStatus'] == 2),
-    repayment['TotalAmountDue'],
-    repayment['TotalAmountPaid']
-)
-
-# Apportion payments including taxes
-def apportion_payments(row):
-    # Use the lower of what the user paid or what they owed
-    amount_to_apportion = min(row['TotalAmountPaid'], row['TotalAmountDue'])
-    remaining = amount_to_apportion
-    # remaining = row['TotalAmountPaid']
-
-    # Step 1: Late Fee + Tax (total 92.8)
-    total_late_fee_due = row['LateFee'] + row['TaxOnLateFee']
-    if remaining >= total_late_fee_due:
-        late_fee_paid = row['LateFee']
-        tax_on_late_fee_paid = row['TaxOnLateFee']
-        remaining -= total_late_fee_due
-    else:
-        late_fee_paid = round(remaining / 1.16, 2)
-        tax_on_late_fee_paid = round(remaining - late_fee_paid, 2)
-        remaining = 0
-
-    # Step 2: Fee + Tax (total 34.8)
-    total_fee_due = row['Fee'] + row['TaxOnFee']
-    if remaining >= total_fee_due:
-        fee_paid = row['Fee']
-        tax_on_fee_paid = row['TaxOnFee']
-        remaining -= total_fee_due
-    else:
-        fee_paid = round(remaining / 1.16, 2)
-        tax_on_fee_paid = round(remaining - fee_paid, 2)
-        remaining = 0
-
-    # Step 3: Principal (no tax)
-    principal_paid = min(remaining, row['PrincipalAmount'])
-
-    return principal_paid, fee_paid, tax_on_fee_paid, late_fee_paid, tax_on_late_fee_paid
+"""
 
-# Apply the function to calculate apportioned payments
-repayment[['PrincipalPaid', 'FeePaid', 'TaxOnFeePaid', 'LateFeePaid', 'TaxOnLateFeePaid']] = repayment.apply(
-    lambda row: apportion_payments(row), axis=1, result_type='expand'
-)
-
-print("Finished apportioning.")
-
-repayment['LastPaidDate'] = repayment[['LastPaidAtArcus', 'LastPaidAtStripe', 'LastPaidAtCash']].max(axis=1)
-repayment['LastPaidDateCDMX'] = repayment['LastPaidDate'].dt.tz_convert('America/Mexico_City')
+# Users with at least one loan modified since the watermark.
+# All loans of these users are re-pulled so per-user LoanNumber stays correct
+# and loans that moved to DisbursementFailed (6) drop out.
+CHANGED_USERS_QUERY = """
+select
+    uls.UserId,
+    max(l.ModifiedAt) as ModifiedAt
+from UserLoans l
+join UserLoanSubscriptions uls on l.UserLoanSubscriptionId = uls.UserLoanSubscriptionId
+where l.ModifiedAt > '{since}'
+group by uls.UserId
+"""
+
+CHANGED_USERS_SUBQUERY = """
+    select uls.UserId
+    from UserLoans l
+    join UserLoanSubscriptions uls on l.UserLoanSubscriptionId = uls.UserLoanSubscriptionId
+    where l.ModifiedAt > '{since}'
+"""
+
+CHANGED_LOANS_SUBQUERY = """
+    select l.UserLoanId
+    from UserLoans l
+    join UserLoanSubscriptions uls on l.UserLoanSubscriptionId = uls.UserLoanSubscriptionId
+    where uls.UserId in ({changed_users})
+"""
+
+
+def _since_literal(since):
+    return since.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def user_filter(since=None):
+    """Loan query filter: only users changed since the watermark (empty on full refresh)."""
+    if since is None:
+        return ""
+    return f"and uls.UserId in ({CHANGED_USERS_SUBQUERY.format(since=_since_literal(since))})"
+
+
+def loan_filter(column, since=None):
+    """Payment query filter on column (e.g. ulat.UserLoanId): loans of changed users only."""
+    if since is None:
+        return ""
+    changed_users = CHANGED_USERS_SUBQUERY.format(since=_since_literal(since))
+    return f"and {column} in ({CHANGED_LOANS_SUBQUERY.format(changed_users=changed_users)})"
+
+
+def source_queries(since=None):
+    """Source queries by staged name (see STAGED_SOURCES). since=None pulls everything."""
+    return {
+        "loans": LOANS_QUERY.format(user_filter=user_filter(since), tax_rate=DEFAULT_TAX_RATE),
+        "arcus": ARCUS_QUERY.format(loan_filter=loan_filter("ulat.UserLoanId", since)),
+        "stripe": STRIPE_QUERY.format(loan_filter=loan_filter("ulst.UserLoanId", since)),
+        "dispute": DISPUTE_QUERY.format(loan_filter=loan_filter("ulst.UserLoanId", since)),
+        "cash": CASH_QUERY.format(loan_filter=loan_filter("ulot.UserLoanId", since)),
+    }
+
+
+def fetch_sources(since=None, max_workers=None):
+    """
+    Pull loans and payment aggregates concurrently. since=None pulls everything.
+    Returns (loans, arcus, stripe, dispute, cash).
+    """
+    queries = source_queries(since)
+    frames, timings = fetch_data_batch(queries, max_workers=max_workers)
+    print(f"Pulled {len(queries)} source queries, slowest {max(timings, key=timings.get)} ({max(timings.values()):.1f}s)")
+
+    return tuple(frames[name] for name in queries)
+
+
+def build_repayment(loans, arcus, stripe, dispute, cash):
+    """Merge sources, apportion payments and compute settlement dates (one row per loan)."""
+    # Transform UTC to CDMX dates (timestamps stay naive: UTC columns + *CDMX columns)
+    add_cdmx_columns(loans, ['IssueDate', 'ModifiedAt'])
+
+    arcus["LastPaidAtArcus"] = pd.to_datetime(arcus["LastPaidAtArcus"], errors="coerce")
+    add_cdmx_columns(arcus, ['LastPaidAtArcus'])
+
+    stripe["LastPaidAtStripe"] = pd.to_datetime(stripe["LastPaidAtStripe"], errors="coerce")
+    add_cdmx_columns(stripe, ['LastPaidAtStripe'])
+
+    cash["LastPaidAtCash"] = pd.to_datetime(cash["LastPaidAtCash"], errors="coerce")
+    add_cdmx_columns(cash, ['LastPaidAtCash'])
+
+    repayment = loans.merge(arcus, on="UserLoanId", how="left").merge(
+        stripe, on="UserLoanId", how="left"
+    ).merge(dispute, on="UserLoanId", how="left").merge(cash, on="UserLoanId", how="left")
+
+    # Fill NaN values with 0 for payment amounts
+    repayment["AmountPaidArcus"] = repayment["AmountPaidArcus"].fillna(0)
+    repayment["AmountPaidStripe"] = repayment["AmountPaidStripe"].fillna(0)
+    repayment["AmountPaidCash"] = repayment["AmountPaidCash"].fillna(0)
+    repayment["DisputeAmount"] = repayment["DisputeAmount"].fillna(0)
+    # repayment["LastAmountPaid"] = repayment["LastAmountPaid"].fillna(0)
+
+    # Compute total amount due
+    repayment["TotalAmountDue"] = (
+        repayment["PrincipalAmount"]
+        + repayment["Fee"]
+        + repayment["TaxOnFee"]
+        + repayment["LateFee"]
+        + repayment["TaxOnLateFee"]
+    )
 
-# ========================================
-# SETTLEMENT DATE CALCULATION
-# ========================================
-# SettledAt: Timestamp when loan was fully repaid
-# - For repaid loans WITH payments: use latest payment date across all channels
-# - For repaid loans WITHOUT payments: assume settled on due date (edge case)
-# - For outstanding loans: NULL
-
-repayment["SettledAt"] = np.where(
-    (repayment['LoanStatus'] == 2) & repayment['LastPaidDate'].notnull(),
-    repayment['LastPaidDate'],
-    pd.NaT
-)
-
-repayment['SettledAtCDMX'] = repayment['SettledAt'].dt.tz_convert('America/Mexico_City')
-
-repayment["SettledAt"] = np.where(
-    (repayment['LoanStatus'] == 2) & repayment['LastPaidDate'].isnull(),
-    pd.to_datetime(repayment["DueDate"], errors="coerce").dt.tz_localize('UTC'),
-    repayment["SettledAt"]
-)
-
-repayment["SettledAtCDMX"] = np.where(
-    (repayment['LoanStatus'] == 2) & repayment['LastPaidDate'].isnull(),
-    pd.to_datetime(repayment["DueDate"], errors="coerce").dt.tz_localize('America/Mexico_City'),
-    repayment["SettledAtCDMX"]
-)
-
-repayment["LoanCohort"] = np.where(
-    repayment["LoanNumber"] == 1,
-    "First",
-    "Repeat"
-)
-
-for col in repayment.select_dtypes(include=['datetimetz']).columns:
-    repayment[col] = repayment[col].dt.tz_localize(None)
+    # Initialize columns for apportioned amounts
+    repayment['LateFeePaid'] = 0.0
+    repayment['TaxOnLateFeePaid'] = 0.0
+    repayment['FeePaid'] = 0.0
+    repayment['TaxOnFeePaid'] = 0.0
+    repayment['PrincipalPaid'] = 0.0
 
-# ========================================
-# DAYS LATE CALCULATION (DPD)
-# ========================================
-# DaysLate: Calendar days between due date and settlement (or today if unsettled)
-# - Settled loans: SettledAtCDMX - DueDate
-# - Outstanding loans: today - DueDate
-# - Clipped to 0 minimum (early payments = 0 days late)
-
-today = pd.to_datetime(datetime.now().date())
+    # Compute total amount paid
+    repayment["TotalAmountPaid"] = (
+        repayment["AmountPaidArcus"] + repayment["AmountPaidStripe"] + repayment["AmountPaidCash"] - repayment["DisputeAmount"]
+    )
+    repayment["TotalOriginalAmountPaid"] = repayment["TotalAmountPaid"]
 
-repayment["DaysLate"] = np.where(
-    repayment["SettledAt"].notnull(),
-    (repayment["SettledAtCDMX"] - repayment["DueDate"]).dt.days,
-    (today - repayment["DueDate"]).dt.days
-)
+    # Adjust LoanStatus = 2 and TotalAmountPaid < TotalAmountDue for underpayments adjustment
+    repayment['TotalAmountPaid'] = np.where(
+        (repayment['TotalAmountPaid'] < repayment['TotalAmountDue']) &  (repayment['LoanStatus'] == 2),
+        repayment['TotalAmountDue'],
+        repayment['TotalAmountPaid']
+    )
 
-# No negative DPD
-repayment["DaysLate"] = repayment["DaysLate"].clip(lower=0)
+    # Apportion payments including taxes (vectorized waterfall, see utils/apportion_utils.py)
+    repayment[APPORTIONED_COLUMNS] = apportion_payments_frame(repayment)
 
-# Convert UserId and UserLoanId to string
-repayment['UserId'] = repayment['UserId'].astype(str)
-repayment['UserLoanId'] = repayment['UserLoanId'].astype(str)
+    print("Finished apportioning.")
 
-print("Loans data set created successfully.")
+    repayment['LastPaidDate'] = repayment[['LastPaidAtArcus', 'LastPaidAtStripe', 'LastPaidAtCash']].max(axis=1)
+    repayment['LastPaidDateCDMX'] = utc_to_cdmx(repayment['LastPaidDate'])
 
-# INCLUDE STRATEGIES
-print("Started adding collections strategies.")
+    # ========================================
+    # SETTLEMENT DATE CALCULATION
+    # ========================================
+    # SettledAt: Timestamp when loan was fully repaid
+    # - For repaid loans WITH payments: use latest payment date across all channels
+    # - For repaid loans WITHOUT payments: assume settled on due date (edge case)
+    # - For outstanding loans: NULL
 
-stgy_df = fetch_parquet(parquet_file="collections_strategies.parquet")
+    # where() keeps the datetime dtype even when no loan in the batch matches
+    repayment["SettledAt"] = repayment['LastPaidDate'].where(
+        (repayment['LoanStatus'] == 2) & repayment['LastPaidDate'].notnull()
+    )
 
-stgy_postdd = stgy_df[stgy_df['Strategy'].isin([3, 4, 10, 11, 12, 13])]
+    repayment['SettledAtCDMX'] = utc_to_cdmx(repayment['SettledAt'])
 
-loans_df = repayment.merge(stgy_postdd, on="UserLoanId", how="left")
+    # DueDate is a calendar date: used as is for both SettledAt and SettledAtCDMX
+    settled_on_due_date = (repayment['LoanStatus'] == 2) & repayment['LastPaidDate'].isnull()
+    due_date = pd.to_datetime(repayment["DueDate"], errors="coerce")
+    repayment["SettledAt"] = repayment["SettledAt"].mask(settled_on_due_date, due_date)
+    repayment["SettledAtCDMX"] = repayment["SettledAtCDMX"].mask(settled_on_due_date, due_date)
 
-# Make sure your datetime columns are proper datetimes (keeps tz if present)
-loans_df["DueDate"] = pd.to_datetime(loans_df["DueDate"], errors="coerce")
-loans_df["SettledAtCDMX"] = pd.to_datetime(loans_df["SettledAtCDMX"], errors="coerce")
+    repayment["LoanCohort"] = np.where(
+        repayment["LoanNumber"] == 1,
+        "First",
+        "Repeat"
+    )
 
-# ========================================
-# POST-DUE-DATE FLAG CALCULATION
-# ========================================
-# IsPostDD: Indicates loan entered post-due-date collections workflow
-# A loan is post-DD if ANY of:
-# 1. Explicitly assigned to post-DD strategy (3, 4, 13)
-# 2. Past due AND settled after 30-hour grace period
-# 3. Past due AND still unsettled after 30-hour grace period
-#
-# Grace period: DueDate (midnight) + 30 hours = ~6am next day
+    # UserId and UserLoanId as string ids (Arrow-backed, see utils/dtype_utils.py)
+    repayment['UserId'] = id_strings(repayment['UserId'])
+    repayment['UserLoanId'] = id_strings(repayment['UserLoanId'])
 
-# Floor DueDate to start of day and add 30 hours
+    return repayment
 
-threshold = loans_df["DueDate"].dt.normalize() + pd.Timedelta(hours=30)
 
-now_cdmx = pd.Timestamp.now(tz="America/Mexico_City").tz_localize(None)
+def add_days_late(repayment, today=None):
+    """DaysLate depends on today's date, so it is recomputed for every loan on each run."""
+    # ========================================
+    # DAYS LATE CALCULATION (DPD)
+    # ========================================
+    # DaysLate: Calendar days between due date and settlement (or today if unsettled)
+    # - Settled loans: SettledAtCDMX - DueDate
+    # - Outstanding loans: today - DueDate
+    # - Clipped to 0 minimum (early payments = 0 days late)
 
-due = pd.to_datetime(loans_df["DueDate"])
-settled = pd.to_datetime(loans_df["SettledAtCDMX"])
+    if today is None:
+        today = pd.to_datetime(datetime.now().date())
 
-past_due = due < now_cdmx
-settled_after_threshold = settled > threshold
-over_30h_without_settlement = ((now_cdmx - due) > pd.Timedelta(hours=30)) & settled.isna()
+    repayment["DaysLate"] = np.where(
+        repayment["SettledAt"].notnull(),
+        (repayment["SettledAtCDMX"] - repayment["DueDate"]).dt.days,
+        (today - repayment["DueDate"]).dt.days
+    )
 
-loans_df["IsPostDD"] = (
-    loans_df["Strategy"].isin([3, 4, 13])
-    | (past_due & (settled_after_threshold | over_30h_without_settlement))
-)
+    # No negative DPD; nullable integer (a NULL DueDate would otherwise make it float),
+    # the BIGINT the DuckDB engine writes
+    repayment["DaysLate"] = pd.Series(repayment["DaysLate"], index=repayment.index).clip(lower=0).astype("Int64")
+
+    return repayment
+
+
+def merge_incremental(base, delta, changed_users):
+    """Replace every loan of the changed users in base with the freshly pulled rows."""
+    changed_users = pd.Series(changed_users).astype(str)
+    keep = ~base["UserId"].isin(changed_users) & ~base["UserLoanId"].isin(delta["UserLoanId"])
+    print(f"🔁 Replacing {(~keep).sum()} loans with {len(delta)} refreshed loans")
+    return pd.concat([base[keep], delta], ignore_index=True)
+
+
+def stage_sources(sources, changed_users=None, staging_dir=STAGING_DIR):
+    """Write the raw pulls to staging_dir as Parquet (input of the DuckDB engine)."""
+    os.makedirs(staging_dir, exist_ok=True)
+    frames = dict(zip(STAGED_SOURCES, sources))
+    if changed_users is not None:
+        frames["changed_users"] = changed_users
+    for name, frame in frames.items():
+        write_parquet(frame, os.path.join(staging_dir, f"{name}.parquet"))
+    print(f"📦 Staged {len(frames)} source pulls in {staging_dir}")
+
+
+def stage_sources_streaming(since=None, changed_users=None, staging_dir=STAGING_DIR, max_workers=None):
+    """
+    Stream the source queries straight into staging_dir Parquet files, without
+    holding them in memory (input of the partitioned engine).
+    """
+    os.makedirs(staging_dir, exist_ok=True)
+    queries = source_queries(since)
+    max_workers = max(1, min(max_workers or DEFAULT_MAX_WORKERS, len(queries)))
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage") as pool:
+        futures = {
+            name: pool.submit(fetch_data_to_parquet, query, os.path.join(staging_dir, f"{name}.parquet"))
+            for name, query in queries.items()
+        }
+        for name, future in futures.items():
+            print(f"✅ {name}: {future.result()} rows staged")
+
+    if changed_users is not None:
+        write_parquet(changed_users, os.path.join(staging_dir, "changed_users.parquet"))
+
+
+def build_pandas(sources, base=None, changed_users=None, today=None, now_cdmx=None,
+                 strategies_file="collections_strategies.parquet", strategies=None):
+    """pandas engine: returns (repayment base, final loan frame)."""
+    if sources is None:
+        repayment = base
+    else:
+        repayment = build_repayment(*sources)
+        if base is not None:
+            repayment = merge_incremental(base, repayment, changed_users["UserId"])
+    print("Loans data set created successfully.")
 
-# Make sure CreatedAt is a datetime
-loans_df["CreatedAt"] = pd.to_datetime(loans_df["CreatedAt"], errors="coerce")
+    base = repayment.copy()
+    repayment = add_days_late(repayment, today=today)
 
-# Sort by UserLoanId + CreatedAt DESC
-loans_sorted = loans_df.sort_values(["UserLoanId", "CreatedAt"], ascending=[True, False])
+    # INCLUDE STRATEGIES
+    print("Started adding collections strategies.")
 
-# Drop duplicates keeping the first (which is the latest CreatedAt per UserLoanId)
-loans_clean = loans_sorted.drop_duplicates(subset=["UserLoanId"], keep="first")
+    # Strategies file is read once and shared by the post-DD and Pypper steps; only the
+    # strategy rows they use are read, and repeated builds in one process hit the cache
+    stgy_df = strategies if strategies is not None else fetch_parquet(
+        parquet_file=strategies_file, filters=[("Strategy", "in", USED_STRATEGIES)], cache=True
+    )
 
-loans_clean["StrategyCreatedAt"] = loans_clean.apply(
-    lambda row: threshold[row.name]
-    if (
-        (row["IsPostDD"] and pd.isna(row["CreatedAt"]))
-        or (row["IsPostDD"] and row["Strategy"] in [10, 11, 12])
+    loans_clean = resolve_collections_strategies(repayment, stgy_df, now_cdmx=now_cdmx)
+
+    print("Final data set created successfully.")
+    return base, loans_clean
+
+
+def _bucket_sql(path, n_buckets, bucket):
+    return f"SELECT * FROM read_parquet('{Path(path).as_posix()}') WHERE {bucket_filter('UserId', n_buckets, bucket)}"
+
+
+def build_bucket(bucket, n_buckets, staging_dir, parts_dir, previous_base_path=None,
+                 has_changes=True, today=None, now_cdmx=None, memory_limit=None):
+    """
+    Partitioned engine worker: build the loans of one UserId hash bucket.
+
+    Reads only its bucket from the staged pulls and the previous base (DuckDB
+    scans), runs the pandas transformation and writes base/loan part files.
+    Returns (base_part, loan_part), or None when the bucket has no loans.
+    """
+    con = duckdb.connect()
+    con.execute("SET threads = 1")
+    if memory_limit:
+        con.execute(f"SET memory_limit = '{memory_limit}'")
+
+    staged = {name: Path(staging_dir) / f"{name}.parquet" for name in STAGED_SOURCES}
+    loans_sql = _bucket_sql(staged["loans"], n_buckets, bucket)
+
+    base = changed_users = sources = None
+    if previous_base_path is not None:
+        base = con.sql(_bucket_sql(previous_base_path, n_buckets, bucket)).df()
+    if has_changes:
+        loans = con.sql(loans_sql).df()
+        if previous_base_path is not None:
+            changed_users = con.sql(_bucket_sql(Path(staging_dir) / "changed_users.parquet", n_buckets, bucket)).df()
+        if not loans.empty:
+            # Payments follow their loan into the bucket
+            sources = (loans,) + tuple(
+                con.sql(
+                    f"SELECT * FROM read_parquet('{staged[name].as_posix()}') "
+                    f"WHERE CAST(UserLoanId AS VARCHAR) IN (SELECT CAST(UserLoanId AS VARCHAR) FROM ({loans_sql}))"
+                ).df()
+                for name in STAGED_SOURCES[1:]
+            )
+        elif base is not None and not changed_users.empty:
+            # Every loan of this bucket's changed users dropped out of the pull
+            base = base[~base["UserId"].isin(changed_users["UserId"].astype(str))]
+
+    if sources is None and (base is None or base.empty):
+        return None
+
+    # Only this bucket's strategy rows are needed for the join
+    strategies_path = Path(OUTPUT_DIR) / "collections_strategies.parquet"
+    bucket_loans = sources[0]["UserLoanId"].astype(str) if sources is not None else pd.Series(dtype=str)
+    if base is not None:
+        bucket_loans = pd.concat([bucket_loans, base["UserLoanId"]])
+    con.register("bucket_loans", pd.DataFrame({"UserLoanId": bucket_loans.unique()}))
+    strategies = con.sql(
+        f"SELECT * FROM read_parquet('{strategies_path.as_posix()}') "
+        f"WHERE UserLoanId IN (SELECT UserLoanId FROM bucket_loans)"
+    ).df()
+    con.close()
+
+    base, loans_clean = build_pandas(
+        sources, base, changed_users, today=today, now_cdmx=now_cdmx, strategies=strategies
     )
-    else row["CreatedAt"],
-    axis=1
-)
-
-loans_clean["StrategyCreatedAtCDMX"] = loans_clean.apply(
-    lambda row: threshold[row.name]
-    if (
-        (row["IsPostDD"] and pd.isna(row["CreatedAt"]))
-        or (row["IsPostDD"] and row["Strategy"] in [10, 11, 12])
+    base_part = Path(parts_dir) / "base" / f"part-{bucket:05d}.parquet"
+    loan_part = Path(parts_dir) / "loan" / f"part-{bucket:05d}.parquet"
+    write_parquet(base, base_part)
+    write_parquet(loans_clean, loan_part)
+    print(f"🧩 Bucket {bucket + 1}/{n_buckets}: {len(loans_clean)} loans")
+    return base_part, loan_part
+
+
+def build_partitioned(staging_dir=STAGING_DIR, previous_base_path=None, has_changes=True,
+                      memory_budget=MEMORY_BUDGET, workers=PARTITION_WORKERS, n_buckets=None,
+                      today=None, now_cdmx=None):
+    """
+    Partitioned engine: hash the loans by UserId into N buckets, build each
+    bucket in its own process and write the bucket outputs as part files of
+    data/loan_parts/{base,loan}/, then stream them into BASE_FILE and OUTPUT_FILE.
+
+    N is picked from the staged input size so that `workers` buckets in flight
+    stay inside memory_budget (LOAN_MEMORY_BUDGET).
+    """
+    today = today if today is not None else pd.to_datetime(datetime.now().date())
+    if now_cdmx is None:
+        now_cdmx = pd.Timestamp.now(tz="America/Mexico_City").tz_localize(None)
+
+    if n_buckets is None:
+        inputs = [os.path.join(staging_dir, f"{name}.parquet") for name in STAGED_SOURCES] if has_changes else []
+        inputs += [previous_base_path, os.path.join(OUTPUT_DIR, "collections_strategies.parquet")] if previous_base_path else []
+        n_buckets = choose_partitions(parquet_memory_size(inputs), memory_budget, workers, MEMORY_EXPANSION)
+    workers = min(workers, n_buckets)
+    # DuckDB only scans the bucket out of the staged files; keep it a workable floor
+    worker_memory = f"{max(256, parse_bytes(memory_budget) // workers // (1024 ** 2))}MB"
+    print(f"🧩 Building fact_loan in {n_buckets} buckets with {workers} worker processes (budget {memory_budget})")
+
+    shutil.rmtree(PARTS_DIR, ignore_errors=True)
+    for kind in ("base", "loan"):
+        os.makedirs(os.path.join(PARTS_DIR, kind))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                build_bucket, bucket, n_buckets, staging_dir, PARTS_DIR, previous_base_path,
+                has_changes, today, now_cdmx, worker_memory,
+            )
+            for bucket in range(n_buckets)
+        ]
+        parts = [part for part in (future.result() for future in futures) if part is not None]
+
+    if not parts:
+        raise RuntimeError("Partitioned build produced no loans")
+
+    rows = combine_parts([base_part for base_part, _ in parts], BASE_FILE)
+    combine_parts([loan_part for _, loan_part in parts], OUTPUT_FILE)
+    print(f"✅ {rows} loans written from {len(parts)} bucket parts")
+    return rows
+
+
+def stage_sources_from_events(since, changed_users, touched, staging_dir=STAGING_DIR):
+    """
+    Stage the loans to rebuild and their payment aggregates from the payment
+    events fact (instead of the aggregate queries):
+    - every loan of the changed users, pulled from the db (all loans on a full refresh)
+    - loans with new payment events whose user did not change, taken from BASE_FILE
+    """
+    os.makedirs(staging_dir, exist_ok=True)
+    con = duckdb.connect()
+    parts = []
+
+    if since is None or not changed_users.empty:
+        pulled_path = Path(staging_dir, "loans_pulled.parquet")
+        if fetch_data_to_parquet(LOANS_QUERY.format(user_filter=user_filter(since), tax_rate=DEFAULT_TAX_RATE), pulled_path):
+            parts.append(
+                "SELECT * REPLACE (CAST(UserId AS VARCHAR) AS UserId, CAST(UserLoanId AS VARCHAR) AS UserLoanId) "
+                f"FROM read_parquet('{pulled_path.as_posix()}')"
+            )
+
+    if since is not None:
+        con.register("touched", pd.DataFrame({"UserLoanId": pd.Series(touched, dtype=str)}))
+        con.register("changed", changed_users[["UserId"]].astype(str))
+        # Only the LOANS_QUERY columns of the base: build_repayment recomputes the rest
+        loan_columns = ", ".join(f'"{column}"' for column in LOAN_COLUMNS)
+        parts.append(
+            f"SELECT {loan_columns} FROM read_parquet('{Path(BASE_FILE).as_posix()}') "
+            "WHERE UserLoanId IN (SELECT UserLoanId FROM touched) "
+            "AND UserId NOT IN (SELECT UserId FROM changed)"
+        )
+        write_parquet(changed_users, os.path.join(staging_dir, "changed_users.parquet"))
+
+    loans_path = Path(staging_dir, "loans.parquet")
+    copy_to_parquet(con, " UNION ALL BY NAME ".join(parts), loans_path)
+    loans = con.execute(f"SELECT count(*) FROM read_parquet('{loans_path.as_posix()}')").fetchone()[0]
+    con.close()
+
+    stage_payment_aggregates(loans_path, staging_dir)
+    print(f"📦 Staged {loans} loans and their payment aggregates from {EVENTS_FILE}")
+
+
+def read_staged_sources(staging_dir=STAGING_DIR):
+    return tuple(pd.read_parquet(os.path.join(staging_dir, f"{name}.parquet")) for name in STAGED_SOURCES)
+
+
+def main(incremental=False, engine=LOAN_ENGINE, payment_events=LOAN_PAYMENT_EVENTS):
+    since = read_watermark(WATERMARK_NAME) if incremental else None
+    if since is not None and not os.path.exists(BASE_FILE):
+        print(f"⚠️ {BASE_FILE} not found, falling back to full refresh")
+        since = None
+    if payment_events and since is not None and read_watermark(EVENTS_WATERMARK_NAME) is None:
+        print("⚠️ No payment events consumed yet, falling back to full refresh")
+        since = None
+
+    changed_users = None
+    if since is None:
+        print("Start pulling data from db (full refresh):")
+    else:
+        watermark = since
+        since = watermark - WATERMARK_LOOKBACK
+        print(f"Start pulling data from db (loans modified since {since}):")
+        changed_users = fetch_data(CHANGED_USERS_QUERY.format(since=_since_literal(since)))
+        # The lookback window can only re-read rows, never move the watermark back
+        new_watermark = max(watermark, changed_users["ModifiedAt"].max()) if not changed_users.empty else watermark
+
+    touched = None
+    if payment_events:
+        events_watermark = read_watermark(EVENTS_WATERMARK_NAME) if since is not None else None
+        events_since = events_watermark - WATERMARK_LOOKBACK if events_watermark is not None else None
+        touched, new_events_watermark = update_payment_events(events_since)
+        if events_watermark is not None and new_events_watermark is not None:
+            new_events_watermark = max(events_watermark, new_events_watermark)
+        else:
+            new_events_watermark = new_events_watermark or events_watermark
+
+    has_changes = since is None or not changed_users.empty or (touched is not None and not touched.empty)
+
+    # sources: in-memory pulls, or None when they are staged in STAGING_DIR (or nothing changed)
+    sources = None
+    if not has_changes:
+        print("No loans changed since last run.")
+    elif payment_events:
+        stage_sources_from_events(since, changed_users, touched)
+    elif engine == "partitioned":
+        stage_sources_streaming(since, changed_users)
+    else:
+        sources = fetch_sources(since)
+
+    if since is None:
+        if sources is not None:
+            new_watermark = sources[0]["ModifiedAt"].max()
+        else:
+            new_watermark = duckdb.sql(
+                f"SELECT max(ModifiedAt) FROM read_parquet('{Path(STAGING_DIR, 'loans.parquet').as_posix()}')"
+            ).fetchone()[0]
+
+    previous_base_path = BASE_FILE if since is not None else None
+    if engine == "partitioned":
+        build_partitioned(previous_base_path=previous_base_path, has_changes=has_changes)
+    elif engine == "duckdb":
+        print("🦆 Building fact_loan with DuckDB")
+        con = loan_duckdb_utils.connect()
+        if has_changes:
+            if sources is not None:
+                stage_sources(sources, changed_users)
+            loan_duckdb_utils.build_base_duckdb(con, STAGING_DIR, BASE_FILE, previous_base_path=previous_base_path)
+        strategies_file = os.path.join(OUTPUT_DIR, "collections_strategies.parquet")
+        loan_duckdb_utils.build_final_duckdb(con, BASE_FILE, strategies_file, OUTPUT_FILE)
+    else:
+        if has_changes and sources is None:
+            sources = read_staged_sources()
+        base = pd.read_parquet(BASE_FILE) if previous_base_path is not None else None
+        base, loans_clean = build_pandas(sources, base, changed_users)
+        write_parquet(base, BASE_FILE)
+        write_parquet(apply_type_policy(loans_clean), OUTPUT_FILE)
+    print("Loan repayment parquet stored locally.")
+
+    # Only advance the watermarks once the outputs are written, both in one write:
+    # they describe the same fact_loan, so they must never get out of step
+    watermarks = {WATERMARK_NAME: new_watermark}
+    if payment_events:
+        watermarks[EVENTS_WATERMARK_NAME] = new_events_watermark
+    write_watermarks(watermarks)
+
+
+def _parity_schema(schema):
+    """
+    The schema with the encoding differences the parity check accepts removed:
+    labels are dictionary-encoded by pandas (categoricals) and plain strings in
+    DuckDB's output, and pandas writes large_string where DuckDB writes string.
+    Both read back as the same VARCHAR / ENUM in the warehouse. Every other
+    type must match exactly.
+    """
+    fields = []
+    for field in schema:
+        type_ = field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+        fields.append(field.with_type(pa.string() if pa.types.is_large_string(type_) else type_))
+    return pa.schema(fields)
+
+
+def check_duckdb_parity(staging_dir=STAGING_DIR, strategies_file="collections_strategies.parquet"):
+    """
+    Run the pandas and DuckDB engines on the same staged full pull and compare
+    the loan.parquet files they write: Arrow types (see _parity_schema for the
+    accepted encoding differences), then values row by row with dtypes
+    enforced. Raises AssertionError on mismatch.
+    """
+    today = pd.Timestamp.now().normalize()
+    now_cdmx = pd.Timestamp.now(tz="America/Mexico_City").tz_localize(None)
+    sources = read_staged_sources(staging_dir)
+
+    _, expected = build_pandas(sources, today=today, now_cdmx=now_cdmx, strategies_file=strategies_file)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Written as the pandas engine writes OUTPUT_FILE
+        expected_path = os.path.join(tmp, "expected.parquet")
+        write_parquet(apply_type_policy(expected), expected_path)
+        expected = pq.read_table(expected_path)
+
+        base_path = os.path.join(tmp, "loan_base.parquet")
+        output_path = os.path.join(tmp, "loan.parquet")
+        loan_duckdb_utils.build_loan_duckdb(
+            staging_dir, os.path.join(OUTPUT_DIR, strategies_file), base_path, output_path,
+            today=today, now_cdmx=now_cdmx,
+        )
+        actual = pq.read_table(output_path)
+
+    expected_schema = _parity_schema(expected.schema.remove_metadata())
+    actual_schema = _parity_schema(actual.schema.remove_metadata())
+    differences = [
+        f"{e.name}: pandas {e.type}, duckdb {a.type}"
+        for e, a in zip(expected_schema, actual_schema) if e.name != a.name or e.type != a.type
+    ]
+    assert expected_schema.names == actual_schema.names and not differences, (
+        "schemas differ:\n" + "\n".join(differences or [f"{expected_schema.names}\n{actual_schema.names}"])
     )
-    else row["CreatedAtCDMX"],
-    axis=1
-)
-
-loans_clean["StrategyName"] = loans_clean["StrategyName"].fillna("Twilio")
 
-# Remove no needed columns
-loans_clean = loans_clean.drop(columns=["CreatedAt", "CreatedAtCDMX", "IsDeleted", "StrategyType"])
+    keys = ["UserLoanId", "LateStrategyCreatedAt"]
+    expected = expected.cast(expected_schema).to_pandas(types_mapper=pd.ArrowDtype)
+    actual = actual.cast(actual_schema).to_pandas(types_mapper=pd.ArrowDtype)
+    expected = expected.sort_values(keys, ignore_index=True)
+    actual = actual.sort_values(keys, ignore_index=True)
+    pd.testing.assert_frame_equal(actual, expected)
+    print(f"✅ DuckDB engine matches pandas on {len(expected)} loans.")
 
-# ADD PYPPER 20+ TEST
-pypper = fetch_parquet(parquet_file="collections_strategies.parquet")
 
-pypper = stgy_df[stgy_df['Strategy'] == 14]
-pypper = pypper[['UserLoanId', 'Strategy', 'StrategyName', 'CreatedAt', 'CreatedAtCDMX']]
-pypper = pypper.rename(columns={'CreatedAt': 'LateStrategyCreatedAt', 'CreatedAtCDMX': 'LateStrategyCreatedAtCDMX', 'StrategyName': 'LateStrategyName', 'Strategy': 'LateStrategy'})
-
-loans_clean = loans_clean.merge(pypper, on="UserLoanId", how="left")
-
-print("Final data set created successfully.")
-
-loans_clean.to_parquet(OUTPUT_FILE, index=False)
-print("Loan repayment parquet stored locally.")
\ No newline at end of file
+if __name__ == "__main__":
+    if "--check-duckdb-parity" in sys.argv:
+        check_duckdb_parity()
+    else:
+        engine = sys.argv[sys.argv.index("--engine") + 1] if "--engine" in sys.argv else LOAN_ENGINE
+        main(
+            incremental=(
+                ("--incremental" in sys.argv or os.getenv("LOAN_INCREMENTAL") == "1")
+                and "--full-refresh" not in sys.argv
+            ),
+            engine=engine,
+            payment_events="--payment-events" in sys.argv or LOAN_PAYMENT_EVENTS,
+        )
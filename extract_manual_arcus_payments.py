@@ -2,6 +2,7 @@ import os
 import pandas as pd
 from pathlib import Path
 from dotenv import load_dotenv
+from utils.dataset_utils import dataset_rows, migrate_file, write_partitioned
 from utils.gsheets_utils import list_files_in_folder, load_drive_file_as_dataframe
 
 # Load environment variables
@@ -18,12 +19,17 @@ if not PAYMENTS_FOLDER_ID:
 
 # Local tracking and output paths
 processed_log = Path("data/arcus_processed_payments_folders.txt")
-output_parquet = Path("data/arcus_payments_raw.parquet")
+# Hive-partitioned by month of `creation_date`, one part file per source folder
+# (utils/dataset_utils.py); new folders are appended, earlier ones are kept
+output_dataset = Path("data/arcus_payments_raw")
 
 # Ensure log file exists
 processed_log.parent.mkdir(parents=True, exist_ok=True)
 processed_log.touch(exist_ok=True)
 
+# The single file written by earlier versions becomes the dataset's first parts
+migrate_file(Path("data/arcus_payments_raw.parquet"), output_dataset, "creation_date")
+
 # Read already processed folder IDs
 with open(processed_log, "r") as f:
     processed_folders = set(line.strip() for line in f.readlines())
@@ -41,7 +47,7 @@ payment_subfolders_sorted = sorted(payment_subfolders, key=lambda x: x["name"])
 
 # Track processed this run
 processed_this_run = []
-all_dfs = []
+new_rows = 0
 
 for folder in payment_subfolders_sorted:
     folder_id = folder["id"]
@@ -56,6 +62,7 @@ for folder in payment_subfolders_sorted:
     # List CSV files inside this subfolder
     csv_files = list_files_in_folder(folder_id)
     csv_files = [f for f in csv_files if f["name"].lower().endswith(".csv")]
+    folder_dfs = []
 
     for csv_file in csv_files:
         file_id = csv_file["id"]
@@ -75,33 +82,32 @@ for folder in payment_subfolders_sorted:
                 print(f"⚠️ Skipping {file_name} (empty after dropping totals).")
                 continue
 
-            all_dfs.append(df)
+            folder_dfs.append(df)
         except Exception as e:
             print(f"❌ Error processing {file_name}: {e}")
 
-    processed_this_run.append(folder_id)
-
-if not all_dfs:
-    print("⚠️ No new valid data to process.")
-    exit()
-    
-# Combine everything
-final_df = pd.concat(all_dfs, ignore_index=True)
+    if folder_dfs:
+        folder_df = pd.concat(folder_dfs, ignore_index=True)
 
-# Convert from cents to currency units
-final_df["amount"] = final_df["amount"] / 100
+        # Convert from cents to currency units
+        folder_df["amount"] = folder_df["amount"] / 100
 
-final_df['creation_date'] = pd.to_datetime(final_df['creation_date'], utc=True)
-final_df['update_date'] = pd.to_datetime(final_df['update_date'], utc=True)
+        folder_df['creation_date'] = pd.to_datetime(folder_df['creation_date'], utc=True)
+        folder_df['update_date'] = pd.to_datetime(folder_df['update_date'], utc=True)
 
-# Save as Parquet
-output_parquet.parent.mkdir(parents=True, exist_ok=True)
-final_df.to_parquet(output_parquet, index=False)
-print(f"✅ Data exported to {output_parquet}")
+        # Append the folder as new part files; only the new rows are written
+        months = write_partitioned(folder_df, output_dataset, "creation_date", source=folder_name)
+        new_rows += len(folder_df)
+        print(f"📎 Appended {len(folder_df)} rows in {len(months)} monthly partitions")
 
-# Update log with folder IDs
-with open(processed_log, "a") as f:
-    for folder_id in processed_this_run:
+    # Log the folder once its parts are published, so a crash re-runs it (replacing its parts)
+    with open(processed_log, "a") as f:
         f.write(f"{folder_id}\n")
+    processed_this_run.append(folder_id)
+
+if not new_rows:
+    print("⚠️ No new valid data to process.")
+    exit()
 
+print(f"✅ Data exported to {output_dataset}/ ({new_rows} new rows, total: {dataset_rows(output_dataset)} rows)")
 print(f"📝 Logged {len(processed_this_run)} folders as processed.")
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""
+Payment Events (fact_payment_event)
+
+Builds data/payment_events.parquet: one row per payment transaction and loan,
+for the four channels that feed fact_loan:
+- arcus: Arcus SPEI payments (UserLoanArcusTransactions, non-distribution)
+- stripe: Stripe card payments
+- dispute: lost Stripe disputes (one row per dispute)
+- cash: Openpay cash payments (non-distribution)
+
+Columns: Source, TransactionId, UserLoanId, Amount, PaidAt, IsCounted, ModifiedAt
+IsCounted applies the same status rules as the aggregate queries in
+extract_loan_detail.py, so a transaction that changes status is re-pulled and
+stops (or starts) counting.
+
+Incremental: only transactions (or disputes) with ModifiedAt after the
+watermark are pulled; each replaces its previous version in the file. The
+returned UserLoanIds are the loans whose payments may have changed. Hard
+deletes are only picked up by a full refresh.
+
+Usage:
+    python extract_payment_events.py                  # incremental
+    python extract_payment_events.py --full-refresh
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+from utils.fetch_data_utils import fetch_data_to_parquet
+from utils.watermark_utils import read_watermark, write_watermark
+from utils.write_parquet_utils import copy_to_parquet
+
+OUTPUT_DIR = os.getenv("DATA_DIR", "data")
+EVENTS_FILE = os.path.join(OUTPUT_DIR, "payment_events.parquet")
+STAGING_DIR = os.path.join(OUTPUT_DIR, "staging", "payment_events")
+
+WATERMARK_NAME = "payment_events"
+WATERMARK_LOOKBACK = pd.Timedelta(hours=int(os.getenv("LOAN_WATERMARK_LOOKBACK_HOURS", "2")))
+
+EVENT_SCHEMA = pa.schema([
+    ("Source", pa.string()),
+    ("TransactionId", pa.string()),
+    ("UserLoanId", pa.string()),
+    ("Amount", pa.float64()),
+    ("PaidAt", pa.timestamp("us")),
+    ("IsCounted", pa.bool_()),
+    ("ModifiedAt", pa.timestamp("us")),
+])
+
+# ========================================
+# SOURCE QUERIES
+# ========================================
+# {since_filter} is empty on a full refresh.
+
+ARCUS_EVENTS_QUERY = """
+select
+    'arcus' as Source,
+    ar.ArcusTransactionId as TransactionId,
+    ulat.UserLoanId,
+    ar.Amount,
+    ar.CompletedAt as PaidAt,
+    case when ar.Status != 2 then 1 else 0 end as IsCounted,
+    ar.ModifiedAt
+from UserLoanArcusTransactions ulat
+    join ArcusTransactions ar on ar.ArcusTransactionId = ulat.ArcusTransactionId
+where
+    ulat.IsDistribution = 0 -- only credit/in transactions
+    {since_filter}
+"""
+
+STRIPE_EVENTS_QUERY = """
+select
+    'stripe' as Source,
+    st.StripeTransactionId as TransactionId,
+    ulst.UserLoanId,
+    st.Amount,
+    st.CreatedAt as PaidAt,
+    case when st.Status = 1 then 1 else 0 end as IsCounted, -- Succeded
+    st.ModifiedAt
+from UserLoanStripeTransactions ulst
+    join StripeTransactions st ON ulst.StripeTransactionId = st.StripeTransactionId
+where 1 = 1
+{since_filter}
+"""
+
+DISPUTE_EVENTS_QUERY = """
+select
+    'dispute' as Source,
+    sd.StripeDisputeId as TransactionId,
+    ulst.UserLoanId,
+    st.Amount,
+    st.CreatedAt as PaidAt,
+    case when st.Status = 1 and sd.DisputeStatus = 2 then 1 else 0 end as IsCounted, -- remediatedlost
+    case when sd.ModifiedAt > st.ModifiedAt then sd.ModifiedAt else st.ModifiedAt end as ModifiedAt
+from UserLoanStripeTransactions ulst
+    join StripeTransactions st ON ulst.StripeTransactionId = st.StripeTransactionId
+    join StripeDispute sd on sd.StripeTransactionId = st.StripeTransactionId
+where 1 = 1
+{since_filter}
+"""
+
+CASH_EVENTS_QUERY = """
+select
+    'cash' as Source,
+    ot.OpenpayTransactionId as TransactionId,
+    ulot.UserLoanId,
+    ot.Amount,
+    ot.CreatedAt as PaidAt,
+    case when ot.Status = 2 then 1 else 0 end as IsCounted,
+    ot.ModifiedAt
+from UserLoanOpenpayTransactions ulot
+    join OpenpayTransactions ot on ulot.OpenpayTransactionId = ot.OpenpayTransactionId
+where ulot.IsDistribution = 0
+{since_filter}
+"""
+
+EVENT_QUERIES = {
+    "arcus": (ARCUS_EVENTS_QUERY, ["ar.ModifiedAt"]),
+    "stripe": (STRIPE_EVENTS_QUERY, ["st.ModifiedAt"]),
+    "dispute": (DISPUTE_EVENTS_QUERY, ["st.ModifiedAt", "sd.ModifiedAt"]),
+    "cash": (CASH_EVENTS_QUERY, ["ot.ModifiedAt"]),
+}
+
+# Per-loan aggregates in the shape of the ARCUS/STRIPE/DISPUTE/CASH queries of
+# extract_loan_detail.py. Amounts are summed as decimals like SQL Server does.
+AGGREGATE_SQL = {
+    "arcus": """
+        SELECT UserLoanId,
+            CAST(sum(CAST(Amount AS DECIMAL(38, 4))) AS DOUBLE) AS AmountPaidArcus,
+            max(PaidAt) AS LastPaidAtArcus
+        FROM events WHERE Source = 'arcus' AND IsCounted {loan_filter}
+        GROUP BY UserLoanId
+    """,
+    "stripe": """
+        SELECT UserLoanId,
+            CAST(sum(CAST(Amount AS DECIMAL(38, 4))) AS DOUBLE) AS AmountPaidStripe,
+            max(PaidAt) AS LastPaidAtStripe
+        FROM events WHERE Source = 'stripe' AND IsCounted {loan_filter}
+        GROUP BY UserLoanId
+    """,
+    "dispute": """
+        SELECT UserLoanId,
+            CAST(sum(CAST(Amount AS DECIMAL(38, 4))) AS DOUBLE) AS DisputeAmount
+        FROM events WHERE Source = 'dispute' AND IsCounted {loan_filter}
+        GROUP BY UserLoanId
+    """,
+    "cash": """
+        SELECT UserLoanId,
+            CAST(sum(CAST(Amount AS DECIMAL(38, 4))) AS DOUBLE) AS AmountPaidCash,
+            max(PaidAt) AS LastPaidAtCash
+        FROM events WHERE Source = 'cash' AND IsCounted {loan_filter}
+        GROUP BY UserLoanId
+    """,
+}
+
+
+def _since_filter(columns, since):
+    if since is None:
+        return ""
+    literal = since.strftime("%Y-%m-%d %H:%M:%S")
+    return "and (" + " or ".join(f"{column} > '{literal}'" for column in columns) + ")"
+
+
+def _event_chunk(chunk):
+    """Per-chunk typing so every source lands in EVENT_SCHEMA."""
+    chunk["TransactionId"] = chunk["TransactionId"].astype(str)
+    chunk["UserLoanId"] = chunk["UserLoanId"].astype(str)
+    chunk["Amount"] = chunk["Amount"].astype("float64")
+    chunk["PaidAt"] = pd.to_datetime(chunk["PaidAt"], errors="coerce").astype("datetime64[us]")
+    chunk["IsCounted"] = chunk["IsCounted"].astype(bool)
+    chunk["ModifiedAt"] = pd.to_datetime(chunk["ModifiedAt"], errors="coerce").astype("datetime64[us]")
+    return chunk[EVENT_SCHEMA.names]
+
+
+def _parquet(path):
+    return f"read_parquet('{Path(path).as_posix()}')"
+
+
+def update_payment_events(since=None, staging_dir=STAGING_DIR):
+    """
+    Pull payment events changed after since (None: all) and merge them into EVENTS_FILE.
+
+    Returns (touched, new_watermark): the distinct UserLoanIds of the pulled
+    rows (None on a full refresh) and the latest ModifiedAt pulled.
+    """
+    if since is not None and not os.path.exists(EVENTS_FILE):
+        print(f"⚠️ {EVENTS_FILE} not found, pulling every payment event")
+        since = None
+
+    os.makedirs(staging_dir, exist_ok=True)
+    pulled = []
+    for source, (query, modified_columns) in EVENT_QUERIES.items():
+        path = os.path.join(staging_dir, f"{source}.parquet")
+        rows = fetch_data_to_parquet(
+            query.format(since_filter=_since_filter(modified_columns, since)),
+            path,
+            transform=_event_chunk,
+            schema=EVENT_SCHEMA,
+        )
+        print(f"✅ {source} events: {rows} rows")
+        pulled.append(_parquet(path))
+
+    con = duckdb.connect()
+    con.execute(f"CREATE TEMP TABLE new_events AS {' UNION ALL '.join(f'SELECT * FROM {p}' for p in pulled)}")
+    new_watermark = con.execute("SELECT max(ModifiedAt) FROM new_events").fetchone()[0]
+
+    if since is None:
+        copy_to_parquet(con, "SELECT * FROM new_events", EVENTS_FILE)
+        touched = None
+    else:
+        # A re-pulled row replaces its previous version (same source, transaction and loan)
+        copy_to_parquet(con, f"""
+            SELECT * FROM {_parquet(EVENTS_FILE)} e
+            WHERE NOT EXISTS (
+                SELECT 1 FROM new_events n
+                WHERE n.Source = e.Source AND n.TransactionId = e.TransactionId AND n.UserLoanId = e.UserLoanId
+            )
+            UNION ALL
+            SELECT * FROM new_events
+        """, EVENTS_FILE)
+        touched = con.execute("SELECT DISTINCT UserLoanId FROM new_events").df()["UserLoanId"]
+        print(f"💳 {len(touched)} loans with new or changed payment events")
+    con.close()
+
+    return touched, new_watermark
+
+
+def stage_payment_aggregates(loans_path, staging_dir):
+    """
+    Write arcus/stripe/dispute/cash.parquet to staging_dir: per-loan payment
+    aggregates from EVENTS_FILE for the loans in loans_path.
+    """
+    con = duckdb.connect()
+    con.execute(f"CREATE VIEW events AS SELECT * FROM {_parquet(EVENTS_FILE)}")
+    loan_filter = f"AND UserLoanId IN (SELECT CAST(UserLoanId AS VARCHAR) FROM {_parquet(loans_path)})"
+    for source, sql in AGGREGATE_SQL.items():
+        output_path = Path(staging_dir) / f"{source}.parquet"
+        copy_to_parquet(con, sql.format(loan_filter=loan_filter), output_path)
+    con.close()
+
+
+def main(full_refresh=False):
+    since = None if full_refresh else read_watermark(WATERMARK_NAME)
+    if since is not None:
+        since -= WATERMARK_LOOKBACK
+    print("Start pulling payment events from db" + (f" (modified since {since}):" if since is not None else ":"))
+
+    _, new_watermark = update_payment_events(since)
+    print("Payment events parquet stored locally.")
+
+    # The lookback window can only re-read rows, never move the watermark back
+    previous = read_watermark(WATERMARK_NAME)
+    if previous is not None and new_watermark is not None:
+        new_watermark = max(previous, new_watermark)
+    write_watermark(WATERMARK_NAME, new_watermark)
+
+
+if __name__ == "__main__":
+    main(full_refresh="--full-refresh" in sys.argv)
@@ -11,6 +11,7 @@ Outputs: Excel files uploaded to Google Drive folders
 """
 
 import pandas as pd
+import pyarrow.compute as pc
 import os
 from dotenv import load_dotenv
 from utils.fetch_parquet_utils import fetch_parquet
@@ -33,8 +34,17 @@ REFERRALS_DETAIL_FOLDER_ID = os.getenv("REFERRALS_DETAIL_FOLDER_ID")
 pd.set_option('display.max_columns', None)
 pd.set_option('display.float_format', '{:.2f}'.format)
 
-loans_data = fetch_parquet(parquet_file="loan.parquet")
-loans = loans_data[loans_data['LoanStatus'] != 6].copy()
+# Only the columns used below are read, and DisbursementFailed loans are skipped by the reader
+# (as an expression: the list form ('LoanStatus', '!=', 6) would also drop NULL LoanStatus)
+LOAN_COLUMNS = [
+    'UserId', 'UserLoanId', 'IssueDate', 'IssueDateCDMX', 'DueDate', 'LoanStatus', 'LoanNumber', 'IsLate',
+    'PrincipalAmount', 'Fee', 'TaxOnFee', 'LateFee', 'TaxOnLateFee', 'TotalAmountDue',
+    'LateFeePaid', 'TaxOnLateFeePaid', 'FeePaid', 'TaxOnFeePaid', 'PrincipalPaid', 'TotalAmountPaid',
+    'JitOfferPolicy', 'JitOfferPolicyName', 'LastPaidDate', 'LastPaidDateCDMX',
+    'SettledAt', 'SettledAtCDMX', 'DisputeAmount',
+]
+NOT_DISBURSEMENT_FAILED = ~(pc.field('LoanStatus') == 6) | pc.field('LoanStatus').is_null()
+loans = fetch_parquet(parquet_file="loan.parquet", columns=LOAN_COLUMNS, filters=NOT_DISBURSEMENT_FAILED)
 
 # Flag loans that are settled but underpaid (paid less than due)
 loans['UnderpaidFlag'] = np.where(
@@ -0,0 +1,409 @@
+"""
+Parquet Catalog
+
+A small JSON catalog (data/catalog.json) of the Parquet files under the data
+directory: schema, rows, row groups, bytes and per-column min / max / null
+count, all taken from the file footer when the file is written
+(write_parquet_utils, fetch_data_to_parquet, combine_parts, dataset parts).
+Questions about row counts, date ranges or schemas are answered from it in
+milliseconds instead of by scanning the data.
+
+An entry is only used while the file's size and mtime match it. A file
+written by something that does not record it (or a lost catalog) gets its
+footer read again on lookup and its entry refreshed, so the catalog can be
+missing entries but never serves stale ones (concurrent writers can only
+lose each other's new entries). Files outside the data directory or in its
+scratch directories are read from their footer and not stored.
+
+Dataset directories (dataset_utils) are the sum of their part files: rows
+and bytes add up, min / max are taken over every part. Hive partition keys are
+not in the files and have no statistics.
+
+Temporal columns also keep their min / max per row group, so column_months can
+list the months a file holds when no row group spans two months (files
+written with the row_group_period setting of write_parquet_utils).
+
+Usage:
+    from utils.catalog_utils import column_months, column_range, lookup, row_count
+
+    row_count("data/loan.parquet")
+    column_range("data/arcus_transactions_raw", "date")     # (min, max) over all parts
+    column_months("data/growth_data.parquet", "install_day")
+
+List (and refresh) every file, or compare the catalog with full DuckDB scans:
+    python -m utils.catalog_utils
+    python -m utils.catalog_utils --check
+"""
+
+import datetime
+import decimal
+import json
+import math
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
+CATALOG_FILE = Path(os.getenv("PARQUET_CATALOG", DATA_DIR / "catalog.json"))
+# Scratch files of the extracts (pulls, loan bucket parts), not worth cataloguing
+SKIP_DIRS = {"staging", "loan_parts"}
+
+_lock = threading.Lock()
+
+
+# ========================================
+# FOOTERS
+# ========================================
+
+def _to_json(value):
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, (datetime.datetime, pd.Timestamp)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return None  # binary and other types: no usable min / max
+
+
+def _from_json(value, type_):
+    if value is None:
+        return None
+    if type_.startswith("timestamp"):
+        return pd.Timestamp(value)
+    if type_.startswith("date"):
+        return datetime.date.fromisoformat(value)
+    if type_.startswith("decimal"):
+        return decimal.Decimal(value)
+    return value
+
+
+def _is_temporal(type_):
+    return type_.startswith(("timestamp", "date"))
+
+
+def _stat_value(value, field):
+    # Nanosecond timestamps come back as integers
+    if isinstance(value, int) and pa.types.is_timestamp(field.type):
+        return pd.Timestamp(value, unit=field.type.unit)
+    return value
+
+
+def footer_entry(path):
+    """Catalog entry of one Parquet file, read from its footer only."""
+    path = Path(path)
+    stat = path.stat()
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    schema = parquet_file.schema_arrow
+
+    # Per column: [min, max, nulls]; None once a row group has no statistics for it
+    stats = {field.name: [None, None, 0] for field in schema}
+    ranges = {field.name: [] for field in schema if _is_temporal(str(field.type))}
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            chunk = row_group.column(j)
+            name = chunk.path_in_schema
+            if stats.get(name) is None:
+                continue  # nested leaf, or already unknown
+            statistics = chunk.statistics
+            all_null = statistics is not None and statistics.has_null_count and statistics.null_count == chunk.num_values
+            if statistics is None or not statistics.has_null_count or not (statistics.has_min_max or all_null):
+                stats[name] = None
+                ranges.pop(name, None)
+                continue
+            column = stats[name]
+            column[2] += statistics.null_count
+            if all_null:
+                continue
+            field = schema.field(name)
+            low, high = _stat_value(statistics.min, field), _stat_value(statistics.max, field)
+            column[0] = low if column[0] is None else min(column[0], low)
+            column[1] = high if column[1] is None else max(column[1], high)
+            if name in ranges:
+                ranges[name].append([_to_json(low), _to_json(high)])
+
+    columns = {
+        name: {"min": None, "max": None, "nulls": None} if column is None
+        else {"min": _to_json(column[0]), "max": _to_json(column[1]), "nulls": column[2]}
+        for name, column in stats.items()
+    }
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "rows": metadata.num_rows,
+        "row_groups": metadata.num_row_groups,
+        "uncompressed": sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups)),
+        "schema": {field.name: str(field.type) for field in schema},
+        "columns": columns,
+        "row_group_ranges": ranges,
+    }
+
+
+# ========================================
+# STORE
+# ========================================
+
+def _relative(path):
+    try:
+        relative = Path(path).resolve().relative_to(CATALOG_FILE.parent.resolve())
+    except ValueError:
+        return None
+    return None if not relative.parts or relative.parts[0] in SKIP_DIRS else relative
+
+
+def _key(path):
+    """Catalog key of a file (path relative to the data directory), or None if it is not catalogued."""
+    relative = _relative(path)
+    return relative.as_posix() if relative is not None and relative.suffix == ".parquet" else None
+
+
+def _read():
+    try:
+        with open(CATALOG_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write(catalog):
+    tmp_path = CATALOG_FILE.with_name(f"{CATALOG_FILE.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, CATALOG_FILE)
+
+
+def _update(entries, removed=()):
+    """Store {key: entry} and drop removed keys in one read-modify-write."""
+    if not entries and not removed:
+        return
+    with _lock:
+        catalog = _read()
+        catalog.update(entries)
+        for key in removed:
+            catalog.pop(key, None)
+        _write(catalog)
+
+
+def record(*paths):
+    """Refresh the entries of freshly written files (call after the rename)."""
+    entries = {}
+    for path in paths:
+        key = _key(path)
+        if key is not None:
+            entries[key] = footer_entry(path)
+    _update(entries)
+
+
+def _current(catalog, path, refreshed):
+    key = _key(path)
+    entry = catalog.get(key) if key is not None else None
+    stat = path.stat()
+    if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+        entry = footer_entry(path)
+        if key is not None:
+            refreshed[key] = entry
+    return entry
+
+
+def _combine(parts):
+    """Dataset entry from its part entries."""
+    schema, columns, ranges = {}, {}, {}
+    for entry in parts:
+        for name, type_ in entry["schema"].items():
+            schema.setdefault(name, type_)
+    for name, type_ in schema.items():
+        stats = [entry["columns"].get(name) for entry in parts]
+        present = [s for s in stats if s is not None]
+        if any(s["nulls"] is None for s in present):
+            columns[name] = {"min": None, "max": None, "nulls": None}
+        else:
+            values = [s for s in present if s["min"] is not None]
+            # A part without the column has it as NULL (union_by_name)
+            missing_rows = sum(entry["rows"] for entry, s in zip(parts, stats) if s is None)
+            columns[name] = {
+                "min": min((_from_json(s["min"], type_) for s in values), default=None),
+                "max": max((_from_json(s["max"], type_) for s in values), default=None),
+                "nulls": sum(s["nulls"] for s in present) + missing_rows,
+            }
+        if _is_temporal(type_) and all(name in entry["row_group_ranges"] for entry in parts if name in entry["schema"]):
+            ranges[name] = [r for entry in parts for r in entry["row_group_ranges"].get(name, [])]
+    return {
+        "files": len(parts),
+        "size": sum(entry["size"] for entry in parts),
+        "rows": sum(entry["rows"] for entry in parts),
+        "row_groups": sum(entry["row_groups"] for entry in parts),
+        "uncompressed": sum(entry["uncompressed"] for entry in parts),
+        "schema": schema,
+        "columns": {name: {**stats, "min": _to_json(stats["min"]), "max": _to_json(stats["max"])}
+                    for name, stats in columns.items()},
+        "row_group_ranges": ranges,
+    }
+
+
+def lookup(path):
+    """
+    Entry of a Parquet file or dataset directory: size, rows, row_groups,
+    uncompressed, schema {column: Arrow type}, columns {column: min/max/nulls}
+    (min/max as JSON values, see column_range for typed ones). A dataset also
+    has files. Reads the footers of new or rewritten files only.
+    """
+    path = Path(path)
+    catalog = _read()
+    refreshed, removed = {}, []
+    if path.is_dir():
+        files = sorted(path.rglob("*.parquet"))
+        entry = _combine([_current(catalog, file, refreshed) for file in files])
+        relative = _relative(path)
+        if relative is not None:
+            # Parts that were replaced or deleted since they were recorded
+            present = {_key(file) for file in files}
+            prefix = relative.as_posix() + "/"
+            removed = [key for key in catalog if key.startswith(prefix) and key not in present]
+    elif path.exists():
+        entry = _current(catalog, path, refreshed)
+    else:
+        key = _key(path)
+        if key in catalog:
+            _update({}, [key])
+        raise FileNotFoundError(path)
+    _update(refreshed, removed)
+    return entry
+
+
+# ========================================
+# QUESTIONS
+# ========================================
+
+def row_count(path):
+    return lookup(path)["rows"]
+
+
+def column_range(path, column):
+    """(min, max) of a column from the statistics, typed (Timestamp, date, ...); None when unknown."""
+    entry = lookup(path)
+    type_ = entry["schema"].get(column)
+    stats = entry["columns"].get(column)
+    if stats is None or stats["nulls"] is None:
+        return None
+    return _from_json(stats["min"], type_), _from_json(stats["max"], type_)
+
+
+def column_months(path, column):
+    """
+    Set of months (month-start Timestamps) that have a value in a temporal
+    column, from the row group ranges. None when a row group spans more than
+    one month (the statistics cannot tell which months in between exist).
+    """
+    entry = lookup(path)
+    type_ = entry["schema"].get(column, "")
+    ranges = entry["row_group_ranges"].get(column)
+    if not _is_temporal(type_) or ranges is None:
+        return None
+    months = set()
+    for low, high in ranges:
+        if low is None:
+            continue
+        low, high = pd.Timestamp(low).to_period("M"), pd.Timestamp(high).to_period("M")
+        if low != high:
+            return None
+        months.add(low.start_time)
+    return months
+
+
+# ========================================
+# CLI
+# ========================================
+
+def catalog_paths(data_dir=None):
+    """Every catalogued file and dataset directory under data_dir (datasets as one path)."""
+    data_dir = Path(data_dir or CATALOG_FILE.parent)
+    paths = set()
+    for file in data_dir.rglob("*.parquet"):
+        if _key(file) is None:
+            continue
+        top = data_dir / file.relative_to(data_dir).parts[0]
+        paths.add(top)
+    return sorted(paths)
+
+
+def _first_temporal(entry):
+    return next((name for name, type_ in entry["schema"].items() if _is_temporal(type_)), None)
+
+
+def show_catalog(paths):
+    """Refresh and print the catalog of paths."""
+    print(f"{'path':<40} {'files':>6} {'rows':>12} {'groups':>7} {'MB':>8}  range")
+    for path in paths:
+        entry = lookup(path)
+        column = _first_temporal(entry)
+        span = column_range(path, column) if column else None
+        span = f"{column}: {span[0]} → {span[1]}" if span else ""
+        print(
+            f"{Path(path).name:<40} {entry.get('files', 1):>6} {entry['rows']:>12,} "
+            f"{entry['row_groups']:>7} {entry['size'] / 1024 ** 2:8.2f}  {span}"
+        )
+
+
+def check_catalog(paths):
+    """
+    Compare rows and per-column min / max of the catalog with a full DuckDB
+    scan of every path. Returns the number of mismatches.
+    """
+    con = duckdb.connect()
+    mismatches = 0
+    for path in paths:
+        start = time.perf_counter()
+        entry = lookup(path)
+        catalog_ms = (time.perf_counter() - start) * 1000
+
+        path = Path(path)
+        source = (
+            f"read_parquet('{(path / '**' / '*.parquet').as_posix()}', union_by_name = true)"
+            if path.is_dir() else f"read_parquet('{path.as_posix()}')"
+        )
+        checked = [name for name, stats in entry["columns"].items() if stats["nulls"] is not None]
+
+        def aggregate(function, name):
+            # Timestamps compared as epoch microseconds (time zones aside)
+            sql = f'{function}("{name}")'
+            return f"epoch_us({sql})" if entry["schema"][name].startswith("timestamp") else sql
+
+        select = ", ".join(
+            ["count(*)"] + [f"{aggregate('min', name)}, {aggregate('max', name)}" for name in checked]
+        )
+        start = time.perf_counter()
+        result = con.execute(f"SELECT {select} FROM {source}").fetchone()
+        scan_ms = (time.perf_counter() - start) * 1000
+
+        problems = [] if result[0] == entry["rows"] else [f"rows {entry['rows']} vs {result[0]}"]
+        for i, name in enumerate(checked):
+            expected = (result[1 + 2 * i], result[2 + 2 * i])
+            actual = column_range(path, name)
+            if entry["schema"][name].startswith("timestamp"):
+                actual = tuple(None if v is None else v.value // 1000 for v in actual)
+            if actual != expected:
+                problems.append(f"{name} {actual} vs {expected}")
+        mismatches += len(problems)
+        status = "✅" if not problems else "❌ " + "; ".join(problems)
+        print(f"{status} {path.name}: {entry['rows']:,} rows, catalog {catalog_ms:.1f} ms vs scan {scan_ms:.1f} ms")
+    con.close()
+    return mismatches
+
+
+if __name__ == "__main__":
+    paths = [Path(arg) for arg in sys.argv[1:] if not arg.startswith("--")] or catalog_paths()
+    if "--check" in sys.argv:
+        sys.exit(1 if check_catalog(paths) else 0)
+    show_catalog(paths)
@@ -0,0 +1,97 @@
+"""
+Append-only Parquet Dataset Utility
+
+Raw Arcus exports are kept as hive-partitioned datasets instead of one file
+that is read, concatenated and rewritten on every run:
+
+    data/arcus_transactions_raw/
+        date_month=2025-06-01/part-transactions_20250603.parquet
+        date_month=2025-07-01/part-transactions_20250702.parquet
+        date_month=__HIVE_DEFAULT_PARTITION__/...        rows without a date
+
+A batch (one source folder) is written as one part file per month it touches,
+so an append costs the size of the batch, not of the history. Parts are
+written to .tmp files and renamed once all are complete; part names come from
+the source, so re-running a folder after a crash replaces its parts instead of
+duplicating rows.
+
+DuckDB reads a dataset with read_parquet('<dir>/**/*.parquet',
+hive_partitioning = true): the partition key is a DATE column, and filters on
+it skip whole files (see dwh_utils.parquet_source_sql).
+"""
+
+import os
+import re
+from pathlib import Path
+
+import pandas as pd
+
+from utils.catalog_utils import record, row_count
+from utils.write_parquet_utils import write_parquet
+
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def _part_name(source):
+    return "part-" + re.sub(r"[^A-Za-z0-9_.-]", "_", str(source)) + ".parquet"
+
+
+def month_partitions(values):
+    """Partition value per row: first day of the month ('2025-06-01'), or the hive NULL partition."""
+    months = pd.to_datetime(values, utc=True).dt.tz_localize(None).dt.to_period("M").dt.start_time
+    return months.dt.strftime("%Y-%m-%d").fillna(DEFAULT_PARTITION)
+
+
+def write_partitioned(df, dataset_dir, date_column, source, partition_name=None):
+    """
+    Append df to dataset_dir as part files of `source`, partitioned by the
+    month of date_column (partition key <date_column>_month by default).
+    Replaces the parts a previous run of the same source left.
+    Returns {partition value: rows}.
+    """
+    dataset_dir = Path(dataset_dir)
+    partition_name = partition_name or f"{date_column}_month"
+    part_name = _part_name(source)
+
+    written = {}
+    try:
+        for month, part in df.groupby(month_partitions(df[date_column]).to_numpy(), sort=True):
+            directory = dataset_dir / f"{partition_name}={month}"
+            directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = directory / (part_name + ".tmp")
+            write_parquet(part, tmp_path)
+            written[directory / part_name] = (month, len(part))
+
+        # Every part is complete: publish them together
+        for path in written:
+            os.replace(path.with_name(path.name + ".tmp"), path)
+    finally:
+        for path in written:
+            path.with_name(path.name + ".tmp").unlink(missing_ok=True)
+
+    # Parts of an earlier run of this source in months the new batch does not touch
+    for stale in dataset_dir.glob(f"{partition_name}=*/{part_name}"):
+        if stale not in written:
+            stale.unlink()
+    record(*written)
+    return dict(written.values())
+
+
+def migrate_file(file_path, dataset_dir, date_column, partition_name=None):
+    """
+    One-time conversion of a single-file output into the dataset layout (as
+    source 'legacy'). The file is removed once its parts are published.
+    """
+    file_path = Path(file_path)
+    if not file_path.exists():
+        return 0
+    df = pd.read_parquet(file_path)
+    write_partitioned(df, dataset_dir, date_column, "legacy", partition_name)
+    file_path.unlink()
+    print(f"📦 Moved {len(df)} rows of {file_path.name} into {Path(dataset_dir).name}/")
+    return len(df)
+
+
+def dataset_rows(dataset_dir):
+    """Row count of every part file (from the Parquet catalog)."""
+    return row_count(dataset_dir) if Path(dataset_dir).exists() else 0
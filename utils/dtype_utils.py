@@ -0,0 +1,265 @@
+"""
+Column Type Policy
+
+One declaration of the compact type of the columns shared by the extracts and
+the warehouse, instead of each script picking its own:
+
+- id:    join keys (UserId, UserLoanId) → Arrow-backed strings in pandas,
+         VARCHAR in DuckDB. Numeric ids become "123", missing ones stay NULL.
+- label: low-cardinality text (status and policy names) → pandas categorical
+         (dictionary-encoded in Parquet), ENUM in DuckDB. A reloaded table keeps
+         the labels of its previous ENUM, in their order, and new labels are
+         appended: the type (and hash() of every value) stays the same from
+         load to load, so upserts and rollup fingerprints see only real changes.
+- flag:  0/1 integers → Int8 / TINYINT
+- code:  integer status / policy codes → Int16 / SMALLINT
+
+Amounts and counters keep their type: float32 would round money and the
+warehouse sums them, and DuckDB raises on SMALLINT overflow in arithmetic.
+A flag or code column is only narrowed when every value is a whole number
+that fits; otherwise (or when it is bool or text) it is left as it is.
+
+Usage:
+    from utils.dtype_utils import apply_type_policy, id_strings
+
+    df = apply_type_policy(df)                        # pandas, before to_parquet
+    source_sql = typed_source_sql(con, source_sql, previous=table)  # DuckDB, before (re)loading a table
+
+Savings report (pandas memory, Parquet and DuckDB bytes per file):
+    python -m utils.dtype_utils                       # every data/*.parquet
+    python -m utils.dtype_utils data/loan.parquet
+"""
+
+import hashlib
+import io
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+TYPE_POLICY = {
+    # Join keys
+    "UserId": "id",
+    "UserLoanId": "id",
+    # Labels
+    "LoanStatusDescription": "label",
+    "JitOfferPolicyName": "label",
+    "CreditPolicyName": "label",
+    "LoanCohort": "label",
+    "StrategyName": "label",
+    "StrategyType": "label",
+    "LateStrategyName": "label",
+    "StatusDescription": "label",
+    "TransactionType": "label",
+    "TransactionDirectionDescription": "label",
+    # Flags
+    "IsLate": "flag",
+    "IsDistribution": "flag",
+    "IsUnallocated": "flag",
+    # Codes
+    "LoanStatus": "code",
+    "JitOfferPolicy": "code",
+    "CreditPolicy": "code",
+    "Strategy": "code",
+    "LateStrategy": "code",
+    "Status": "code",
+    "TransactionDirection": "code",
+}
+
+PANDAS_TYPES = {"flag": "Int8", "code": "Int16"}
+DUCKDB_TYPES = {"flag": "TINYINT", "code": "SMALLINT"}
+DUCKDB_RANGES = {"TINYINT": (-128, 127), "SMALLINT": (-32768, 32767)}
+NUMERIC_TYPES = {"TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "FLOAT", "DOUBLE"}
+# A label with more distinct values than this stays VARCHAR
+MAX_ENUM_VALUES = 1000
+
+ID_DTYPE = pd.StringDtype("pyarrow")
+
+
+def policy_sha256(policy=None):
+    """Short hash of the policy, so a policy change reloads the tables built with it."""
+    policy = TYPE_POLICY if policy is None else policy
+    return hashlib.sha256(json.dumps(policy, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def id_strings(values):
+    """
+    Ids as Arrow-backed strings: 123 and 123.0 → "123", missing → <NA>.
+    Vectorized replacement for .apply(lambda x: str(int(x))).
+    """
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        values = values.astype("Int64")
+    return values.astype(ID_DTYPE)
+
+
+def _fits(values, dtype):
+    """True when numeric values are whole numbers inside the range of the integer dtype."""
+    if pd.api.types.is_bool_dtype(values) or not pd.api.types.is_numeric_dtype(values):
+        return False
+    present = values.dropna().to_numpy(dtype="float64")
+    if not len(present):
+        return True
+    info = np.iinfo(dtype.lower())
+    return bool((present == np.floor(present)).all() and present.min() >= info.min and present.max() <= info.max)
+
+
+def apply_type_policy(df, policy=None):
+    """Convert the policy columns present in df in place. Returns df."""
+    policy = TYPE_POLICY if policy is None else policy
+    for column, kind in policy.items():
+        if column not in df.columns:
+            continue
+        if kind == "id":
+            df[column] = id_strings(df[column])
+        elif kind == "label":
+            df[column] = df[column].astype("category")
+        elif _fits(df[column], PANDAS_TYPES[kind]):
+            df[column] = df[column].astype(PANDAS_TYPES[kind])
+    return df
+
+
+def enum_sql(values):
+    """ENUM type literal of values, in the given order."""
+    return "ENUM(" + ", ".join("'" + str(value).replace("'", "''") + "'" for value in values) + ")"
+
+
+def _stored_labels(con, relation):
+    """{column: labels in ENUM order} of the ENUM columns of relation (the table being reloaded)."""
+    try:
+        columns = con.execute(f"DESCRIBE {relation}").fetchall()
+    except duckdb.Error:  # e.g. a UTC-only view whose storage table was dropped
+        return {}
+    labels = {}
+    for name, type_, *_ in columns:
+        if type_.startswith("ENUM("):
+            labels[name] = con.execute(f"SELECT enum_range(NULL::{type_})").fetchone()[0]
+    return labels
+
+
+def typed_source_sql(con, source_sql, policy=None, previous=None):
+    """
+    Wrap a DuckDB SELECT so the policy columns it returns get their compact
+    type: labels as an ENUM of the values present (sorted, so ORDER BY is
+    unchanged), flags and codes as TINYINT / SMALLINT when they fit.
+    Reads the source once for the label values and numeric ranges.
+
+    previous: the existing relation the result replaces, if any. Its ENUM
+    labels are kept in their order and new labels appended after them (so
+    ORDER BY on a label added later sorts it last).
+    """
+    policy = TYPE_POLICY if policy is None else policy
+    columns = {name: type_ for name, type_, *_ in con.execute(f"DESCRIBE {source_sql}").fetchall()}
+    stored = _stored_labels(con, previous) if previous else {}
+
+    checks, casts = [], {}
+    for column, kind in policy.items():
+        type_ = columns.get(column)
+        if type_ is None:
+            continue
+        quoted = f'"{column}"'
+        if kind == "id" and type_ != "VARCHAR":
+            casts[column] = f"CAST({quoted} AS VARCHAR)"
+        elif kind == "label" and type_ == "VARCHAR":
+            checks.append((column, kind, f"list_sort(list(DISTINCT {quoted})[:{MAX_ENUM_VALUES + 1}])"))
+        elif kind in DUCKDB_TYPES and type_ in NUMERIC_TYPES and type_ != DUCKDB_TYPES[kind]:
+            low, high = DUCKDB_RANGES[DUCKDB_TYPES[kind]]
+            checks.append((
+                column, kind,
+                f"coalesce(bool_and({quoted} = trunc({quoted}) AND {quoted} BETWEEN {low} AND {high}), true)",
+            ))
+
+    if checks:
+        results = con.execute(f"SELECT {', '.join(sql for _, _, sql in checks)} FROM ({source_sql})").fetchone()
+        for (column, kind, _), result in zip(checks, results):
+            quoted = f'"{column}"'
+            if kind == "label":
+                result = [value for value in result if value is not None]  # list() keeps NULL
+            if kind == "label" and 0 < len(result) <= MAX_ENUM_VALUES:
+                kept = stored.get(column, [])
+                labels = kept + sorted(set(result) - set(kept))
+                casts[column] = f"CAST({quoted} AS {enum_sql(labels if len(labels) <= MAX_ENUM_VALUES else result)})"
+            elif kind in DUCKDB_TYPES and result:
+                casts[column] = f"CAST({quoted} AS {DUCKDB_TYPES[kind]})"
+
+    if not casts:
+        return source_sql
+    replace = ", ".join(f'{sql} AS "{column}"' for column, sql in casts.items())
+    return f"SELECT * REPLACE ({replace}) FROM ({source_sql})"
+
+
+def _plain_types(df, policy):
+    # The types the extracts wrote before the policy: object strings, int64/float64
+    plain = df.copy()
+    for column, kind in policy.items():
+        if column not in plain.columns:
+            continue
+        if kind in ("id", "label"):
+            plain[column] = plain[column].astype(object).where(plain[column].notna(), None)
+        elif pd.api.types.is_extension_array_dtype(plain[column]) and pd.api.types.is_integer_dtype(plain[column]):
+            plain[column] = plain[column].astype("float64" if plain[column].isna().any() else "int64")
+    return plain
+
+
+def _duckdb_bytes(parquet_bytes, typed, workdir):
+    path = Path(workdir) / ("typed.duckdb" if typed else "plain.duckdb")
+    path.unlink(missing_ok=True)
+    source = Path(workdir) / "source.parquet"
+    source.write_bytes(parquet_bytes)
+    con = duckdb.connect(path.as_posix())
+    try:
+        source_sql = f"SELECT * FROM read_parquet('{source.as_posix()}')"
+        if typed:
+            source_sql = typed_source_sql(con, source_sql)
+        con.execute(f"CREATE TABLE t AS {source_sql}")
+        con.execute("CHECKPOINT")
+    finally:
+        con.close()
+    return path.stat().st_size
+
+
+def type_savings_report(paths, policy=None):
+    """
+    Per file: pandas memory, Parquet size and DuckDB file size with the plain
+    types vs the policy types. Prints a table and returns the rows.
+    """
+    policy = TYPE_POLICY if policy is None else policy
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for path in paths:
+            typed = apply_type_policy(pd.read_parquet(path), policy)
+            plain = _plain_types(typed, policy)
+            plain_file, typed_file = io.BytesIO(), io.BytesIO()
+            plain.to_parquet(plain_file, index=False)
+            typed.to_parquet(typed_file, index=False)
+            rows.append({
+                "file": Path(path).name,
+                "rows": len(typed),
+                "memory": (plain.memory_usage(deep=True).sum(), typed.memory_usage(deep=True).sum()),
+                "parquet": (plain_file.tell(), typed_file.tell()),
+                "duckdb": (
+                    _duckdb_bytes(plain_file.getvalue(), False, workdir),
+                    _duckdb_bytes(plain_file.getvalue(), True, workdir),
+                ),
+            })
+
+    def cell(pair):
+        before, after = pair
+        saved = 1 - after / before if before else 0
+        return f"{before / 1024 ** 2:8.1f} → {after / 1024 ** 2:6.1f} MB ({saved:4.0%})"
+
+    print(f"{'file':<34} {'rows':>10}  {'pandas memory':<28} {'parquet':<28} {'duckdb':<28}")
+    for row in rows:
+        print(f"{row['file']:<34} {row['rows']:>10,}  {cell(row['memory'])} {cell(row['parquet'])} {cell(row['duckdb'])}")
+    totals = {key: tuple(sum(row[key][i] for row in rows) for i in (0, 1)) for key in ("memory", "parquet", "duckdb")}
+    print(f"{'total':<34} {sum(row['rows'] for row in rows):>10,}  "
+          f"{cell(totals['memory'])} {cell(totals['parquet'])} {cell(totals['duckdb'])}")
+    return rows
+
+
+if __name__ == "__main__":
+    files = sys.argv[1:] or sorted(str(path) for path in Path("data").glob("*.parquet"))
+    type_savings_report(files)
@@ -0,0 +1,539 @@
+"""
+DuckDB Warehouse Utility
+
+Helpers for create_duckdb.py.
+
+UTC-only storage (DWH_UTC_ONLY=1):
+The extracts write every timestamp twice (IssueDate / IssueDateCDMX). In
+UTC-only mode the base table keeps only the UTC column, in the `utc` schema,
+and the table name in `main` becomes a view that recomputes each *CDMX
+column in its original position, so Metabase queries keep working unchanged.
+A pair is only dropped when the stored CDMX column equals the conversion of
+its UTC column on every row. Columns such as SettledAtCDMX, which falls back
+to the due date, stay stored. Month truncations (IssueMonthCDMX, ...) are
+published by the same views.
+
+Load manifest: meta.load_manifest records the size, mtime and sha256 of the
+Parquet file (or dataset directory) each table was loaded from, so unchanged
+tables are skipped.
+
+Load specs: tables can be sorted on load (ORDER BY clustering key) and get
+ART indexes on lookup keys; benchmark_load_specs measures the effect. A table
+with a primary key is upserted (upsert_table) instead of rewritten.
+
+Parquet views: tables listed in DWH_PARQUET_VIEWS are views over their
+Parquet file instead of DuckDB tables (see create_parquet_view).
+
+Build-then-swap (DWH_PUBLISH=swap): the next warehouse is built in a separate
+file, validated, and renamed over the live one.
+"""
+
+import hashlib
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+
+from utils.catalog_utils import lookup
+from utils.dtype_utils import enum_sql
+
+STORAGE_SCHEMA = "utc"
+CDMX_SUFFIX = "CDMX"
+
+
+def cdmx_sql(column):
+    """DuckDB expression: naive UTC timestamp column → naive Mexico City time."""
+    return f"timezone('America/Mexico_City', timezone('UTC', \"{column}\"))"
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def drop_relation(con, name, schema="main"):
+    """Drop a table or view called name, whichever it is (no-op if missing)."""
+    kinds = con.execute(
+        """
+        SELECT 'TABLE' FROM duckdb_tables() WHERE schema_name = ? AND table_name = ?
+        UNION ALL
+        SELECT 'VIEW' FROM duckdb_views() WHERE schema_name = ? AND view_name = ? AND NOT internal
+        """,
+        [schema, name, schema, name],
+    ).fetchall()
+    for (kind,) in kinds:
+        con.execute(f"DROP {kind} {schema}.{quote(name)}")
+
+
+def list_relations(con, schema="main"):
+    """Names of the user tables and views in schema."""
+    rows = con.execute(
+        """
+        SELECT table_name FROM duckdb_tables() WHERE schema_name = ?
+        UNION
+        SELECT view_name FROM duckdb_views() WHERE schema_name = ? AND NOT internal
+        """,
+        [schema, schema],
+    ).fetchall()
+    return sorted(row[0] for row in rows)
+
+
+def cdmx_pairs(columns):
+    """(utc, cdmx) pairs among columns (list of (name, type)), both TIMESTAMP."""
+    types = dict(columns)
+    return [
+        (name[: -len(CDMX_SUFFIX)], name)
+        for name, type_ in columns
+        if name.endswith(CDMX_SUFFIX)
+        and type_ == "TIMESTAMP"
+        and types.get(name[: -len(CDMX_SUFFIX)]) == "TIMESTAMP"
+    ]
+
+
+def derivable_pairs(con, relation, pairs):
+    """The pairs whose CDMX column equals the conversion of the UTC column on every row."""
+    if not pairs:
+        return []
+    checks = ", ".join(
+        f"coalesce(bool_and({quote(cdmx)} IS NOT DISTINCT FROM {cdmx_sql(utc)}), true)"
+        for utc, cdmx in pairs
+    )
+    flags = con.execute(f"SELECT {checks} FROM {relation}").fetchone()
+    return [pair for pair, derivable in zip(pairs, flags) if derivable]
+
+
+def parquet_source_sql(path):
+    """
+    DuckDB SELECT over a Parquet file, or over every Parquet file under a
+    dataset directory (hive partition keys become columns).
+    """
+    path = Path(path)
+    if path.is_dir():
+        return (
+            f"SELECT * FROM read_parquet('{(path / '**' / '*.parquet').as_posix()}', "
+            f"hive_partitioning = true, union_by_name = true)"
+        )
+    return f"SELECT * FROM read_parquet('{path.as_posix()}')"
+
+
+def create_parquet_view(con, table_name, path, derived_columns=None):
+    """
+    Publish main.<table_name> as a view straight over the Parquet file or
+    dataset: nothing is copied, and filters are pushed down to the row
+    group statistics at query time. Rewritten files are picked up by the
+    next query.
+    """
+    view_sql = parquet_source_sql(Path(path).resolve())
+    if derived_columns:
+        extras = ", ".join(f"{expression} AS {quote(name)}" for name, expression in derived_columns.items())
+        view_sql = f"SELECT *, {extras} FROM ({view_sql})"
+    drop_relation(con, table_name, STORAGE_SCHEMA)
+    drop_relation(con, table_name)
+    con.execute(f"CREATE VIEW main.{quote(table_name)} AS {view_sql}")
+
+
+def order_by_sql(columns):
+    return f" ORDER BY {', '.join(quote(column) for column in columns)}" if columns else ""
+
+
+def create_indexes(con, table_name, columns, schema="main"):
+    """ART index idx_<table>_<column> on each column (for selective lookups such as UserId = ?)."""
+    for column in columns or []:
+        con.execute(
+            f"CREATE INDEX {quote(f'idx_{table_name}_{column}')} "
+            f"ON {schema}.{quote(table_name)} ({quote(column)})"
+        )
+
+
+def create_clustered_table(con, table_name, source_sql, order_by=None, indexes=None):
+    """
+    (Re)create main.<table_name> from source_sql, physically sorted by
+    order_by so DuckDB's per-row-group min/max (zonemaps) can skip data for
+    filters on those columns, with ART indexes on the indexes columns.
+    """
+    drop_relation(con, table_name)
+    con.execute(f"CREATE TABLE {quote(table_name)} AS {source_sql}{order_by_sql(order_by)}")
+    create_indexes(con, table_name, indexes)
+
+
+def upsert_table(con, table_name, source_sql, primary_key, deletes=False):
+    """
+    Apply source_sql (the new full contents) to main.<table_name> by primary key
+    instead of rewriting it: rows with a new key are inserted, rows whose
+    content changed are replaced, and with deletes=True rows whose key is gone
+    are deleted. Unchanged rows are not touched. Runs in one transaction.
+
+    Label columns are ENUMs of the values in each file (dtype_utils), so their
+    types differ from run to run. Incoming labels are cast to the stored ENUM,
+    which is first widened with the new values if there are any. New labels
+    are appended after the stored ones: hash() of an ENUM value depends on its
+    position, so the stored rows (and the rollup fingerprints over them) keep
+    their hashes.
+
+    primary_key must be unique in the source (the grain of the table, see
+    create_duckdb.table_load_specs). Returns {"inserted", "updated",
+    "deleted"}, or None when an upsert is not possible (columns or non-label
+    column types changed, or the key is not unique in the source); the reason
+    is printed and the caller reloads the table.
+    """
+    table = f"main.{quote(table_name)}"
+    incoming = quote(f"{table_name}__incoming")
+    changes = quote(f"{table_name}__changes")
+    keys = ", ".join(quote(column) for column in primary_key)
+    matches = " AND ".join(f"a.{quote(c)} IS NOT DISTINCT FROM b.{quote(c)}" for c in primary_key)
+
+    # DESCRIBE only binds the query, nothing is read yet
+    incoming_columns = [c[:2] for c in con.execute(f"DESCRIBE {source_sql}").fetchall()]
+    table_columns = [c[:2] for c in con.execute(f"DESCRIBE {table}").fetchall()]
+    if [name for name, _ in incoming_columns] != [name for name, _ in table_columns]:
+        print(f"⚠️ {table_name}: columns changed, cannot upsert")
+        return None
+    widened = {}  # column: ENUM type with the stored and the new labels
+    for (name, incoming_type), (_, stored_type) in zip(incoming_columns, table_columns):
+        if incoming_type == stored_type:
+            continue
+        if not (incoming_type.startswith("ENUM(") and stored_type.startswith("ENUM(")):
+            print(f"⚠️ {table_name}: {name} changed type ({stored_type} → {incoming_type}), cannot upsert")
+            return None
+        stored_values, new_values = con.execute(
+            f"SELECT enum_range(NULL::{stored_type}), enum_range(NULL::{incoming_type})"
+        ).fetchone()
+        added = sorted(set(new_values) - set(stored_values))
+        if added:
+            widened[name] = enum_sql(stored_values + added)
+    # Hashes are only comparable between identical types: hash the incoming rows as stored
+    casts = {
+        name: widened.get(name, stored_type)
+        for (name, incoming_type), (_, stored_type) in zip(incoming_columns, table_columns)
+        if incoming_type != stored_type
+    }
+    cast_sql = ", ".join(f"CAST({quote(name)} AS {type_}) AS {quote(name)}" for name, type_ in casts.items())
+    source = f"SELECT * REPLACE ({cast_sql}) FROM ({source_sql})" if casts else source_sql
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        # Widen before hashing, so both sides hash the same ENUM type
+        if widened:
+            _widen_enums(con, table_name, widened)
+        con.execute(f"CREATE OR REPLACE TEMP TABLE {incoming} AS SELECT *, hash(s) AS __row_hash FROM ({source}) s")
+        duplicates = con.execute(
+            f"SELECT count(*) FROM (SELECT {keys} FROM {incoming} GROUP BY ALL HAVING count(*) > 1)"
+        ).fetchone()[0]
+        if duplicates:
+            con.execute("ROLLBACK")
+            print(f"⚠️ {table_name}: {duplicates:,} keys ({', '.join(primary_key)}) repeat in the source, cannot upsert")
+            return None
+
+        # Keys to write, classified against the stored rows
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE {changes} AS
+            SELECT {", ".join(f"coalesce(a.{quote(c)}, b.{quote(c)}) AS {quote(c)}" for c in primary_key)},
+                CASE WHEN b.__row_hash IS NULL THEN 'inserted'
+                     WHEN a.__row_hash IS NULL THEN 'deleted'
+                     ELSE 'updated' END AS change
+            FROM {incoming} a
+                FULL OUTER JOIN (SELECT {keys}, hash(t) AS __row_hash FROM {table} t) b ON {matches}
+            WHERE a.__row_hash IS DISTINCT FROM b.__row_hash
+                {"" if deletes else "AND a.__row_hash IS NOT NULL"}
+        """)
+        counts = dict(con.execute(f"SELECT change, count(*) FROM {changes} GROUP BY ALL").fetchall())
+
+        con.execute(f"""
+            DELETE FROM {table} a WHERE EXISTS (
+                SELECT 1 FROM {changes} b WHERE b.change != 'inserted' AND {matches}
+            )
+        """)
+        con.execute(f"""
+            INSERT INTO {table}
+            SELECT * EXCLUDE (__row_hash) FROM {incoming} a WHERE EXISTS (
+                SELECT 1 FROM {changes} b WHERE b.change != 'deleted' AND {matches}
+            )
+        """)
+        con.execute(f"DROP TABLE {incoming}")
+        con.execute(f"DROP TABLE {changes}")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    if widened:
+        print(f"🏷️ {table_name}: new labels in {', '.join(widened)}, ENUM widened in place")
+    return {change: counts.get(change, 0) for change in ("inserted", "updated", "deleted")}
+
+
+def _widen_enums(con, table_name, types):
+    """ALTER label columns to wider ENUM types ({column: type}); indexes are dropped and recreated around it."""
+    indexes = con.execute(
+        "SELECT index_name, sql FROM duckdb_indexes() WHERE schema_name = 'main' AND table_name = ?", [table_name]
+    ).fetchall()
+    for index_name, _ in indexes:
+        con.execute(f"DROP INDEX main.{quote(index_name)}")
+    for column, type_ in types.items():
+        con.execute(f"ALTER TABLE main.{quote(table_name)} ALTER {quote(column)} SET DATA TYPE {type_}")
+    for _, sql in indexes:
+        con.execute(sql)
+
+
+def load_utc_only(con, table_name, source_sql, derived_columns=None, order_by=None, indexes=None):
+    """
+    Load source_sql as utc.<table_name> without derivable *CDMX columns and
+    publish main.<table_name> as a view with the original columns. A table
+    with nothing to derive is stored as a plain main.<table_name>.
+
+    derived_columns maps extra view column names to DuckDB expressions over
+    the published columns (e.g. month truncations). order_by and indexes as in
+    create_clustered_table (order_by may name a CDMX column that is not stored). Returns
+    the dropped CDMX columns.
+    """
+    staging = quote(table_name + "__load")
+    con.execute(f"CREATE OR REPLACE TABLE {staging} AS {source_sql}{order_by_sql(order_by)}")
+
+    columns = [(name, type_) for name, type_, *_ in con.execute(f"DESCRIBE {staging}").fetchall()]
+    derived = derivable_pairs(con, staging, cdmx_pairs(columns))
+    dropped = {cdmx: utc for utc, cdmx in derived}
+
+    drop_relation(con, table_name, STORAGE_SCHEMA)
+    drop_relation(con, table_name)
+    if not dropped and not derived_columns:
+        # Nothing to compute: a plain table, as in the default mode
+        con.execute(f"ALTER TABLE {staging} RENAME TO {quote(table_name)}")
+        create_indexes(con, table_name, indexes)
+        return []
+
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {STORAGE_SCHEMA}")
+    storage = f"{STORAGE_SCHEMA}.{quote(table_name)}"
+    excluded = f" EXCLUDE ({', '.join(quote(cdmx) for cdmx in dropped)})" if dropped else ""
+    con.execute(f"CREATE TABLE {storage} AS SELECT *{excluded} FROM {staging}{order_by_sql(order_by)}")
+    con.execute(f"DROP TABLE {staging}")
+    create_indexes(con, table_name, [column for column in indexes or [] if column not in dropped], STORAGE_SCHEMA)
+
+    select = ",\n    ".join(
+        f"{cdmx_sql(dropped[name])} AS {quote(name)}" if name in dropped else quote(name)
+        for name, _ in columns
+    )
+    view_sql = f"SELECT\n    {select}\nFROM {storage}"
+    if derived_columns:
+        extras = ", ".join(f"{expression} AS {quote(name)}" for name, expression in derived_columns.items())
+        view_sql = f"SELECT *, {extras} FROM ({view_sql})"
+
+    con.execute(f"CREATE VIEW main.{quote(table_name)} AS {view_sql}")
+    return list(dropped)
+
+
+# ========================================
+# LOAD MANIFEST
+# ========================================
+# One row per table: the source file it was loaded from (size, mtime, sha256)
+# and the load mode. A table whose source is unchanged is not reloaded.
+
+MANIFEST_SCHEMA = "meta"
+MANIFEST_TABLE = f"{MANIFEST_SCHEMA}.load_manifest"
+PARQUET_VIEW_MODE = "parquet_view"
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(con):
+    """{table_name: row dict} from the manifest (created if missing)."""
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {MANIFEST_SCHEMA}")
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            table_name VARCHAR PRIMARY KEY,
+            source_file VARCHAR,
+            size_bytes BIGINT,
+            mtime DOUBLE,
+            sha256 VARCHAR,
+            load_mode VARCHAR,
+            loaded_at TIMESTAMP
+        )
+    """)
+    rows = con.execute(f"SELECT * FROM {MANIFEST_TABLE}").fetchall()
+    columns = [d[0] for d in con.description]
+    return {row[0]: dict(zip(columns, row)) for row in rows}
+
+
+def source_state(path, previous=None, hash_content=True):
+    """
+    Size, mtime and sha256 of path. The file is only hashed when size or
+    mtime differ from previous (a manifest row); otherwise its hash is reused.
+    A dataset directory gets total size, latest mtime and a hash of its file
+    listing (path, size, mtime of every part): parts are only ever added or
+    replaced, so the same listing means the same content. hash_content=False
+    gives no hash.
+    """
+    path = Path(path)
+    if path.is_dir():
+        parts = sorted(
+            (file.relative_to(path).as_posix(), file.stat()) for file in path.rglob("*.parquet")
+        )
+        listing = "\n".join(f"{name} {stat.st_size} {stat.st_mtime_ns}" for name, stat in parts)
+        return {
+            "source_file": path.name,
+            "size_bytes": sum(stat.st_size for _, stat in parts),
+            "mtime": max((stat.st_mtime for _, stat in parts), default=0.0),
+            "sha256": hashlib.sha256(listing.encode()).hexdigest() if hash_content else None,
+        }
+
+    stat = os.stat(path)
+    state = {"source_file": path.name, "size_bytes": stat.st_size, "mtime": stat.st_mtime}
+    if not hash_content:
+        state["sha256"] = None
+    elif (
+        previous
+        and previous["sha256"] is not None  # a Parquet view records no hash
+        and previous["size_bytes"] == stat.st_size
+        and previous["mtime"] == stat.st_mtime
+    ):
+        state["sha256"] = previous["sha256"]
+    else:
+        state["sha256"] = file_sha256(path)
+    return state
+
+
+def is_unchanged(previous, state, load_mode):
+    """
+    True when the table was last loaded from identical content in the same
+    mode. A Parquet view never needs reloading once it exists (it reads the
+    file in place; the caller still refreshes what is derived from it when
+    the file's size or mtime changed).
+    """
+    if previous is None or previous["load_mode"] != load_mode:
+        return False
+    return load_mode == PARQUET_VIEW_MODE or (
+        state["sha256"] is not None and previous["sha256"] == state["sha256"]
+    )
+
+
+def record_load(con, table_name, state, load_mode):
+    """Upsert the manifest row of table_name."""
+    con.execute(
+        f"INSERT OR REPLACE INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, ?, now()::TIMESTAMP)",
+        [table_name, state["source_file"], state["size_bytes"], state["mtime"], state["sha256"], load_mode],
+    )
+
+
+def forget_loads(con, table_names):
+    """Remove manifest rows (tables that were dropped)."""
+    for table_name in table_names:
+        con.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE table_name = ?", [table_name])
+
+
+# ========================================
+# BUILD-THEN-SWAP PUBLISHING
+# ========================================
+
+def validate_warehouse(con, expected_rows):
+    """
+    Check that every table in expected_rows ({table_name: rows}) can be
+    queried and has the expected row count. Returns a list of problems.
+    """
+    problems = []
+    existing = set(list_relations(con))
+    for table_name, rows in expected_rows.items():
+        if table_name not in existing:
+            problems.append(f"{table_name}: missing")
+            continue
+        try:
+            actual = con.execute(f"SELECT count(*) FROM {quote(table_name)}").fetchone()[0]
+        except duckdb.Error as e:
+            problems.append(f"{table_name}: {e}")
+            continue
+        if actual != rows:
+            problems.append(f"{table_name}: {actual} rows, expected {rows}")
+    return problems
+
+
+def publish_swap(build_path, live_path, backup_path=None):
+    """
+    Atomically replace live_path with build_path (same directory).
+
+    The previous file is kept as backup_path through a hard link, so no data
+    is copied; readers that still have the old file open keep reading it.
+    """
+    build_path, live_path = Path(build_path), Path(live_path)
+    if backup_path is not None and live_path.exists():
+        backup_path = Path(backup_path)
+        backup_path.unlink(missing_ok=True)
+        try:
+            os.link(live_path, backup_path)
+        except OSError:
+            shutil.copy(live_path, backup_path)  # file systems without hard links
+    os.replace(build_path, live_path)
+
+
+# ========================================
+# RESOURCES & LOAD STATS
+# ========================================
+
+def configure(con, threads=None, memory_limit=None, temp_directory=None, preserve_insertion_order=None):
+    """Apply the DuckDB settings that are given (None keeps DuckDB's default)."""
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    if memory_limit:
+        con.execute(f"SET memory_limit = '{memory_limit}'")
+    if temp_directory:
+        con.execute(f"SET temp_directory = '{Path(temp_directory).as_posix()}'")
+    if preserve_insertion_order is not None:
+        con.execute(f"SET preserve_insertion_order = {bool(preserve_insertion_order)}")
+
+
+def parquet_stats(path):
+    """(rows, file bytes, uncompressed bytes) of a Parquet file or dataset directory, from the Parquet catalog."""
+    entry = lookup(path)
+    return entry["rows"], entry["size"], entry["uncompressed"]
+
+
+# ========================================
+# QUERY LATENCY BENCHMARK
+# ========================================
+
+def benchmark_load_specs(sources, load_specs, queries, params=None, repeat=20, workdir=None):
+    """
+    Load each table of sources ({table_name: parquet path}) twice into
+    throwaway databases, as is and with its load spec (order_by / indexes),
+    and time each query on both. params ({name: scalar SQL}) fill the
+    {name} placeholders of the queries, evaluated once on the plain copy.
+    Returns [(query name, plain ms, clustered ms)] (medians).
+    """
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        databases = {}
+        for variant in ("plain", "clustered"):
+            con = duckdb.connect(str(Path(tmp) / f"{variant}.duckdb"))
+            for table_name, path in sources.items():
+                spec = load_specs.get(table_name, {}) if variant == "clustered" else {}
+                create_clustered_table(
+                    con, table_name, parquet_source_sql(path), spec.get("order_by"), spec.get("indexes")
+                )
+            con.execute("CHECKPOINT")
+            databases[variant] = con
+
+        values = {name: databases["plain"].execute(sql).fetchone()[0] for name, sql in (params or {}).items()}
+        results = []
+        for name, template in queries.items():
+            sql = template.format(**values)
+            medians = []
+            for con in databases.values():
+                con.execute(sql).fetchall()  # warm-up
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    con.execute(sql).fetchall()
+                    timings.append((time.perf_counter() - start) * 1000)
+                medians.append(statistics.median(timings))
+            results.append((name, *medians))
+        for con in databases.values():
+            con.close()
+
+    width = max(len(name) for name, _, _ in results)
+    print(f"{'query':<{width}}  {'plain ms':>9}  {'clustered ms':>12}  speedup")
+    for name, plain, clustered in results:
+        print(f"{name:<{width}}  {plain:>9.2f}  {clustered:>12.2f}  {plain / clustered:>6.1f}x")
+    return results
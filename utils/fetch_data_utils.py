@@ -2,13 +2,30 @@
 Database Query Utility
 
 Provides a simple interface to execute SQL queries against the production database.
-Automatically handles connection lifecycle (open → query → close).
+Queries share the process-wide pooled engine from db_connection.py; connections
+go back to the pool after each query and are closed at interpreter exit.
+
+- fetch_data: run one query
+- fetch_data_batch: run several named queries concurrently
+  (bounded thread pool, each worker checks out its own pooled connection)
+- fetch_data_to_parquet: stream a large result set to a Parquet file in
+  chunks, so memory does not grow with table size (codec, dictionary and
+  statistics settings of the file come from write_parquet_utils; the file is
+  recorded in the Parquet catalog)
+- fetch_arrow / fetch_arrow_batches: build typed Arrow record batches straight
+  from the cursor's fetchmany buffers (no pandas object columns), with an
+  optional declared schema per query, e.g. {"UserLoanId": pa.string()}
 
 Note: Connection credentials are loaded from .env via db_connection.py
 """
 
 import sys
 import os
+import time
+import datetime
+import decimal
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 
 # Add root folder (Pypeline) to sys.path
 # Required when running scripts from subdirectories (e.g., utils/)
@@ -16,13 +33,251 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from db_connection import get_db_connection
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.catalog_utils import record
+from utils.write_parquet_utils import parquet_settings, writer_options
+
+# Default number of queries run at the same time by fetch_data_batch
+DEFAULT_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "4"))
+# Default rows per chunk for fetch_data_to_parquet
+DEFAULT_CHUNKSIZE = int(os.getenv("FETCH_CHUNKSIZE", "100000"))
 
 def fetch_data(query):
-    """Fetches data from the database and closes the connection after execution."""
+    """Fetches data from the database using a pooled connection."""
     engine = get_db_connection()
+    return pd.read_sql(query, engine)
+
+def _timed_read_sql(query, engine):
+    start = time.perf_counter()
+    df = pd.read_sql(query, engine)
+    return df, time.perf_counter() - start
+
+def fetch_data_batch(queries, max_workers=None):
+    """
+    Run a dict of named queries concurrently and return (frames, timings).
+
+    frames maps each name to its DataFrame, timings maps each name to seconds.
+    At most max_workers queries run at once (default FETCH_MAX_WORKERS or 4).
+    If any query fails the remaining ones are cancelled and the error is raised.
+    """
+    max_workers = max(1, min(max_workers or DEFAULT_MAX_WORKERS, len(queries) or 1))
+    engine = get_db_connection()
+    frames, timings = {}, {}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch") as pool:
+        futures = {pool.submit(_timed_read_sql, query, engine): name for name, query in queries.items()}
+        try:
+            for future in as_completed(futures):
+                name = futures[future]
+                frames[name], timings[name] = future.result()
+                print(f"✅ {name}: {len(frames[name])} rows in {timings[name]:.1f}s")
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    # Keep the caller's order
+    frames = {name: frames[name] for name in queries}
+    timings = {name: timings[name] for name in queries}
+    return frames, timings
+
+def _is_untyped(type_):
+    # All-NULL column, or categorical without categories
+    return pa.types.is_null(type_) or (pa.types.is_dictionary(type_) and pa.types.is_null(type_.value_type))
+
+def _promote_null_fields(schema):
+    # A column that is entirely NULL in the first chunk has no type yet; store it as string
+    return pa.schema([
+        field.with_type(pa.dictionary(pa.int32(), pa.string()) if pa.types.is_dictionary(field.type) else pa.string())
+        if _is_untyped(field.type) else field
+        for field in schema
+    ], metadata=schema.metadata)
+
+def _retype_written(tmp_path, schema, output_path, row_group_size):
+    """
+    Rewrite the rows written so far with schema, batch by batch (their
+    retyped columns are all NULL, so the cast cannot fail). Returns the open
+    writer to continue with.
+    """
+    written_path = tmp_path.with_name(tmp_path.name + ".retype")
+    os.replace(tmp_path, written_path)
+    writer = pq.ParquetWriter(tmp_path, schema, **writer_options(output_path))
     try:
-        df = pd.read_sql(query, engine)
-        return df
+        for batch in pq.ParquetFile(written_path).iter_batches(batch_size=row_group_size):
+            writer.write_table(pa.Table.from_batches([batch]).cast(schema), row_group_size=row_group_size)
+    except BaseException:
+        writer.close()
+        raise
     finally:
-        engine.dispose()
-        print("✅ Database connection closed.")
\ No newline at end of file
+        written_path.unlink()
+    return writer
+
+def fetch_data_to_parquet(query, output_path, chunksize=None, transform=None, schema=None):
+    """
+    Stream a query into a Parquet file, chunksize rows at a time.
+
+    transform(chunk) -> chunk is applied to every chunk before it is written
+    (e.g. UTC → CDMX conversion). Each chunk becomes one or more row groups
+    of at most the file's row_group_size; rows are not sorted.
+    The schema is taken from the first chunk unless one is passed. A column
+    that is entirely NULL in the first chunk is written as string until a
+    chunk brings its type; the rows written before are then rewritten once
+    with that type. Passing the schema avoids the rewrite.
+    The file is written to a temp path and renamed on success.
+    Returns the number of rows written.
+    """
+    chunksize = chunksize or DEFAULT_CHUNKSIZE
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    row_group_size = parquet_settings(output_path)["row_group_size"]
+    engine = get_db_connection()
+    writer = None
+    untyped = set()  # columns still NULL in every chunk so far
+    rows = 0
+
+    try:
+        # stream_results keeps the driver from buffering the whole result set
+        with engine.connect().execution_options(stream_results=True) as conn:
+            for chunk in pd.read_sql(query, conn, chunksize=chunksize):
+                if transform is not None:
+                    chunk = transform(chunk)
+
+                if untyped:
+                    chunk_types = pa.Schema.from_pandas(chunk[sorted(untyped)], preserve_index=False)
+                    typed = {
+                        name: chunk_types.field(name).type
+                        for name in untyped if not _is_untyped(chunk_types.field(name).type)
+                    }
+                    untyped -= typed.keys()
+                    # Text fits the string placeholder as it is
+                    retyped = [
+                        name for name, type_ in typed.items()
+                        if type_ != schema.field(name).type and not (pa.types.is_string(type_) or pa.types.is_large_string(type_))
+                    ]
+                    if retyped:
+                        # pandas metadata of this chunk, which has the real dtypes
+                        schema = pa.schema(
+                            [field.with_type(typed[field.name]) if field.name in retyped else field for field in schema],
+                            metadata=pa.Schema.from_pandas(chunk, preserve_index=False).metadata,
+                        )
+                        writer.close()
+                        writer = None
+                        writer = _retype_written(tmp_path, schema, output_path, row_group_size)
+                        print(f"🔁 {', '.join(retyped)} typed in a later chunk: rewrote the {rows} rows written before")
+
+                table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                if writer is None:
+                    if schema is None:
+                        untyped = {field.name for field in table.schema if _is_untyped(field.type)}
+                        schema = _promote_null_fields(table.schema)
+                        table = table.cast(schema)
+                    writer = pq.ParquetWriter(tmp_path, schema, **writer_options(output_path))
+                writer.write_table(table, row_group_size=row_group_size)
+
+                rows += len(chunk)
+                print(f"📦 {rows} rows written to {output_path.name}")
+
+        if writer is None:
+            # Empty result: still produce a readable file
+            empty = pa.Table.from_pandas(pd.DataFrame(), preserve_index=False) if schema is None else schema.empty_table()
+            pq.write_table(empty, tmp_path, **writer_options(output_path))
+        else:
+            writer.close()
+            writer = None
+
+        os.replace(tmp_path, output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    record(output_path)
+    return rows
+
+# pyodbc reports each column's Python type in cursor.description
+_PYTHON_TO_ARROW = {
+    bool: pa.bool_(),
+    int: pa.int64(),
+    float: pa.float64(),
+    str: pa.string(),
+    bytes: pa.binary(),
+    bytearray: pa.binary(),
+    datetime.datetime: pa.timestamp("us"),
+    datetime.date: pa.date32(),
+    datetime.time: pa.time64("us"),
+}
+
+def _arrow_type_from_description(column):
+    """Arrow type for one cursor.description entry, or None to let Arrow infer it."""
+    type_code, precision, scale = column[1], column[4], column[5]
+    if type_code is decimal.Decimal and precision:
+        return pa.decimal128(precision, scale or 0)
+    return _PYTHON_TO_ARROW.get(type_code)
+
+def _resolve_schema(description, schema):
+    """Target schema: declared types where given, cursor types everywhere else."""
+    names = [column[0] for column in description]
+    if isinstance(schema, pa.Schema):
+        declared = {field.name: field.type for field in schema}
+    else:
+        declared = dict(schema or {})
+
+    unknown = set(declared) - set(names)
+    if unknown:
+        raise ValueError(f"Declared columns not in query result: {sorted(unknown)}")
+
+    return [
+        (name, _arrow_type_from_description(column), declared.get(name))
+        for name, column in zip(names, description)
+    ]
+
+def _rows_to_batch(rows, columns):
+    # fetchmany returns row tuples; transpose them into one sequence per column
+    column_values = zip(*rows) if rows else [()] * len(columns)
+    arrays = []
+    for values, (name, source_type, target_type) in zip(column_values, columns):
+        array = pa.array(values, type=source_type, from_pandas=False)
+        if target_type is not None and array.type != target_type:
+            array = array.cast(target_type)
+        arrays.append(array)
+    return pa.RecordBatch.from_arrays(arrays, names=[name for name, _, _ in columns])
+
+def fetch_arrow_batches(query, schema=None, batch_size=None):
+    """
+    Yield pyarrow RecordBatches of up to batch_size rows.
+
+    schema is a pa.Schema or a dict of column -> Arrow type for the columns
+    that need a specific type (e.g. IDs as strings, decimals as float64);
+    the rest keep the type reported by the driver.
+    """
+    batch_size = batch_size or DEFAULT_CHUNKSIZE
+    connection = get_db_connection().raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(query)
+        columns = _resolve_schema(cursor.description, schema)
+
+        emitted = False
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            emitted = True
+            yield _rows_to_batch(rows, columns)
+        if not emitted:
+            # Empty result: one empty batch so callers still get the columns
+            yield _rows_to_batch([], columns)
+        cursor.close()
+    finally:
+        connection.close()
+
+def fetch_arrow(query, schema=None, batch_size=None):
+    """Run a query and return a typed pyarrow Table (see fetch_arrow_batches)."""
+    tables = [
+        pa.Table.from_batches([batch])
+        for batch in fetch_arrow_batches(query, schema=schema, batch_size=batch_size)
+    ]
+    # Columns the driver does not type can be all-NULL in an early batch
+    return pa.concat_tables(tables, promote_options="default")
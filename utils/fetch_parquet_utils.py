@@ -1,19 +1,84 @@
 """
 Parquet File Loader Utility
 
-Loads parquet files from the project's data directory.
-Provides a default path relative to the project root, with option to override.
+Loads parquet files (or partitioned dataset directories) from the project's
+data directory. Provides a default path relative to the project root, with
+option to override.
+
+Reads only what the caller needs:
+- columns: projection, only those column chunks are read
+- filters: pyarrow row filters, e.g. [("LoanStatus", "!=", 6)] or a
+  pyarrow.compute expression (comparisons drop NULLs, as in SQL: keep them
+  with `| pc.field("LoanStatus").is_null()`); row groups
+  whose min/max statistics cannot match (and non-matching partitions of a
+  dataset, whose keys compare as strings: ("date_month", ">=", "2025-07-01"))
+  are skipped, the rest is filtered row by row
+- memory_map: the file is mapped instead of read into a buffer first
+
+cache=True keeps the result in an in-process LRU cache keyed by path, file
+mtime/size, columns and filters, so a script that loads the same file twice
+decodes it once; a rewritten file is a cache miss. Callers get a copy.
 """
 
-import pandas as pd
+import os
+from collections import OrderedDict
 from pathlib import Path
 
-def fetch_parquet(parquet_file, prefix_path=None):
-    # Load a parquet file from the data directory.
+import pandas as pd
+
+# Entries kept by the cache=True reads
+CACHE_SIZE = int(os.getenv("FETCH_PARQUET_CACHE_SIZE", "8"))
+
+_cache = OrderedDict()
+
+
+def _file_key(path):
+    """What identifies the current content of a file or dataset directory."""
+    if path.is_dir():
+        return tuple(
+            (file.relative_to(path).as_posix(), file.stat().st_mtime_ns, file.stat().st_size)
+            for file in sorted(path.rglob("*.parquet"))
+        )
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def fetch_parquet(parquet_file, prefix_path=None, columns=None, filters=None, memory_map=True, cache=False):
+    """
+    Load a parquet file from the data directory (prefix_path overrides it).
+
+    columns and filters are pushed down to the reader (see module docstring).
+    With cache=True, repeated reads of an unchanged file return a copy of the
+    cached frame.
+    """
     if prefix_path is None:
         # Use default path relative to project root (data/ folder)
         project_root = Path(__file__).parent.parent
         prefix_path = project_root / "data"
-    
-    file_path = f"{prefix_path}/{parquet_file}"
-    return pd.read_parquet(file_path)
\ No newline at end of file
+
+    file_path = Path(prefix_path) / parquet_file
+    columns = list(columns) if columns is not None else None
+
+    def read():
+        return pd.read_parquet(
+            file_path, engine="pyarrow", columns=columns, filters=filters, memory_map=memory_map
+        )
+
+    if not cache:
+        return read()
+
+    key = (str(file_path.resolve()), _file_key(file_path), tuple(columns or ()), repr(filters))
+    if key in _cache:
+        _cache.move_to_end(key)
+    else:
+        # Entries of an older version of the same file are dead
+        for stale in [k for k in _cache if k[0] == key[0] and k[1] != key[1]]:
+            del _cache[stale]
+        _cache[key] = read()
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return _cache[key].copy()
@@ -0,0 +1,339 @@
+"""
+fact_loan Transformation in DuckDB
+
+Runs the loan.parquet derivation from extract_loan_detail.py as one DuckDB
+query plan over the staged raw pulls, instead of pandas:
+- UTC → CDMX conversion
+- payment merge and fill
+- apportionment waterfall
+- settlement dates, LoanCohort, DaysLate
+- latest post-DD strategy, IsPostDD, StrategyCreatedAt
+- Pypper 20+ assignment
+
+DuckDB runs it multi-threaded and spills to temp_directory when it goes over
+memory_limit. Output columns and order match the pandas path; check with:
+    python extract_loan_detail.py --check-duckdb-parity
+
+Staged inputs (written by extract_loan_detail.py, one Parquet file each):
+loans, arcus, stripe, dispute, cash (+ changed_users on incremental runs)
+"""
+
+import os
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from utils.apportion_utils import py_round_2, DEFAULT_TAX_RATE
+from utils.dtype_utils import typed_source_sql
+from utils.write_parquet_utils import copy_to_parquet
+
+STAGED_SOURCES = ["loans", "arcus", "stripe", "dispute", "cash"]
+
+# Resource settings (optional, .env)
+DUCKDB_THREADS = os.getenv("LOAN_DUCKDB_THREADS")
+DUCKDB_MEMORY_LIMIT = os.getenv("LOAN_DUCKDB_MEMORY_LIMIT")
+DUCKDB_TEMP_DIRECTORY = os.getenv("LOAN_DUCKDB_TEMP_DIRECTORY")
+
+# One row per loan: loan + repayment columns (same as data/loan_base.parquet)
+REPAYMENT_SQL = """
+WITH merged AS (
+    SELECT
+        l.*,
+        cdmx(l.IssueDate) AS IssueDateCDMX,
+        cdmx(l.ModifiedAt) AS ModifiedAtCDMX,
+        coalesce(a.AmountPaidArcus, 0) AS AmountPaidArcus,
+        a.LastPaidAtArcus,
+        cdmx(a.LastPaidAtArcus) AS LastPaidAtArcusCDMX,
+        coalesce(s.AmountPaidStripe, 0) AS AmountPaidStripe,
+        s.LastPaidAtStripe,
+        cdmx(s.LastPaidAtStripe) AS LastPaidAtStripeCDMX,
+        coalesce(d.DisputeAmount, 0) AS DisputeAmount,
+        coalesce(c.AmountPaidCash, 0) AS AmountPaidCash,
+        c.LastPaidAtCash,
+        cdmx(c.LastPaidAtCash) AS LastPaidAtCashCDMX,
+        l.PrincipalAmount + l.Fee + l.TaxOnFee + l.LateFee + l.TaxOnLateFee AS TotalAmountDue,
+        -- greatest() skips NULLs, like DataFrame.max(axis=1)
+        greatest(a.LastPaidAtArcus, s.LastPaidAtStripe, c.LastPaidAtCash) AS LastPaidDate
+    FROM {loans} l
+    LEFT JOIN ({arcus_typed}) a ON a.UserLoanId = CAST(l.UserLoanId AS VARCHAR)
+    LEFT JOIN ({stripe_typed}) s ON s.UserLoanId = CAST(l.UserLoanId AS VARCHAR)
+    LEFT JOIN ({dispute_typed}) d ON d.UserLoanId = CAST(l.UserLoanId AS VARCHAR)
+    LEFT JOIN ({cash_typed}) c ON c.UserLoanId = CAST(l.UserLoanId AS VARCHAR)
+),
+paid AS (
+    SELECT
+        *,
+        AmountPaidArcus + AmountPaidStripe + AmountPaidCash - DisputeAmount AS TotalOriginalAmountPaid
+    FROM merged
+),
+adjusted AS (
+    SELECT
+        *,
+        -- Underpaid repaid loans count as fully paid
+        CASE WHEN TotalOriginalAmountPaid < TotalAmountDue AND LoanStatus = 2
+            THEN TotalAmountDue ELSE TotalOriginalAmountPaid END AS TotalAmountPaid
+    FROM paid
+),
+-- Apportionment waterfall (see utils/apportion_utils.py). Comparisons and
+-- min() follow the Python version, so NULL/NaN inputs behave the same.
+step_late_fee AS (
+    SELECT
+        *,
+        CASE WHEN TotalAmountDue < TotalAmountPaid THEN TotalAmountDue ELSE TotalAmountPaid END AS remaining0,
+        remaining0 >= LateFee + TaxOnLateFee AS late_fee_covered,
+        CASE WHEN late_fee_covered THEN LateFee
+            ELSE py_round2(remaining0 / {divisor}) END AS LateFeePaid,
+        CASE WHEN late_fee_covered THEN TaxOnLateFee
+            ELSE py_round2(remaining0 - py_round2(remaining0 / {divisor})) END AS TaxOnLateFeePaid,
+        CASE WHEN late_fee_covered THEN remaining0 - (LateFee + TaxOnLateFee) ELSE 0 END AS remaining1
+    FROM adjusted
+),
+step_fee AS (
+    SELECT
+        *,
+        remaining1 >= Fee + TaxOnFee AS fee_covered,
+        CASE WHEN fee_covered THEN Fee
+            ELSE py_round2(remaining1 / {divisor}) END AS FeePaid,
+        CASE WHEN fee_covered THEN TaxOnFee
+            ELSE py_round2(remaining1 - py_round2(remaining1 / {divisor})) END AS TaxOnFeePaid,
+        CASE WHEN fee_covered THEN remaining1 - (Fee + TaxOnFee) ELSE 0 END AS remaining2
+    FROM step_late_fee
+)
+SELECT
+    * EXCLUDE (
+        remaining0, remaining1, remaining2, late_fee_covered, fee_covered,
+        AmountPaidArcus, LastPaidAtArcus, LastPaidAtArcusCDMX,
+        AmountPaidStripe, LastPaidAtStripe, LastPaidAtStripeCDMX,
+        DisputeAmount, AmountPaidCash, LastPaidAtCash, LastPaidAtCashCDMX,
+        TotalAmountDue, LastPaidDate, TotalOriginalAmountPaid, TotalAmountPaid,
+        LateFeePaid, TaxOnLateFeePaid, FeePaid, TaxOnFeePaid,
+        IssueDateCDMX, ModifiedAtCDMX
+    ),
+    IssueDateCDMX,
+    ModifiedAtCDMX,
+    AmountPaidArcus,
+    LastPaidAtArcus,
+    LastPaidAtArcusCDMX,
+    AmountPaidStripe,
+    LastPaidAtStripe,
+    LastPaidAtStripeCDMX,
+    DisputeAmount,
+    AmountPaidCash,
+    LastPaidAtCash,
+    LastPaidAtCashCDMX,
+    TotalAmountDue,
+    LateFeePaid,
+    TaxOnLateFeePaid,
+    FeePaid,
+    TaxOnFeePaid,
+    CASE WHEN PrincipalAmount < remaining2 THEN PrincipalAmount ELSE remaining2 END AS PrincipalPaid,
+    TotalAmountPaid,
+    TotalOriginalAmountPaid,
+    LastPaidDate,
+    cdmx(LastPaidDate) AS LastPaidDateCDMX,
+    -- SettledAt: last payment for repaid loans, due date if repaid without payments
+    CASE WHEN LoanStatus = 2 THEN coalesce(LastPaidDate, DueDate) END AS SettledAt,
+    CASE WHEN LoanStatus = 2 THEN coalesce(cdmx(LastPaidDate), DueDate) END AS SettledAtCDMX,
+    CASE WHEN LoanNumber = 1 THEN 'First' ELSE 'Repeat' END AS LoanCohort
+FROM step_fee
+"""
+
+# An empty pull is staged with untyped (string) columns, so payment columns are
+# cast to their real types and joined on the text UserLoanId
+PAYMENT_COLUMN_TYPES = {
+    "arcus": {"AmountPaidArcus": "DOUBLE", "LastPaidAtArcus": "TIMESTAMP"},
+    "stripe": {"AmountPaidStripe": "DOUBLE", "LastPaidAtStripe": "TIMESTAMP"},
+    "dispute": {"DisputeAmount": "DOUBLE"},
+    "cash": {"AmountPaidCash": "DOUBLE", "LastPaidAtCash": "TIMESTAMP"},
+}
+
+# UserId/UserLoanId are stored as strings, like the pandas path
+REPAYMENT_IDS_SQL = """
+SELECT * REPLACE (CAST(UserId AS VARCHAR) AS UserId, CAST(UserLoanId AS VARCHAR) AS UserLoanId)
+FROM ({repayment})
+"""
+
+# Final loan.parquet: DaysLate + strategy columns over every loan in base
+FINAL_SQL = """
+WITH latest_strategy AS (
+    SELECT * EXCLUDE (rn, file_row_number)
+    FROM (
+        SELECT
+            *,
+            row_number() OVER (
+                PARTITION BY UserLoanId
+                ORDER BY CreatedAt DESC NULLS LAST, file_row_number
+            ) AS rn
+        FROM read_parquet('{strategies}', file_row_number = true)
+        WHERE Strategy IN (3, 4, 10, 11, 12, 13)
+    )
+    WHERE rn = 1
+),
+joined AS (
+    SELECT
+        b.*,
+        s.CreatedAt,
+        s.Strategy,
+        s.StrategyName,
+        s.CreatedAtCDMX,
+        date_trunc('day', b.DueDate) + INTERVAL 30 HOUR AS threshold
+    FROM {base} b
+    LEFT JOIN latest_strategy s ON s.UserLoanId = b.UserLoanId
+),
+flagged AS (
+    SELECT
+        *,
+        -- DaysLate: whole days from due date to settlement (or today), never negative
+        date_diff('microsecond', DueDate, CASE WHEN SettledAt IS NOT NULL THEN SettledAtCDMX ELSE {today} END)
+            // 86400000000 AS days_late_raw,
+        coalesce(Strategy IN (3, 4, 13), false)
+        OR (
+            coalesce(DueDate < {now_cdmx}, false)
+            AND (
+                coalesce(SettledAtCDMX > threshold, false)
+                OR (coalesce({now_cdmx} - DueDate > INTERVAL 30 HOUR, false) AND SettledAtCDMX IS NULL)
+            )
+        ) AS IsPostDD
+    FROM joined
+),
+pypper AS (
+    SELECT
+        UserLoanId,
+        Strategy AS LateStrategy,
+        StrategyName AS LateStrategyName,
+        CreatedAt AS LateStrategyCreatedAt,
+        CreatedAtCDMX AS LateStrategyCreatedAtCDMX
+    FROM read_parquet('{strategies}')
+    WHERE Strategy = 14
+)
+SELECT
+    f.* EXCLUDE (CreatedAt, CreatedAtCDMX, threshold, days_late_raw, Strategy, StrategyName, IsPostDD),
+    CASE WHEN days_late_raw < 0 THEN 0 ELSE days_late_raw END AS DaysLate,
+    f.Strategy,
+    coalesce(f.StrategyName, 'Twilio') AS StrategyName,
+    f.IsPostDD,
+    CASE WHEN f.IsPostDD AND (f.CreatedAt IS NULL OR coalesce(f.Strategy IN (10, 11, 12), false))
+        THEN f.threshold ELSE f.CreatedAt END AS StrategyCreatedAt,
+    CASE WHEN f.IsPostDD AND (f.CreatedAt IS NULL OR coalesce(f.Strategy IN (10, 11, 12), false))
+        THEN f.threshold ELSE f.CreatedAtCDMX END AS StrategyCreatedAtCDMX,
+    p.* EXCLUDE (UserLoanId)
+FROM flagged f
+LEFT JOIN pypper p ON p.UserLoanId = f.UserLoanId
+"""
+
+
+def _py_round2(values):
+    # Arrow UDF: same rounding as the pandas path (Python round semantics)
+    result = py_round_2(np.asarray(values.to_numpy(zero_copy_only=False), dtype="float64"))
+    return pa.array(result, mask=np.isnan(result))
+
+
+def _parquet(path):
+    return f"read_parquet('{Path(path).as_posix()}')"
+
+
+def _timestamp(value):
+    return f"TIMESTAMP '{value:%Y-%m-%d %H:%M:%S.%f}'"
+
+
+def connect(threads=None, memory_limit=None, temp_directory=None):
+    """In-memory DuckDB connection with the helpers the loan SQL needs."""
+    con = duckdb.connect()
+
+    threads = threads or DUCKDB_THREADS
+    memory_limit = memory_limit or DUCKDB_MEMORY_LIMIT
+    temp_directory = temp_directory or DUCKDB_TEMP_DIRECTORY
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    if memory_limit:
+        con.execute(f"SET memory_limit = '{memory_limit}'")
+    if temp_directory:
+        con.execute(f"SET temp_directory = '{Path(temp_directory).as_posix()}'")
+
+    con.execute("CREATE MACRO cdmx(ts) AS timezone('America/Mexico_City', timezone('UTC', ts))")
+    con.create_function("py_round2", _py_round2, ["DOUBLE"], "DOUBLE", type="arrow")
+    return con
+
+
+def build_base_duckdb(con, staging_dir, base_path, previous_base_path=None, tax_rate=DEFAULT_TAX_RATE):
+    """
+    Build loan_base.parquet (one row per loan, before DaysLate/strategies).
+
+    With previous_base_path (incremental run), the staged pulls only cover the
+    changed users (staging_dir/changed_users.parquet): their loans are replaced
+    in the previous base and every other loan is kept as is.
+    Returns the number of loans written.
+    """
+    staging_dir = Path(staging_dir)
+    sources = {name: _parquet(staging_dir / f"{name}.parquet") for name in STAGED_SOURCES}
+    for name, types in PAYMENT_COLUMN_TYPES.items():
+        columns = ", ".join(f"CAST({column} AS {type_}) AS {column}" for column, type_ in types.items())
+        sources[f"{name}_typed"] = f"SELECT CAST(UserLoanId AS VARCHAR) AS UserLoanId, {columns} FROM {sources[name]}"
+    repayment_sql = REPAYMENT_IDS_SQL.format(
+        repayment=REPAYMENT_SQL.format(divisor=f"{1 + tax_rate!r}::DOUBLE", **sources)
+    )
+
+    if previous_base_path is None:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE base AS {repayment_sql}")
+    else:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE delta AS {repayment_sql}")
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE base AS
+            SELECT * FROM {_parquet(previous_base_path)}
+            WHERE UserId NOT IN (
+                SELECT CAST(UserId AS VARCHAR) FROM {_parquet(staging_dir / 'changed_users.parquet')}
+            )
+            AND UserLoanId NOT IN (SELECT UserLoanId FROM delta)
+            UNION ALL BY NAME
+            SELECT * FROM delta
+        """)
+
+    # base may be the file we just read from, so write next to it and swap
+    copy_to_parquet(con, "SELECT * FROM base", base_path)
+
+    loans = con.execute("SELECT count(*) FROM base").fetchone()[0]
+    print(f"🦆 {loans} loans written to {Path(base_path).name}")
+    return loans
+
+
+def build_final_duckdb(con, base_path, strategies_path, output_path, today=None, now_cdmx=None):
+    """
+    Build loan.parquet from loan_base.parquet: DaysLate + strategy columns.
+
+    today / now_cdmx are naive Timestamps (defaults: today, current Mexico City time).
+    """
+    today = today if today is not None else pd.Timestamp.now().normalize()
+    if now_cdmx is None:
+        now_cdmx = pd.Timestamp.now(tz="America/Mexico_City").tz_localize(None)
+
+    final_sql = FINAL_SQL.format(
+        base=_parquet(base_path),
+        strategies=Path(strategies_path).as_posix(),
+        today=_timestamp(today),
+        now_cdmx=_timestamp(now_cdmx),
+    )
+    # Compact label/flag/code types, as the pandas engine writes them
+    final_sql = typed_source_sql(con, final_sql)
+    copy_to_parquet(con, final_sql, output_path)
+    print(f"🦆 {Path(output_path).name} written")
+
+
+def build_loan_duckdb(
+    staging_dir,
+    strategies_path,
+    base_path,
+    output_path,
+    previous_base_path=None,
+    today=None,
+    now_cdmx=None,
+    tax_rate=DEFAULT_TAX_RATE,
+    con=None,
+):
+    """Build loan_base.parquet and loan.parquet from the staged raw pulls. Returns the loan count."""
+    con = con or connect()
+    loans = build_base_duckdb(con, staging_dir, base_path, previous_base_path, tax_rate)
+    build_final_duckdb(con, base_path, strategies_path, output_path, today, now_cdmx)
+    return loans
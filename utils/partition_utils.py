@@ -0,0 +1,94 @@
+"""
+Hash Partitioning Utility
+
+Splits a job into N independent buckets by hashing a key column (e.g. UserId),
+so each bucket fits in memory and can be processed in its own worker process.
+
+- parse_bytes: "4GB" -> 4294967296
+- parquet_memory_size: uncompressed size of Parquet files (footer metadata only)
+- choose_partitions: number of buckets that keeps the running workers inside a memory budget
+- bucket_filter: DuckDB predicate selecting one bucket
+- combine_parts: stream part files into one Parquet file (write_parquet_utils settings)
+"""
+
+import math
+import os
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.catalog_utils import record
+from utils.write_parquet_utils import parquet_settings, writer_options
+
+_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+
+
+def parse_bytes(value):
+    """Parse a size like '4GB', '512MB' or '1073741824' into bytes."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().upper().replace("IB", "B")
+    for unit in sorted(_UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[: -len(unit)].strip()) * _UNITS[unit])
+    return int(float(text))
+
+
+def parquet_memory_size(paths):
+    """Sum of the uncompressed row group sizes of the given Parquet files (missing files count 0)."""
+    total = 0
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        metadata = pq.ParquetFile(path).metadata
+        total += sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups))
+    return total
+
+
+def choose_partitions(data_bytes, memory_budget, workers, expansion):
+    """
+    Number of buckets so that `workers` buckets in flight fit in memory_budget.
+
+    data_bytes is the uncompressed input size; expansion is how much bigger a
+    bucket gets once loaded and transformed (pandas copies, object columns).
+    """
+    per_worker = parse_bytes(memory_budget) / max(1, workers)
+    return max(1, math.ceil(data_bytes * expansion / per_worker))
+
+
+def bucket_filter(column, n_buckets, bucket):
+    """DuckDB predicate for one bucket. The key is hashed as text, so int and string ids agree."""
+    return f"hash(CAST({column} AS VARCHAR)) % {int(n_buckets)} = {int(bucket)}"
+
+
+def combine_parts(part_paths, output_path):
+    """
+    Stream Parquet part files into output_path, one part in memory at a time.
+
+    Part schemas are unified first (a column that is all NULL in one bucket is
+    typed from the others). Written to a temp file and renamed on success,
+    with the codec/dictionary settings of output_path (rows keep part order).
+    Returns the number of rows written.
+    """
+    part_paths = [Path(path) for path in part_paths]
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    row_group_size = parquet_settings(output_path)["row_group_size"]
+
+    schema = pa.unify_schemas(
+        [pq.read_schema(path) for path in part_paths], promote_options="permissive"
+    )
+    rows = 0
+    try:
+        with pq.ParquetWriter(tmp_path, schema, **writer_options(output_path)) as writer:
+            for path in part_paths:
+                table = pq.read_table(path).select(schema.names).cast(schema)
+                writer.write_table(table, row_group_size=row_group_size)
+                rows += len(table)
+        os.replace(tmp_path, output_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    record(output_path)
+    return rows
@@ -0,0 +1,200 @@
+"""
+Materialized Rollup Utility
+
+Monthly rollup tables for dashboards, refreshed incrementally by
+create_duckdb.py. A rollup is declared as:
+
+    "rollup_loan_origination_monthly": {
+        "source": "fact_loan",
+        "month": "date_trunc('month', IssueDateCDMX)",   # rows with a NULL month are left out
+        "where": "LoanStatus != 6",                        # optional
+        "dimensions": {"LoanCohort": "LoanCohort"},        # name -> expression
+        "measures": {"Loans": "count(*)", "PrincipalAmount": decimal_sum("PrincipalAmount")},
+    }
+
+and materialized as a table with columns Month, <dimensions>, <measures>.
+
+Incremental refresh: each month of source rows has a fingerprint (row count
+and sum of row hashes) stored in meta.rollup_months. On refresh the
+fingerprints are recomputed (one hashing scan). Only months whose fingerprint
+changed, appeared or disappeared are deleted and re-aggregated. A new value in
+an ENUM source column widens the rollup column in place. A changed definition,
+a missing table, other changed column types or full=True rebuilds the rollup.
+"""
+
+import hashlib
+import json
+import time
+
+from utils.dwh_utils import MANIFEST_SCHEMA, quote
+
+ROLLUP_MONTHS_TABLE = f"{MANIFEST_SCHEMA}.rollup_months"
+ROLLUP_STATE_TABLE = f"{MANIFEST_SCHEMA}.rollup_state"
+
+
+def _ensure_state_tables(con):
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {MANIFEST_SCHEMA}")
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLUP_STATE_TABLE} (
+            rollup_name VARCHAR PRIMARY KEY,
+            definition_sha256 VARCHAR,
+            refreshed_at TIMESTAMP
+        )
+    """)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLUP_MONTHS_TABLE} (
+            rollup_name VARCHAR,
+            "Month" TIMESTAMP,
+            source_rows BIGINT,
+            fingerprint HUGEINT
+        )
+    """)
+
+
+def decimal_sum(expression):
+    """
+    Exact money sum, as in extract_payment_events.AGGREGATE_SQL: the result does
+    not depend on row order, so incremental and full refreshes agree exactly.
+    """
+    return f"CAST(sum(CAST({expression} AS DECIMAL(38, 4))) AS DOUBLE)"
+
+
+def definition_sha256(definition):
+    return hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+
+
+def _source_sql(definition):
+    where = f" AND ({definition['where']})" if definition.get("where") else ""
+    return (
+        f"SELECT ({definition['month']})::TIMESTAMP AS __month, src.* FROM {quote(definition['source'])} src "
+        f"WHERE ({definition['month']}) IS NOT NULL{where}"
+    )
+
+
+def _aggregate_sql(definition, month_filter=""):
+    dimensions = "".join(f", {expression} AS {quote(name)}" for name, expression in definition["dimensions"].items())
+    measures = ", ".join(f"{expression} AS {quote(name)}" for name, expression in definition["measures"].items())
+    return (
+        f'SELECT __month AS "Month"{dimensions}, {measures} '
+        f"FROM ({_source_sql(definition)}) src {month_filter} GROUP BY ALL"
+    )
+
+
+def is_current(con, name, definition):
+    """True when rollup table `name` exists and was built from this definition."""
+    _ensure_state_tables(con)
+    state = con.execute(
+        f"SELECT definition_sha256 FROM {ROLLUP_STATE_TABLE} WHERE rollup_name = ?", [name]
+    ).fetchone()
+    exists = con.execute(
+        "SELECT count(*) FROM duckdb_tables() WHERE schema_name = 'main' AND table_name = ?", [name]
+    ).fetchone()[0]
+    return bool(exists) and state is not None and state[0] == definition_sha256(definition)
+
+
+def _type_changes(con, name, definition):
+    """
+    {column: fresh type} of the ENUM columns of rollup `name` whose source ENUM
+    gained labels, or None when the rollup must be rebuilt (columns changed,
+    or a type changed in any other way).
+    """
+    stored = [column[:2] for column in con.execute(f"DESCRIBE {quote(name)}").fetchall()]
+    fresh = [column[:2] for column in con.execute(f"DESCRIBE {_aggregate_sql(definition)}").fetchall()]
+    if [column for column, _ in stored] != [column for column, _ in fresh]:
+        return None
+    changes = {}
+    for (column, stored_type), (_, fresh_type) in zip(stored, fresh):
+        if stored_type == fresh_type:
+            continue
+        if not (stored_type.startswith("ENUM(") and fresh_type.startswith("ENUM(")):
+            return None
+        stored_values, fresh_values = con.execute(
+            f"SELECT enum_range(NULL::{stored_type}), enum_range(NULL::{fresh_type})"
+        ).fetchone()
+        if not set(stored_values) <= set(fresh_values):
+            return None
+        changes[column] = fresh_type
+    return changes
+
+
+def refresh_rollup(con, name, definition, full=False):
+    """
+    Bring rollup table `name` up to date with its source. Runs in one
+    transaction. Returns a report dict (mode, months, recomputed, rows, seconds).
+    """
+    start = time.perf_counter()
+    sha = definition_sha256(definition)
+    type_changes = None if full or not is_current(con, name, definition) else _type_changes(con, name, definition)
+    rebuild = type_changes is None
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE rollup_fingerprints AS
+            SELECT __month AS "Month", count(*) AS source_rows, sum(hash(src))::HUGEINT AS fingerprint
+            FROM ({_source_sql(definition)}) src
+            GROUP BY ALL
+        """)
+        months = con.execute("SELECT count(*) FROM rollup_fingerprints").fetchone()[0]
+
+        if rebuild:
+            con.execute(f"CREATE OR REPLACE TABLE {quote(name)} AS {_aggregate_sql(definition)} ORDER BY ALL")
+            recomputed = months
+        else:
+            for column, type_ in type_changes.items():
+                con.execute(f"ALTER TABLE {quote(name)} ALTER {quote(column)} SET DATA TYPE {type_}")
+            # Months that are new, gone, or whose rows changed
+            con.execute(f"""
+                CREATE OR REPLACE TEMP TABLE rollup_changed AS
+                SELECT coalesce(n."Month", o."Month") AS "Month"
+                FROM rollup_fingerprints n
+                    FULL OUTER JOIN (SELECT * FROM {ROLLUP_MONTHS_TABLE} WHERE rollup_name = ?) o
+                    ON n."Month" = o."Month"
+                WHERE n.fingerprint IS DISTINCT FROM o.fingerprint OR n.source_rows IS DISTINCT FROM o.source_rows
+            """, [name])
+            recomputed = con.execute("SELECT count(*) FROM rollup_changed").fetchone()[0]
+            if recomputed:
+                con.execute(f'DELETE FROM {quote(name)} WHERE "Month" IN (SELECT "Month" FROM rollup_changed)')
+                con.execute(
+                    f"INSERT INTO {quote(name)} "
+                    + _aggregate_sql(definition, 'WHERE __month IN (SELECT "Month" FROM rollup_changed)')
+                )
+
+        con.execute(f"DELETE FROM {ROLLUP_MONTHS_TABLE} WHERE rollup_name = ?", [name])
+        con.execute(f"INSERT INTO {ROLLUP_MONTHS_TABLE} SELECT ?, * FROM rollup_fingerprints", [name])
+        con.execute(f"INSERT OR REPLACE INTO {ROLLUP_STATE_TABLE} VALUES (?, ?, now()::TIMESTAMP)", [name, sha])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    rows = con.execute(f"SELECT count(*) FROM {quote(name)}").fetchone()[0]
+    return {
+        "rollup": name,
+        "mode": "rebuild" if rebuild else "incremental",
+        "months": months,
+        "recomputed": recomputed,
+        "rows": rows,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def check_rollup(con, name, definition):
+    """Rows that differ between the rollup table and a from-scratch aggregate (0 when in sync)."""
+    fresh = _aggregate_sql(definition)
+    return con.execute(f"""
+        SELECT count(*) FROM (
+            (SELECT * FROM {quote(name)} EXCEPT ALL SELECT * FROM ({fresh}))
+            UNION ALL
+            (SELECT * FROM ({fresh}) EXCEPT ALL SELECT * FROM {quote(name)})
+        )
+    """).fetchone()[0]
+
+
+def forget_rollups(con, defined_names):
+    """Drop the refresh state of rollups that are no longer defined."""
+    _ensure_state_tables(con)
+    for table in (ROLLUP_STATE_TABLE, ROLLUP_MONTHS_TABLE):
+        con.execute(
+            f"DELETE FROM {table} WHERE NOT list_contains(?, rollup_name)", [list(defined_names)]
+        )
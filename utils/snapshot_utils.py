@@ -0,0 +1,252 @@
+"""
+Warehouse Snapshot Utility
+
+Point-in-time snapshots of the DuckDB warehouse as zstd Parquet files, one
+per table, instead of full copies of the database file:
+
+    db/snapshots/<YYYYmmdd_HHMMSS>/
+        snapshot.json              tables (DDL, rows, hashes), views, indexes, schemas
+        main.fact_loan.parquet
+        utc.fact_loan.parquet
+        ...
+
+A table whose content is unchanged since the previous snapshot is hard-linked
+to the previous file rather than written again. A table is known unchanged
+without reading it when its load-manifest entry (source sha256 + load mode) is
+the same; otherwise it is exported and the file hash is compared. Backup cost
+therefore scales with what changed.
+
+create_duckdb.py snapshots the warehouse before each build, so the newest
+snapshot is the state the build started from. Retention keeps the two newest
+snapshots (a same-day rerun does not prune the one before it) and the newest
+snapshot of each of the last N days and M weeks.
+
+Usage:
+    python -m utils.snapshot_utils list
+    python -m utils.snapshot_utils restore              # latest snapshot
+    python -m utils.snapshot_utils restore 20250101_020000
+"""
+
+import json
+import os
+import shutil
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import duckdb
+
+from utils.dwh_utils import MANIFEST_TABLE, file_sha256, publish_swap, quote
+
+DB_DIR = Path(__file__).parent.parent / "db"
+DB_PATH = DB_DIR / "empower_mx_dwh.duckdb"
+SNAPSHOT_DIR = Path(os.getenv("DWH_SNAPSHOT_DIR", DB_DIR / "snapshots"))
+SNAPSHOT_DAILY = int(os.getenv("DWH_SNAPSHOT_DAILY", "7"))
+SNAPSHOT_WEEKLY = int(os.getenv("DWH_SNAPSHOT_WEEKLY", "4"))
+
+SNAPSHOT_FILE = "snapshot.json"
+NAME_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def list_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    """Complete snapshot directories, oldest first."""
+    snapshot_dir = Path(snapshot_dir)
+    if not snapshot_dir.exists():
+        return []
+    return sorted(path for path in snapshot_dir.iterdir() if (path / SNAPSHOT_FILE).exists())
+
+
+def _read_snapshot(path):
+    with open(Path(path) / SNAPSHOT_FILE) as f:
+        return json.load(f)
+
+
+def _source_keys(con):
+    """{table_name: key} from the load manifest; the same key means the same table content."""
+    try:
+        rows = con.execute(f"SELECT table_name, sha256, load_mode FROM {MANIFEST_TABLE}").fetchall()
+    except duckdb.CatalogException:
+        return {}
+    return {name: f"{sha}:{mode}" for name, sha, mode in rows if sha}
+
+
+def take_snapshot(con, snapshot_dir=SNAPSHOT_DIR, name=None):
+    """
+    Snapshot every user table and view reachable from con. Returns the snapshot path.
+
+    Written to <name>.tmp and renamed when complete, so a crash never leaves a
+    snapshot that looks restorable.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    name = name or datetime.now().strftime(NAME_FORMAT)
+    final_path = snapshot_dir / name
+    tmp_path = snapshot_dir / f"{name}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    previous_path = (list_snapshots(snapshot_dir) or [None])[-1]
+    previous = _read_snapshot(previous_path)["tables"] if previous_path else {}
+    source_keys = _source_keys(con)
+
+    tables = con.execute("""
+        SELECT schema_name, table_name, sql FROM duckdb_tables()
+        WHERE database_name = current_database() AND NOT temporary
+        ORDER BY schema_name, table_name
+    """).fetchall()
+    views = con.execute("""
+        SELECT schema_name, view_name, sql FROM duckdb_views()
+        WHERE database_name = current_database() AND NOT internal AND NOT temporary
+        ORDER BY schema_name, view_name
+    """).fetchall()
+    indexes = con.execute("""
+        SELECT sql FROM duckdb_indexes()
+        WHERE database_name = current_database() AND sql IS NOT NULL
+        ORDER BY schema_name, index_name
+    """).fetchall()
+
+    entries, written, linked = {}, 0, 0
+    for schema, table, ddl in tables:
+        qualified = f"{schema}.{table}"
+        file_name = f"{qualified}.parquet"
+        target = tmp_path / file_name
+        entry = {"file": file_name, "ddl": ddl, "source_key": source_keys.get(table)}
+        before = previous.get(qualified)
+
+        if before and entry["source_key"] and before.get("source_key") == entry["source_key"] and before["ddl"] == ddl:
+            os.link(previous_path / before["file"], target)
+            entry.update(sha256=before["sha256"], rows=before["rows"])
+            linked += 1
+        else:
+            con.execute(
+                f"COPY {quote(schema)}.{quote(table)} TO '{target.as_posix()}' (FORMAT parquet, COMPRESSION zstd)"
+            )
+            entry["sha256"] = file_sha256(target)
+            entry["rows"] = con.execute(f"SELECT count(*) FROM {quote(schema)}.{quote(table)}").fetchone()[0]
+            if before and before["sha256"] == entry["sha256"]:
+                target.unlink()
+                os.link(previous_path / before["file"], target)
+                linked += 1
+            else:
+                written += 1
+        entries[qualified] = entry
+
+    schemas = sorted({schema for schema, _, _ in tables + views} - {"main"})
+    with open(tmp_path / SNAPSHOT_FILE, "w") as f:
+        json.dump(
+            {
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "schemas": schemas,
+                "tables": entries,
+                "views": [{"schema": s, "name": v, "sql": sql} for s, v, sql in views],
+                "indexes": [sql for (sql,) in indexes],
+            },
+            f,
+            indent=2,
+        )
+    os.replace(tmp_path, final_path)
+
+    size = sum(
+        (final_path / entry["file"]).stat().st_size for entry in entries.values()
+        if (final_path / entry["file"]).stat().st_nlink == 1
+    )
+    print(
+        f"📸 Snapshot {name}: {written} tables written ({size / 1024 ** 2:.1f} MB), "
+        f"{linked} unchanged tables linked, {len(views)} views"
+    )
+    return final_path
+
+
+def snapshots_to_keep(names, daily=SNAPSHOT_DAILY, weekly=SNAPSHOT_WEEKLY, now=None):
+    """
+    Names to retain: the newest snapshot of each of the last `daily` days and
+    of each of the last `weekly` ISO weeks, plus the two newest overall.
+    """
+    now = now or datetime.now()
+    dated = sorted(((datetime.strptime(name, NAME_FORMAT), name) for name in names), reverse=True)
+    keep = {name for _, name in dated[:2]}
+    days, weeks = set(), set()
+    for taken_at, name in dated:
+        day = taken_at.date()
+        week = taken_at.isocalendar()[:2]
+        if day > (now - timedelta(days=daily)).date() and day not in days:
+            days.add(day)
+            keep.add(name)
+        if taken_at > now - timedelta(weeks=weekly) and week not in weeks:
+            weeks.add(week)
+            keep.add(name)
+    return keep
+
+
+def prune_snapshots(snapshot_dir=SNAPSHOT_DIR, daily=SNAPSHOT_DAILY, weekly=SNAPSHOT_WEEKLY):
+    """Delete the snapshots outside the retention policy (and abandoned .tmp directories)."""
+    snapshot_dir = Path(snapshot_dir)
+    for abandoned in snapshot_dir.glob("*.tmp"):
+        shutil.rmtree(abandoned, ignore_errors=True)
+    snapshots = list_snapshots(snapshot_dir)
+    keep = snapshots_to_keep([path.name for path in snapshots], daily, weekly)
+    for path in snapshots:
+        if path.name not in keep:
+            shutil.rmtree(path)  # hard links keep files shared with retained snapshots
+            print(f"🧹 Deleted old snapshot: {path.name}")
+
+
+def restore_snapshot(name=None, db_path=DB_PATH, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Rebuild the warehouse from a snapshot (default: latest) into a new file
+    and swap it over db_path. The replaced file is kept as <db>.before_restore.
+    """
+    snapshots = list_snapshots(snapshot_dir)
+    if not snapshots:
+        raise FileNotFoundError(f"❌ No snapshots in {snapshot_dir}")
+    path = snapshots[-1] if name in (None, "latest") else Path(snapshot_dir) / name
+    snapshot = _read_snapshot(path)
+
+    db_path = Path(db_path)
+    restore_path = db_path.with_name(db_path.stem + ".restore.duckdb")
+    restore_path.unlink(missing_ok=True)
+    con = duckdb.connect(restore_path.as_posix())
+    try:
+        for schema in snapshot["schemas"]:
+            con.execute(f"CREATE SCHEMA IF NOT EXISTS {quote(schema)}")
+        for qualified, entry in snapshot["tables"].items():
+            schema, table = qualified.split(".", 1)
+            con.execute(entry["ddl"])
+            con.execute(
+                f"INSERT INTO {quote(schema)}.{quote(table)} "
+                f"SELECT * FROM read_parquet('{(path / entry['file']).as_posix()}')"
+            )
+            rows = con.execute(f"SELECT count(*) FROM {quote(schema)}.{quote(table)}").fetchone()[0]
+            if rows != entry["rows"]:
+                raise RuntimeError(f"❌ {qualified}: restored {rows} rows, snapshot has {entry['rows']}")
+        for sql in snapshot.get("indexes", []):
+            con.execute(sql)
+        for view in snapshot["views"]:
+            con.execute(view["sql"])
+        con.execute("CHECKPOINT")
+    finally:
+        con.close()
+
+    publish_swap(restore_path, db_path, db_path.with_name(db_path.stem + ".before_restore.duckdb"))
+    print(f"✅ Restored {len(snapshot['tables'])} tables and {len(snapshot['views'])} views from {path.name} into {db_path}")
+
+
+def _print_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    for path in list_snapshots(snapshot_dir):
+        snapshot = _read_snapshot(path)
+        files = [path / entry["file"] for entry in snapshot["tables"].values()]
+        own = sum(file.stat().st_size for file in files if file.stat().st_nlink == 1)
+        total = sum(file.stat().st_size for file in files)
+        print(
+            f"{path.name}  {len(files)} tables, {len(snapshot['views'])} views, "
+            f"{total / 1024 ** 2:.1f} MB ({own / 1024 ** 2:.1f} MB not shared)"
+        )
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "list":
+        _print_snapshots()
+    elif command == "restore":
+        restore_snapshot(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        sys.exit("Usage: python -m utils.snapshot_utils [list | restore [<snapshot>|latest]]")
@@ -0,0 +1,105 @@
+"""
+Collections Strategy Resolution
+
+Attaches collections strategies (data/collections_strategies.parquet) to the
+loan data set built by extract_loan_detail.py:
+- Latest post-DD strategy per loan (StrategyName, Strategy, ...)
+- IsPostDD flag
+- StrategyCreatedAt / StrategyCreatedAtCDMX
+- Pypper 20+ test assignment (LateStrategy*)
+
+The latest strategy is picked per loan BEFORE joining, so the loan frame is
+never blown up to one row per strategy assignment, and every column is
+computed with masks instead of row-wise apply.
+"""
+
+import pandas as pd
+
+# Strategies used after the due date
+POST_DD_STRATEGIES = [3, 4, 10, 11, 12, 13]
+# Strategies that on their own flag a loan as post-DD (CMD, Integra, Pypper)
+EXPLICIT_POST_DD_STRATEGIES = [3, 4, 13]
+# Moonflow strategies: creation date is replaced by the grace-period threshold
+MOONFLOW_STRATEGIES = [10, 11, 12]
+# Pypper 20+ test, reported separately as LateStrategy
+LATE_STRATEGY = 14
+# The only strategy rows resolve_collections_strategies looks at (read filter)
+USED_STRATEGIES = POST_DD_STRATEGIES + [LATE_STRATEGY]
+
+
+def latest_strategy_per_loan(strategies):
+    """Keep only the most recent post-DD strategy row per UserLoanId."""
+    postdd = strategies[strategies['Strategy'].isin(POST_DD_STRATEGIES)].copy()
+    postdd["CreatedAt"] = pd.to_datetime(postdd["CreatedAt"], errors="coerce")
+
+    # Latest CreatedAt first; rows without a date only win when a loan has nothing else
+    postdd = postdd.sort_values("CreatedAt", ascending=False, na_position="last", kind="stable")
+    return postdd.drop_duplicates(subset=["UserLoanId"], keep="first")
+
+
+def resolve_collections_strategies(repayment, strategies, now_cdmx=None):
+    """
+    Join the latest post-DD strategy and the Pypper 20+ assignment onto repayment.
+
+    strategies is the full collections_strategies.parquet frame (read once).
+    now_cdmx defaults to the current Mexico City time (naive).
+    """
+    loans_df = repayment.merge(latest_strategy_per_loan(strategies), on="UserLoanId", how="left")
+
+    # Make sure your datetime columns are proper datetimes (keeps tz if present)
+    loans_df["DueDate"] = pd.to_datetime(loans_df["DueDate"], errors="coerce")
+    loans_df["SettledAtCDMX"] = pd.to_datetime(loans_df["SettledAtCDMX"], errors="coerce")
+
+    # ========================================
+    # POST-DUE-DATE FLAG CALCULATION
+    # ========================================
+    # IsPostDD: Indicates loan entered post-due-date collections workflow
+    # A loan is post-DD if ANY of:
+    # 1. Explicitly assigned to post-DD strategy (3, 4, 13)
+    # 2. Past due AND settled after 30-hour grace period
+    # 3. Past due AND still unsettled after 30-hour grace period
+    #
+    # Grace period: DueDate (midnight) + 30 hours = ~6am next day
+
+    # Floor DueDate to start of day and add 30 hours
+    threshold = loans_df["DueDate"].dt.normalize() + pd.Timedelta(hours=30)
+
+    if now_cdmx is None:
+        now_cdmx = pd.Timestamp.now(tz="America/Mexico_City").tz_localize(None)
+
+    due = loans_df["DueDate"]
+    settled = loans_df["SettledAtCDMX"]
+
+    past_due = due < now_cdmx
+    settled_after_threshold = settled > threshold
+    over_30h_without_settlement = ((now_cdmx - due) > pd.Timedelta(hours=30)) & settled.isna()
+
+    loans_df["IsPostDD"] = (
+        loans_df["Strategy"].isin(EXPLICIT_POST_DD_STRATEGIES)
+        | (past_due & (settled_after_threshold | over_30h_without_settlement))
+    )
+
+    # Post-DD loans with no strategy date (or on Moonflow) start at the grace-period threshold
+    use_threshold = loans_df["IsPostDD"] & (
+        loans_df["CreatedAt"].isna() | loans_df["Strategy"].isin(MOONFLOW_STRATEGIES)
+    )
+    loans_df["StrategyCreatedAt"] = loans_df["CreatedAt"].mask(use_threshold, threshold)
+    loans_df["StrategyCreatedAtCDMX"] = loans_df["CreatedAtCDMX"].mask(use_threshold, threshold)
+
+    # object first: StrategyName is categorical when read from the compact-typed file
+    loans_df["StrategyName"] = loans_df["StrategyName"].astype(object).fillna("Twilio")
+
+    # Remove no needed columns
+    loans_df = loans_df.drop(columns=["CreatedAt", "CreatedAtCDMX", "IsDeleted", "StrategyType"])
+
+    # ADD PYPPER 20+ TEST
+    pypper = strategies[strategies['Strategy'] == LATE_STRATEGY]
+    pypper = pypper[['UserLoanId', 'Strategy', 'StrategyName', 'CreatedAt', 'CreatedAtCDMX']]
+    pypper = pypper.rename(columns={
+        'CreatedAt': 'LateStrategyCreatedAt',
+        'CreatedAtCDMX': 'LateStrategyCreatedAtCDMX',
+        'StrategyName': 'LateStrategyName',
+        'Strategy': 'LateStrategy',
+    })
+
+    return loans_df.merge(pypper, on="UserLoanId", how="left")
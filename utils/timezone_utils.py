@@ -0,0 +1,172 @@
+"""
+UTC → Mexico City Conversion Utility
+
+Converts naive UTC timestamps to naive America/Mexico_City wall-clock time
+without going through tz-aware dtypes (tz_localize → tz_convert → tz_localize).
+
+The zone's UTC offsets form a short table of intervals (Mexico City dropped
+DST in late 2022, so the last offset holds from then on). The table is built
+once from zoneinfo; conversion is one int64 searchsorted + add per column.
+
+Usage:
+    from utils.timezone_utils import add_cdmx_columns, utc_to_cdmx
+
+    df = add_cdmx_columns(df, ["CreatedAt", "ModifiedAt"])   # adds CreatedAtCDMX, ...
+    local = utc_to_cdmx(df["CreatedAt"])
+
+Check against zoneinfo (and time both paths):
+    python -m utils.timezone_utils
+"""
+
+import time
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+CDMX_TZ = "America/Mexico_City"
+
+# Range scanned for offset changes; outside it the first/last offset applies
+TABLE_START = "1850-01-01"
+TABLE_END = "2200-01-01"
+# Offsets are sampled once a week, then each change is located to the second
+# (assumes the zone never changes offset twice within a week; see check_against_zoneinfo)
+PROBE_STEP = 7 * 86400
+
+_NAT = np.iinfo(np.int64).min
+
+
+@lru_cache(maxsize=None)
+def offset_table(tz=CDMX_TZ):
+    """
+    Return (transitions, offsets) in seconds: offsets[i] applies to UTC epoch
+    seconds in [transitions[i - 1], transitions[i]); len(offsets) == len(transitions) + 1.
+    """
+    zone = ZoneInfo(tz)
+
+    def offset(epoch):
+        return int(datetime.fromtimestamp(epoch, zone).utcoffset().total_seconds())
+
+    start = int(pd.Timestamp(TABLE_START).timestamp())
+    end = int(pd.Timestamp(TABLE_END).timestamp())
+
+    transitions, offsets = [], [offset(start)]
+    for probe in range(start + PROBE_STEP, end + 1, PROBE_STEP):
+        current = offset(probe)
+        if current == offsets[-1]:
+            continue
+        # Bisect the change inside the last step: lo still has the old offset
+        lo, hi = probe - PROBE_STEP, probe
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if offset(mid) == offsets[-1]:
+                lo = mid
+            else:
+                hi = mid
+        transitions.append(hi)
+        offsets.append(current)
+
+    return np.array(transitions, dtype="int64"), np.array(offsets, dtype="int64")
+
+
+def utc_to_local(values, tz=CDMX_TZ):
+    """
+    Convert naive UTC datetimes to naive local time in tz.
+
+    values is a Series, Index or array; the result has the same type, unit,
+    index and name. NaT stays NaT. tz-aware input is converted from its zone.
+    """
+    if isinstance(values, (pd.Series, pd.Index)) and isinstance(values.dtype, pd.DatetimeTZDtype):
+        values = values.tz_convert("UTC").tz_localize(None) if isinstance(values, pd.Index) \
+            else values.dt.tz_convert("UTC").dt.tz_localize(None)
+    elif not np.issubdtype(getattr(values, "dtype", np.dtype(object)), np.datetime64):
+        values = pd.to_datetime(values, errors="coerce")
+
+    array = np.asarray(values)
+    unit, _ = np.datetime_data(array.dtype)
+    per_second = int(np.timedelta64(1, "s") / np.timedelta64(1, unit))
+
+    transitions, offsets = offset_table(tz)
+    transitions = transitions * per_second
+    i8 = array.view("int64")
+
+    # Rows after the last transition (nearly all of ours) need no lookup at all
+    if (i8 >= transitions[-1]).all():
+        local = i8 + offsets[-1] * per_second
+    else:
+        local = i8 + offsets[np.searchsorted(transitions, i8, side="right")] * per_second
+        local[i8 == _NAT] = _NAT
+    local = local.view(array.dtype)
+
+    if isinstance(values, pd.Series):
+        return pd.Series(local, index=values.index, name=values.name)
+    if isinstance(values, pd.Index):
+        return pd.DatetimeIndex(local, name=values.name)
+    return local
+
+
+def utc_to_cdmx(values):
+    """Naive UTC → naive Mexico City time (see utc_to_local)."""
+    return utc_to_local(values, CDMX_TZ)
+
+
+def add_cdmx_columns(df, columns, suffix="CDMX"):
+    """Add <column><suffix> with the Mexico City time of each naive UTC column. Returns df."""
+    for column in columns:
+        df[f"{column}{suffix}"] = utc_to_cdmx(df[column])
+    return df
+
+
+def _zoneinfo_reference(values, tz):
+    # The conversion this module replaces
+    return values.dt.tz_localize("UTC").dt.tz_convert(ZoneInfo(tz)).dt.tz_localize(None)
+
+
+def check_against_zoneinfo(tz=CDMX_TZ, seed=0):
+    """
+    Compare with zoneinfo: hourly from 1900 to 2100, every transition ±1s and
+    random instants, in ns and us units. Raises AssertionError on mismatch.
+    """
+    transitions, _ = offset_table(tz)
+    rng = np.random.default_rng(seed)
+
+    hourly = pd.date_range("1900-01-01", "2100-01-01", freq="h").asi8 // 10 ** 9
+    edges = (transitions[:, None] + np.arange(-1, 2)).ravel()
+    random = rng.integers(hourly[0], hourly[-1], 1_000_000)
+    epochs = np.concatenate([hourly, edges, random])
+
+    for unit in ("ns", "us"):
+        values = pd.Series(pd.to_datetime(epochs, unit="s").as_unit(unit))
+        values = pd.concat([values, pd.Series([pd.NaT], dtype=values.dtype)], ignore_index=True)
+        expected = _zoneinfo_reference(values, tz)
+        actual = utc_to_local(values, tz)
+        assert actual.dtype == values.dtype, f"unit changed: {actual.dtype}"
+        mismatched = ~((actual == expected) | (actual.isna() & expected.isna()))
+        assert not mismatched.any(), f"{mismatched.sum()} {unit} values differ:\n{values[mismatched].head()}"
+
+    # Exact per-second spot check straight from zoneinfo
+    zone = ZoneInfo(tz)
+    for epoch in np.concatenate([edges, rng.choice(random, 1000)]).tolist():
+        expected = datetime.fromtimestamp(epoch, zone).replace(tzinfo=None)
+        assert utc_to_local(pd.Series(pd.to_datetime([epoch], unit="s")), tz).iloc[0] == expected, epoch
+
+    print(f"✅ {tz}: offset table ({len(transitions)} transitions) matches zoneinfo on {len(epochs)} instants.")
+
+
+def _timing(n=5_000_000):
+    # 2023 onwards, like the extracts
+    values = pd.Series(pd.to_datetime(np.random.default_rng(0).integers(1.7e9, 1.8e9, n), unit="s"))
+    start = time.perf_counter()
+    _zoneinfo_reference(values, CDMX_TZ)
+    reference = time.perf_counter() - start
+    start = time.perf_counter()
+    utc_to_cdmx(values)
+    table = time.perf_counter() - start
+    print(f"⏱️ {n} timestamps: tz_localize/tz_convert {reference:.2f}s, offset table {table:.2f}s")
+
+
+if __name__ == "__main__":
+    check_against_zoneinfo()
+    _timing()
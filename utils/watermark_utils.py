@@ -0,0 +1,66 @@
+"""
+Extraction Watermark Utility
+
+Stores high-water marks for incremental extracts (e.g. the latest
+UserLoans.ModifiedAt already loaded) in data/watermarks.json, keyed by name.
+
+Usage:
+    from utils.watermark_utils import read_watermark, write_watermark, write_watermarks
+
+    since = read_watermark("fact_loan")          # None on first run
+    write_watermark("fact_loan", loans["ModifiedAt"].max())
+
+    # Marks that must move together: one write, all or none
+    write_watermarks({"fact_loan": loans_max, "fact_loan_payment_events": events_max})
+"""
+
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+DATA_DIR = Path(os.getenv("DATA_DIR", Path(__file__).parent.parent / "data"))
+WATERMARK_FILE = DATA_DIR / "watermarks.json"
+
+
+def _load_all():
+    if not WATERMARK_FILE.exists():
+        return {}
+    with open(WATERMARK_FILE, "r") as f:
+        return json.load(f)
+
+
+def read_watermark(name):
+    """Return the stored watermark as a Timestamp, or None if there is none."""
+    value = _load_all().get(name)
+    return pd.Timestamp(value) if value else None
+
+
+def write_watermark(name, value):
+    """Store a watermark (anything pd.Timestamp accepts). NaT/None leaves it unchanged."""
+    write_watermarks({name: value})
+
+
+def write_watermarks(values):
+    """
+    Store several watermarks ({name: value}) in one atomic write, so a crash
+    never leaves some of them advanced and the others not. NaT/None values
+    leave their watermark unchanged.
+    """
+    values = {name: value for name, value in values.items() if value is not None and not pd.isna(value)}
+    if not values:
+        return
+
+    watermarks = _load_all()
+    for name, value in values.items():
+        watermarks[name] = pd.Timestamp(value).isoformat()
+
+    # Write to a temp file first so a crash never leaves a half-written file
+    WATERMARK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = WATERMARK_FILE.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(watermarks, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, WATERMARK_FILE)
+    for name in values:
+        print(f"🔖 Watermark '{name}' set to {watermarks[name]}")